@@ -0,0 +1,89 @@
+"""
+Measure the per-request cost of building an :class:`potpy.wsgi.App` context as
+``default_context`` grows.
+
+Compares copying ``default_context`` into a fresh
+:class:`~potpy.context.Context` (the previous behaviour) with layering a
+:class:`~potpy.context.LayeredContext` over it. Reports the size of the
+per-request mapping once the request is done, which is what each request
+allocates, and requests per second through an app that routes by path and
+then by method, as apps read from a config file do.
+
+Usage::
+
+    $ python benchmarks/bench_app_context.py
+"""
+import sys
+from timeit import default_timer
+
+from potpy.context import Context
+from potpy.wsgi import App, PathRouter, MethodRouter
+
+
+SIZES = [0, 10, 50, 100, 500, 1000]
+
+
+def response(environ, start_response):
+    return []
+
+
+class CopyingApp(App):
+    def __call__(self, environ, start_response):
+        context = Context(
+            self.default_context,
+            environ=environ,
+            path_info=environ['PATH_INFO'],
+            request_method=environ['REQUEST_METHOD']
+        )
+        return context.inject(self.router)(environ, start_response)
+
+
+class CapturingRouter(MethodRouter):
+    """Keeps the context of the last request it routed."""
+    context = None
+
+    def _find(self, context, request_method):
+        self.context = context
+        return MethodRouter._find(self, context, request_method)
+
+
+def make_default_context(size):
+    default_context = dict(
+        ('provider%d' % (i,), lambda environ: environ)
+        for i in xrange(size)
+    )
+    default_context['request'] = lambda environ: environ
+    return default_context
+
+
+def rate(app, number):
+    environ = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+    start = default_timer()
+    for i in xrange(number):
+        app(environ, None)
+    return number / (default_timer() - start)
+
+
+def main(number=20000):
+    methods = CapturingRouter(('GET', lambda request: response))
+    router = PathRouter(('/', methods))
+    print '%6s %12s %12s %12s %12s' % (
+        'size', 'copy bytes', 'layer bytes', 'copy req/s', 'layer req/s')
+    for size in SIZES:
+        default_context = make_default_context(size)
+        environ = {'PATH_INFO': '/', 'REQUEST_METHOD': 'GET'}
+        copied = Context(default_context, environ=environ,
+                         path_info='/', request_method='GET')
+        layered = App(router, default_context)
+        layered(environ, None)
+        print '%6d %12d %12d %12.0f %12.0f' % (
+            size,
+            sys.getsizeof(copied),
+            sys.getsizeof(methods.context),
+            rate(CopyingApp(router, default_context), number),
+            rate(layered, number),
+        )
+
+
+if __name__ == '__main__':
+    main()
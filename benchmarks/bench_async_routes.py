@@ -0,0 +1,54 @@
+"""
+Run thousands of :class:`potpy.aio.AsyncRoute` calls concurrently on one
+event loop.
+
+Each route loads a value from a coroutine that waits ``DELAY`` seconds (a
+stand-in for network I/O), then formats it with a plain handler. Since the
+routes wait concurrently, the wall time should stay close to ``DELAY`` as the
+number of in-flight routes grows, where running them one after another would
+take ``routes * DELAY``.
+
+Usage::
+
+    $ python benchmarks/bench_async_routes.py
+"""
+from timeit import default_timer
+
+import trollius as asyncio
+from trollius import From, Return
+
+from potpy.aio import AsyncRoute
+from potpy.context import Context
+
+
+COUNTS = [1, 100, 1000, 5000, 10000]
+DELAY = 0.05
+
+
+@asyncio.coroutine
+def load(user_id):
+    yield From(asyncio.sleep(DELAY))
+    raise Return({'id': user_id})
+
+
+def present(user):
+    return 'user %(id)d' % user
+
+
+def main():
+    loop = asyncio.get_event_loop()
+    route = AsyncRoute((load, 'user'), present)
+    print '%8s %10s %12s %14s' % (
+        'routes', 'seconds', 'routes/s', 'sequential s')
+    for count in COUNTS:
+        calls = [route(Context(user_id=i)) for i in xrange(count)]
+        start = default_timer()
+        results = loop.run_until_complete(asyncio.gather(*calls))
+        elapsed = default_timer() - start
+        assert len(results) == count
+        print '%8d %10.3f %12.0f %14.1f' % (
+            count, elapsed, count / elapsed, count * DELAY)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Measure bulk classification of request paths (see
+:meth:`potpy.router.Router.classify_many`) against calling the router for
+each path, in one process and spread over worker processes.
+
+The router has 100 path templates with parameters, and the paths are spread
+evenly across them, with a few that match nothing. Worker processes only pay
+off with as many CPUs to run them on.
+
+Usage::
+
+    $ python benchmarks/bench_classify.py
+"""
+import random
+from timeit import default_timer
+
+from potpy.context import Context
+from potpy.wsgi import PathRouter
+
+
+ROUTES = 100
+PATHS = 200000
+PROCESSES = [2, 4]
+
+
+def handler():
+    return None
+
+
+def per_call(router, paths):
+    start = default_timer()
+    for path in paths:
+        router.try_route(Context(), path)
+    return default_timer() - start
+
+
+def bulk(router, paths, processes=None):
+    start = default_timer()
+    for result in router.classify_many(paths, processes):
+        pass
+    return default_timer() - start
+
+
+def main():
+    router = PathRouter(*[
+        ('/section%d/{slug}/{page:\d+}' % (i,), handler)
+        for i in xrange(ROUTES)
+    ])
+    rng = random.Random(0)
+    paths = [
+        '/section%d/post-%d/%d' % (rng.randrange(ROUTES + 5), i, i % 7)
+        for i in xrange(PATHS)
+    ]
+    baseline = per_call(router, paths)
+    print '%-20s %10s %10s %8s' % ('method', 'seconds', 'paths/s', 'speedup')
+    def report(name, elapsed):
+        print '%-20s %10.2f %10d %7.1fx' % (
+            name, elapsed, len(paths) / elapsed, baseline / elapsed)
+    report('try_route', baseline)
+    report('classify_many', bulk(router, paths))
+    for processes in PROCESSES:
+        report('classify_many x%d' % (processes,),
+               bulk(router, paths, processes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Measure PathRouter dispatch time against the number of routes, checking
+each template in turn and with one combined regular expression (see
+:attr:`potpy.wsgi.PathRouter.combined`).
+
+Each route has a template like ``/section17/{slug}``. Routers are asked for
+the last route (the worst case for a scan) and for a path no route matches.
+
+Usage::
+
+    $ python benchmarks/bench_combined_regex.py
+"""
+from timeit import default_timer
+
+from potpy.context import Context
+from potpy.wsgi import PathRouter
+
+
+SIZES = [10, 100, 500, 1000, 5000]
+
+
+def handler():
+    return None
+
+
+def latency(router, path, number):
+    try_route = router.try_route
+    try_route(Context(), path)  # build the index
+    start = default_timer()
+    for i in xrange(number):
+        try_route(Context(), path)
+    return (default_timer() - start) / number * 1e6
+
+
+def make_router(size, combined):
+    router = PathRouter(*[
+        ('/section%d/{slug}' % (i,), handler) for i in xrange(size)
+    ])
+    router.combined = combined
+    return router
+
+
+def main(number=2000):
+    print '%6s %-5s %10s %12s %8s' % (
+        'routes', 'path', 'scan us', 'combined us', 'speedup')
+    for size in SIZES:
+        scan = make_router(size, False)
+        combined = make_router(size, True)
+        for kind, path in [('last', '/section%d/foo' % (size - 1,)),
+                           ('miss', '/missing/foo')]:
+            before = latency(scan, path, number)
+            after = latency(combined, path, number)
+            print '%6d %-5s %10.2f %12.2f %7.1fx' % (
+                size, kind, before, after, before / after)
+
+
+if __name__ == '__main__':
+    main()
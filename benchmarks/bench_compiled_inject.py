@@ -0,0 +1,54 @@
+"""
+Compare generic and compiled :meth:`potpy.context.Context.inject` across
+handler arities.
+
+Each handler takes ``arity`` arguments, half plain values and half remembered
+callable items.
+
+Usage::
+
+    $ python benchmarks/bench_compiled_inject.py
+"""
+from timeit import default_timer
+
+from potpy.context import Context
+
+
+ARITIES = [0, 1, 2, 4, 8]
+
+
+def make_handler(arity):
+    args = ', '.join('arg%d' % (i,) for i in xrange(arity))
+    namespace = {}
+    exec 'def handler(%s):\n    pass\n' % (args,) in namespace
+    return namespace['handler']
+
+
+def make_context(arity, compiled):
+    context = Context()
+    for i in xrange(arity):
+        context['arg%d' % (i,)] = (lambda: None) if i % 2 else i
+    context.compiled = compiled
+    return context
+
+
+def rate(context, handler, number):
+    inject = context.inject
+    start = default_timer()
+    for i in xrange(number):
+        inject(handler)
+    return number / (default_timer() - start)
+
+
+def main(number=200000):
+    print '%6s %14s %14s %8s' % ('arity', 'generic/s', 'compiled/s', 'speedup')
+    for arity in ARITIES:
+        handler = make_handler(arity)
+        generic = rate(make_context(arity, False), handler, number)
+        compiled = rate(make_context(arity, True), handler, number)
+        print '%6d %14.0f %14.0f %7.1fx' % (
+            arity, generic, compiled, compiled / generic)
+
+
+if __name__ == '__main__':
+    main()
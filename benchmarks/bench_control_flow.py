@@ -0,0 +1,84 @@
+"""
+Compare raising :class:`potpy.router.Route.Stop` and
+:class:`potpy.router.Router.NoRoute` with their non-raising alternatives:
+returning a Stop instance from a handler, and
+:meth:`potpy.router.Router.try_route`.
+
+The last two rows serve 404s through :class:`potpy.wsgi.App`, once with the
+router wrapped in a function (so that misses are raised and caught) and once
+with the router itself (so that App uses ``try_route``).
+
+Usage::
+
+    $ python benchmarks/bench_control_flow.py
+"""
+from timeit import default_timer
+
+from potpy.context import Context
+from potpy.router import Route
+from potpy.wsgi import App, PathRouter
+
+
+def raise_stop():
+    raise Route.Stop('invalid')
+
+
+def return_stop():
+    return Route.Stop('invalid')
+
+
+def never():
+    return 'valid'
+
+
+def make_router():
+    return PathRouter(*[('/route/%d' % (i,), never) for i in xrange(10)])
+
+
+def start_response(status, headers):
+    pass
+
+
+def timed(func, number):
+    start = default_timer()
+    for i in xrange(number):
+        func()
+    return (default_timer() - start) / number * 1e6
+
+
+def main(number=50000):
+    context = Context()
+    raising = Route(raise_stop, never)
+    returning = Route(return_stop, never)
+    router = make_router()
+
+    def miss_raising():
+        try:
+            router(Context(), '/missing')
+        except router.NoRoute:
+            pass
+
+    def miss_returning():
+        router.try_route(Context(), '/missing')
+
+    environ = {'PATH_INFO': '/missing', 'REQUEST_METHOD': 'GET'}
+    wrapped = App(lambda context, path_info: router(context, path_info))
+    direct = App(router)
+
+    rows = [
+        ('stop', lambda: raising(context), lambda: returning(context)),
+        ('router miss', miss_raising, miss_returning),
+        ('app 404', lambda: wrapped(environ, start_response),
+         lambda: direct(environ, start_response)),
+    ]
+    print '%-12s %12s %14s %8s' % (
+        'case', 'raising us', 'returning us', 'speedup')
+    for label, slow, fast in rows:
+        before = timed(slow, number)
+        after = timed(fast, number)
+        print '%-12s %12.2f %14.2f %7.1fx' % (
+            label, before, after, before / after)
+
+
+if __name__ == '__main__':
+    main()
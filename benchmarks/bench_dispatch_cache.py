@@ -0,0 +1,86 @@
+"""
+Measure :class:`potpy.wsgi.PathRouter` dispatch time under skewed traffic,
+with and without a dispatch cache (see
+:attr:`potpy.router.Router.dispatch_cache`).
+
+The router has 50 path templates. Requests are drawn from 1000 distinct
+paths with Zipf-like frequencies, so a few paths make up most of the calls.
+The last row (marked *) makes the templates not cacheable (see
+:meth:`potpy.wsgi.PathRouter.cache_match`), so only the winning route is
+cached.
+
+Usage::
+
+    $ python benchmarks/bench_dispatch_cache.py
+"""
+import random
+from bisect import bisect_left
+from timeit import default_timer
+
+from potpy.cache import Cache
+from potpy.context import Context
+from potpy.wsgi import PathRouter
+
+
+ROUTES = 50
+PATHS = 1000
+SIZES = [None, 10, 100, 1000]
+
+
+def handler():
+    return None
+
+
+def make_router(cacheable=True):
+    router = PathRouter(*[
+        ('/section%d/{id:\\d+}' % (i,), handler) for i in xrange(ROUTES)])
+    for template, route in router.routes:
+        template.cacheable = cacheable
+    return router
+
+
+def make_paths(number):
+    rng = random.Random(0)
+    weights = [1.0 / (rank + 1) for rank in xrange(PATHS)]
+    paths = ['/section%d/%d' % (i % ROUTES, i) for i in xrange(PATHS)]
+    # popularity shouldn't depend on the position of the route
+    rng.shuffle(paths)
+    total = sum(weights)
+    cumulative = []
+    running = 0
+    for weight in weights:
+        running += weight / total
+        cumulative.append(running)
+    return [paths[min(bisect_left(cumulative, rng.random()), PATHS - 1)]
+            for i in xrange(number)]
+
+
+def latency(router, paths):
+    start = default_timer()
+    for path in paths:
+        router(Context(), path)
+    return (default_timer() - start) / len(paths) * 1e6
+
+
+def main(number=50000):
+    paths = make_paths(number)
+    print '%8s %10s %10s %8s' % ('maxsize', 'us/call', 'hit ratio', 'speedup')
+    baseline = None
+    for size, cacheable in [(size, True) for size in SIZES] + [
+            (SIZES[-1], False)]:
+        router = make_router(cacheable)
+        if size is not None:
+            router.dispatch_cache = Cache(maxsize=size)
+        elapsed = latency(router, paths)
+        if baseline is None:
+            baseline = elapsed
+        ratio = router.dispatch_cache and router.dispatch_cache.hit_ratio
+        print '%8s %10.2f %10s %7.1fx' % (
+            size and '%d%s' % (size, '' if cacheable else '*') or '-',
+            elapsed,
+            '-' if ratio is None else '%.2f' % (ratio,),
+            baseline / elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Measure router dispatch time against the number of routes, with and without
+an index (see :meth:`potpy.router.Router.index_key`).
+
+Each router matches exact string keys, and is asked for the route in the
+middle of the list.
+
+Usage::
+
+    $ python benchmarks/bench_dispatch_index.py
+"""
+from timeit import default_timer
+
+from potpy.context import Context
+from potpy.router import Router
+
+
+SIZES = [1, 10, 100, 1000]
+
+
+class ScanningRouter(Router):
+    def match(self, key, obj):
+        if key == obj:
+            return {}
+
+
+class IndexedRouter(ScanningRouter):
+    def index_key(self, key):
+        return key
+
+    def lookup_key(self, obj):
+        return obj
+
+
+def handler():
+    return None
+
+
+def latency(router, obj, number):
+    context = Context()
+    start = default_timer()
+    for i in xrange(number):
+        router(context, obj)
+    return (default_timer() - start) / number * 1e6
+
+
+def main(number=20000):
+    print '%6s %10s %12s %8s' % ('routes', 'scan us', 'indexed us', 'speedup')
+    for size in SIZES:
+        routes = [('key%d' % (i,), handler) for i in xrange(size)]
+        obj = 'key%d' % (size // 2,)
+        before = latency(ScanningRouter(*routes), obj, number)
+        after = latency(IndexedRouter(*routes), obj, number)
+        print '%6d %10.2f %12.2f %7.1fx' % (
+            size, before, after, before / after)
+
+
+if __name__ == '__main__':
+    main()
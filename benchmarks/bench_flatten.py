@@ -0,0 +1,65 @@
+"""
+Measure route latency against nesting depth, with and without
+:meth:`potpy.router.Route.flatten`.
+
+Two shapes are measured: routes nested directly in routes, and routes
+reached through a chain of :class:`potpy.wsgi.MethodRouter` instances (the
+shape of a ``PathRouter -> Route -> MethodRouter -> Route`` application).
+Each level runs one trivial handler.
+
+Usage::
+
+    $ python benchmarks/bench_flatten.py
+"""
+from timeit import default_timer
+
+from potpy.context import Context
+from potpy.router import Route
+from potpy.wsgi import MethodRouter
+
+
+DEPTHS = [1, 2, 4, 8, 16]
+
+
+def handler():
+    return None
+
+
+def nested_routes(depth):
+    route = Route(handler)
+    for i in xrange(depth - 1):
+        route = Route(handler, route)
+    return route
+
+
+def nested_routers(depth):
+    route = Route(handler)
+    for i in xrange(depth - 1):
+        route = Route(handler, MethodRouter(('GET', route)))
+    return route
+
+
+def latency(route, number):
+    context = Context(request_method='GET')
+    start = default_timer()
+    for i in xrange(number):
+        route(context)
+    return (default_timer() - start) / number * 1e6
+
+
+def main(number=20000):
+    print '%-8s %6s %12s %12s %8s' % (
+        'shape', 'depth', 'nested us', 'flat us', 'speedup')
+    for label, build in [('routes', nested_routes),
+                         ('routers', nested_routers)]:
+        for depth in DEPTHS:
+            before = latency(build(depth), number)
+            route = build(depth)
+            route.flatten()
+            after = latency(route, number)
+            print '%-8s %6d %12.2f %12.2f %7.1fx' % (
+                label, depth, before, after, before / after)
+
+
+if __name__ == '__main__':
+    main()
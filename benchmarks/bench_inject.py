@@ -0,0 +1,89 @@
+"""
+Measure :meth:`potpy.context.Context.inject` throughput.
+
+Compares the cached injection plan against the previous behaviour of
+inspecting the callable's signature on every call.
+
+Usage::
+
+    $ python benchmarks/bench_inject.py
+"""
+import inspect
+from timeit import default_timer
+
+from potpy.context import Context
+
+
+def legacy_argspec(obj):
+    if inspect.isfunction(obj):
+        return inspect.getargspec(obj)
+    if hasattr(obj, 'im_func'):
+        spec = legacy_argspec(obj.im_func)
+        del spec[0][0]
+        return spec
+    if inspect.isclass(obj):
+        if '__init__' not in obj.__dict__:
+            return [], [], None, None
+        return legacy_argspec(obj.__init__)
+    return legacy_argspec(obj.__call__)
+
+
+def legacy_inject(context, func, **kwargs):
+    args, varargs, keywords, defaults = legacy_argspec(func)
+    if defaults:
+        required_args = args[:-len(defaults)]
+        optional_args = args[len(required_args):]
+    else:
+        required_args = args
+        optional_args = []
+    values = [
+        kwargs[arg] if arg in kwargs else context[arg]
+        for arg in required_args
+    ]
+    if defaults:
+        values.extend(
+            kwargs[arg] if arg in kwargs else context.get(arg, default)
+            for arg, default in zip(optional_args, defaults)
+        )
+    return func(*values)
+
+
+def handler(foo, bar, baz=None):
+    return foo
+
+
+class Handler(object):
+    def __init__(self, foo, bar):
+        pass
+
+    def method(self, foo, bar, baz=None):
+        return foo
+
+
+CALLABLES = [
+    ('function', handler),
+    ('class', Handler),
+    ('bound method', Handler(1, 2).method),
+]
+
+
+def rate(func, number):
+    start = default_timer()
+    for i in xrange(number):
+        func()
+    return number / (default_timer() - start)
+
+
+def main(number=100000):
+    context = Context(foo=1, bar=2)
+    print '%-14s %14s %14s %8s' % (
+        'callable', 'before/s', 'after/s', 'speedup')
+    for label, func in CALLABLES:
+        before = rate(lambda: legacy_inject(context, func), number)
+        after = rate(lambda: context.inject(func), number)
+        print '%-14s %14.0f %14.0f %7.1fx' % (
+            label, before, after, after / before)
+
+
+if __name__ == '__main__':
+    main()
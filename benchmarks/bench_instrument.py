@@ -0,0 +1,42 @@
+"""
+Measure the overhead of route instrumentation.
+
+Calls a route of five trivial handlers without instruments, with a
+:class:`potpy.instrument.Collector` attached, and again after detaching it.
+
+Usage::
+
+    $ python benchmarks/bench_instrument.py
+"""
+from timeit import default_timer
+
+from potpy.context import Context
+from potpy.instrument import Collector
+from potpy.router import Route
+
+
+def handler(foo):
+    return foo
+
+
+def rate(route, number):
+    context = Context(foo=1)
+    start = default_timer()
+    for i in xrange(number):
+        route(context)
+    return number / (default_timer() - start)
+
+
+def main(number=50000):
+    route = Route(*[handler] * 5)
+    print '%-14s %14s' % ('instruments', 'routes/s')
+    print '%-14s %14.0f' % ('none', rate(route, number))
+    collector = Collector()
+    route.instrument(collector, 'bench')
+    print '%-14s %14.0f' % ('collector', rate(route, number))
+    route.uninstrument()
+    print '%-14s %14.0f' % ('detached', rate(route, number))
+
+
+if __name__ == '__main__':
+    main()
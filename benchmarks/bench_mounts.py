@@ -0,0 +1,70 @@
+"""
+Measure PathRouter dispatch time for an application made of sub-applications,
+routed by one flat list of full paths and by routers mounted under prefixes
+(see :meth:`potpy.wsgi.PathRouter.mount`).
+
+Each sub-application has 20 templated routes under its own prefix. Routers
+are asked for the last route of the last sub-application, with a
+:class:`~potpy.context.LayeredContext` over 100 default items, as
+:class:`potpy.wsgi.App` would pass them.
+
+Usage::
+
+    $ python benchmarks/bench_mounts.py
+"""
+import gc
+from timeit import default_timer
+
+from potpy.context import LayeredContext
+from potpy.wsgi import PathRouter
+
+
+APPS = [1, 5, 25, 100]
+ROUTES = 20
+
+DEFAULTS = dict(('provider%d' % (i,), lambda environ: environ)
+                for i in xrange(100))
+
+
+def handler():
+    return None
+
+
+def latency(router, path, number):
+    try_route = router.try_route
+    try_route(LayeredContext(DEFAULTS), path)  # build the index
+    gc.disable()
+    try:
+        start = default_timer()
+        for i in xrange(number):
+            try_route(LayeredContext(DEFAULTS), path)
+        return (default_timer() - start) / number * 1e6
+    finally:
+        gc.enable()
+
+
+def templates():
+    return ['/things%d/{id:\\d+}' % (i,) for i in xrange(ROUTES)]
+
+
+def main(number=2000):
+    print '%6s %7s %10s %12s %8s' % (
+        'apps', 'routes', 'flat us', 'mounted us', 'speedup')
+    for apps in APPS:
+        flat = PathRouter()
+        mounted = PathRouter()
+        for i in xrange(apps):
+            sub = PathRouter()
+            for template in templates():
+                flat.add('/app%d%s' % (i, template), handler)
+                sub.add(template, handler)
+            mounted.mount('/app%d' % (i,), sub)
+        path = '/app%d/things%d/42' % (apps - 1, ROUTES - 1)
+        before = latency(flat, path, number)
+        after = latency(mounted, path, number)
+        print '%6d %7d %10.2f %12.2f %7.1fx' % (
+            apps, apps * ROUTES, before, after, before / after)
+
+
+if __name__ == '__main__':
+    main()
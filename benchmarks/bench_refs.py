@@ -0,0 +1,77 @@
+"""
+Measure the cost of following :attr:`potpy.router.Route.previous` and
+:attr:`potpy.router.Route.context` references with 1, 3 and 6 level
+attribute chains.
+
+Compares the precompiled accessors against the previous behaviour of
+splitting the dotted name and calling ``getattr`` on every call.
+
+Usage::
+
+    $ python benchmarks/bench_refs.py
+"""
+from timeit import default_timer
+
+from potpy.context import Context
+from potpy.router import Route
+
+
+DEPTHS = [1, 3, 6]
+
+
+class Node(object):
+    pass
+
+
+def make_chain(depth):
+    root = obj = Node()
+    for i in xrange(depth):
+        setattr(obj, 'attr%d' % (i,), Node())
+        obj = getattr(obj, 'attr%d' % (i,))
+    return root, '.'.join('attr%d' % (i,) for i in xrange(depth))
+
+
+def legacy_previous(name):
+    def get(obj):
+        for part in name.split('.'):
+            obj = getattr(obj, part)
+        return obj
+    return get
+
+
+def legacy_context(key, name):
+    def get(context):
+        obj = context[key]
+        for part in name.split('.'):
+            obj = getattr(obj, part)
+        return obj
+    return get
+
+
+def rate(func, arg, number):
+    start = default_timer()
+    for i in xrange(number):
+        func(arg)
+    return number / (default_timer() - start)
+
+
+def main(number=200000):
+    print '%-10s %6s %14s %14s %8s' % (
+        'reference', 'depth', 'before/s', 'after/s', 'speedup')
+    for depth in DEPTHS:
+        root, name = make_chain(depth)
+        context = Context(root=root)
+        cases = [
+            ('previous', root, legacy_previous(name), Route.previous(name)),
+            ('context', context, legacy_context('root', name),
+             Route.context('root', name)),
+        ]
+        for label, arg, legacy, ref in cases:
+            before = rate(legacy, arg, number)
+            after = rate(ref, arg, number)
+            print '%-10s %6d %14.0f %14.0f %7.1fx' % (
+                label, depth, before, after, after / before)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Measure peak memory with many requests in flight, with and without releasing
+named results early (see :meth:`potpy.router.Route.prepare`).
+
+Each request loads a large payload, transforms it into a second payload of
+the same size, and then waits on a slow step while holding the result, the
+way a request waits on a client or a downstream service. Without release,
+both payloads stay in the context until the request ends.
+
+Each configuration runs in a fresh process, since peak RSS can't be reset.
+
+Usage::
+
+    $ python benchmarks/bench_release.py
+"""
+import resource
+import subprocess
+import sys
+import threading
+
+from potpy.context import Context
+from potpy.router import Route
+
+
+REQUESTS = 32
+PAYLOAD = 4 * 1024 * 1024
+
+
+def load():
+    return bytearray(PAYLOAD)
+
+
+def transform(payload):
+    return payload[::-1]
+
+
+def build(arrived, finish):
+    def wait(result):
+        arrived.release()
+        finish.wait()
+        return len(result)
+    return Route(
+        (load, 'payload'),
+        (transform, 'result'),
+        wait,
+    )
+
+
+def run(release):
+    arrived = threading.Semaphore(0)
+    finish = threading.Event()
+    route = build(arrived, finish)
+    route.prepare(release=release)
+    threads = [threading.Thread(target=route, args=(Context(),))
+               for i in xrange(REQUESTS)]
+    for thread in threads:
+        thread.start()
+    # hold every request at the slow step at once
+    for thread in threads:
+        arrived.acquire()
+    finish.set()
+    for thread in threads:
+        thread.join()
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def main():
+    if len(sys.argv) > 1:
+        print run(sys.argv[1] == 'release')
+        return
+    print '%d requests, %d MiB payloads' % (REQUESTS, PAYLOAD >> 20)
+    print '%-10s %14s' % ('mode', 'peak RSS MiB')
+    for mode in ['keep', 'release']:
+        peak = float(subprocess.check_output(
+            [sys.executable, __file__, mode]))
+        print '%-10s %14.1f' % (mode, peak)
+
+
+if __name__ == '__main__':
+    main()
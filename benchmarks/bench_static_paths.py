@@ -0,0 +1,60 @@
+"""
+Measure PathRouter dispatch time for static paths (templates without
+parameters), with and without the static path index (see
+:meth:`potpy.wsgi.PathRouter.index_key`), against the number of routes.
+
+Half the routes are templated and half are static, interleaved; routers are
+asked for the last static route.
+
+Usage::
+
+    $ python benchmarks/bench_static_paths.py
+"""
+import gc
+from timeit import default_timer
+
+from potpy.context import Context
+from potpy.wsgi import PathRouter
+
+
+SIZES = [10, 100, 1000]
+
+
+class ScanningPathRouter(PathRouter):
+    def index_key(self, template):
+        return None
+
+
+def handler():
+    return None
+
+
+def latency(router, path, number):
+    try_route = router.try_route
+    try_route(Context(), path)  # build the index
+    gc.disable()
+    try:
+        start = default_timer()
+        for i in xrange(number):
+            try_route(Context(), path)
+        return (default_timer() - start) / number * 1e6
+    finally:
+        gc.enable()
+
+
+def main(number=5000):
+    print '%6s %10s %12s %8s' % ('routes', 'scan us', 'indexed us', 'speedup')
+    for size in SIZES:
+        routes = []
+        for i in xrange(size // 2):
+            routes.append(('/items%d/{id:\\d+}' % (i,), handler))
+            routes.append(('/status%d' % (i,), handler))
+        path = '/status%d' % (size // 2 - 1,)
+        before = latency(ScanningPathRouter(*routes), path, number)
+        after = latency(PathRouter(*routes), path, number)
+        print '%6d %10.2f %12.2f %7.1fx' % (
+            size, before, after, before / after)
+
+
+if __name__ == '__main__':
+    main()
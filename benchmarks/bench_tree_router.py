@@ -0,0 +1,73 @@
+"""
+Measure path dispatch time against the number of routes, for PathRouter
+checking each template in turn, PathRouter with a combined regular
+expression (see :attr:`potpy.wsgi.PathRouter.combined`), and TreePathRouter.
+
+The routes look like a REST API: each resource has a collection, an item and
+an item action template, with segment parameters. Routers are asked for the
+last item route and for a path no route matches.
+
+Usage::
+
+    $ python benchmarks/bench_tree_router.py
+"""
+import gc
+from timeit import default_timer
+
+from potpy.context import Context
+from potpy.wsgi import PathRouter, TreePathRouter
+
+
+SIZES = [10, 100, 1000, 5000]
+
+
+def handler():
+    return None
+
+
+def latency(router, path, number):
+    try_route = router.try_route
+    try_route(Context(), path)  # build the index
+    gc.disable()    # as timeit does; big routers make collections slow
+    try:
+        start = default_timer()
+        for i in xrange(number):
+            try_route(Context(), path)
+        return (default_timer() - start) / number * 1e6
+    finally:
+        gc.enable()
+
+
+def make_router(cls, size, combined=False):
+    routes = []
+    for i in xrange(size // 3 + 1):
+        routes.extend([
+            ('/api/resource%d' % (i,), handler),
+            (('/api/resource%d/{id:\\d+}' % (i,), {'id': int}), handler),
+            ('/api/resource%d/{id:\\d+}/{action:[a-z]+}' % (i,), handler),
+        ])
+    router = cls(*routes[:size])
+    router.combined = combined
+    return router, routes[size - 1][0]
+
+
+def main(number=2000):
+    print '%6s %-5s %10s %12s %8s' % (
+        'routes', 'path', 'scan us', 'combined us', 'tree us')
+    for size in SIZES:
+        scan, last = make_router(PathRouter, size)
+        combined, last = make_router(PathRouter, size, True)
+        tree, last = make_router(TreePathRouter, size)
+        if isinstance(last, tuple):
+            last = last[0]
+        last = last.replace('{id:\\d+}', '42').replace(
+            '{action:[a-z]+}', 'edit')
+        for kind, path in [('last', last), ('miss', '/api/missing/42')]:
+            print '%6d %-5s %10.2f %12.2f %8.2f' % (
+                size, kind, latency(scan, path, number),
+                latency(combined, path, number),
+                latency(tree, path, number))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,458 @@
+"""
+This module provides coroutine support for use with :mod:`asyncio`, via the
+`trollius <https://pypi.python.org/pypi/trollius>`_ backport.
+
+Coroutines are written in the trollius style: decorate generator functions
+with ``@asyncio.coroutine``, wait with ``yield From(...)`` and return with
+``raise Return(...)``.
+"""
+import sys
+
+import trollius as asyncio
+from trollius import From, Return
+
+from .context import (get_plan, Lifetime, per_request, singleton, per_thread,
+                      _missing)
+from .router import (Route, _GuardedStep, _CachedStep, _NamedStep,
+                     _ParallelStep, _InstrumentedStep, _ReleasingStep,
+                     _RouterStep)
+
+
+def _is_awaitable(obj):
+    return asyncio.iscoroutine(obj) or isinstance(obj, asyncio.Future)
+
+
+def _stop_type(result):
+    # The type of a returned Route.Stop, reported to instruments as if it
+    # had been raised.
+    if type(result) is Route.Stop:
+        return Route.Stop
+    return None
+
+
+@asyncio.coroutine
+def _provide(context, key, provider):
+    try:
+        result = yield From(ainject(context, provider))
+    finally:
+        del context._pending[key]
+    context._remember(key, provider, result)
+    raise Return(result)
+
+
+@asyncio.coroutine
+def aget(context, key):
+    """Look up a context item, waiting for it if it is a coroutine.
+
+    The asynchronous counterpart of ``context[key]``. Callable items are
+    injected with :func:`ainject`, and remembered as they would be by
+    :class:`~potpy.context.Context`. While an item is being resolved, other
+    lookups of the same key wait for the same result rather than calling the
+    item again. The same goes for :class:`~potpy.context.singleton` and
+    :class:`~potpy.context.per_thread` items, which then keep the result of
+    that call, for synchronous lookups too (or call the provider again, if
+    it fails).
+    """
+    memo = context._memo
+    if key in memo:
+        raise Return(memo[key])
+    value = context._lookup(key, _missing)
+    if value is _missing:
+        if key != 'context':
+            raise KeyError(key)
+        raise Return(context._context_item())
+    if not callable(value):
+        raise Return(value)
+    if isinstance(value, (singleton, per_thread)):
+        result = yield From(_provide_shared(context, value))
+    elif isinstance(value, Lifetime) and not isinstance(value, per_request):
+        result = value.provide(context, key, lambda provider: (
+            asyncio.ensure_future(ainject(context, provider))))
+        if _is_awaitable(result):
+            result = yield From(asyncio.shield(result))
+    elif not isinstance(value, per_request) and (
+            not context.memoize or key in context.volatile_keys):
+        result = yield From(ainject(context, value))
+    else:
+        pending = context.__dict__.setdefault('_pending', {})
+        if key not in pending:
+            pending[key] = asyncio.ensure_future(
+                _provide(context, key, value))
+        result = yield From(asyncio.shield(pending[key]))
+    raise Return(result)
+
+
+@asyncio.coroutine
+def _provide_shared(context, lifetime):
+    # The result of a singleton or per_thread item. Lookups while the
+    # provider runs wait for the same call (in the same event loop), and its
+    # result is stored for synchronous lookups too.
+    result = lifetime._result()
+    if result is not _missing:
+        raise Return(result)
+    future = lifetime._pending()
+    if future is None or future.done() or \
+            future._loop is not asyncio.get_event_loop():
+        future = asyncio.ensure_future(ainject(context, lifetime.provider))
+        lifetime._set_pending(future)
+        def store(future):
+            if lifetime._pending() is future:
+                lifetime._set_pending(None)
+            if not future.cancelled() and future.exception() is None:
+                lifetime._store(future.result())
+        future.add_done_callback(store)
+    result = yield From(asyncio.shield(future))
+    raise Return(result)
+
+
+@asyncio.coroutine
+def _aget_default(context, key, default):
+    try:
+        result = yield From(aget(context, key))
+    except KeyError:
+        result = default
+    raise Return(result)
+
+
+@asyncio.coroutine
+def ainject(context, func, **kwargs):
+    """Inject arguments from a context into a callable, asynchronously.
+
+    Works like :meth:`potpy.context.Context.inject`, except that the
+    arguments are looked up with :func:`aget` all at once, so items that
+    don't depend on each other are resolved concurrently. If ``func``
+    returns a coroutine or future, it is waited for too.
+
+    Example::
+
+        >>> from potpy.context import Context
+        >>> @asyncio.coroutine
+        ... def user(user_id):
+        ...     yield From(asyncio.sleep(0))    # simulate a slow lookup
+        ...     raise Return('user %d' % (user_id,))
+        ...
+        >>> ctx = Context(user_id=1, user=user)
+        >>> loop = asyncio.get_event_loop()
+        >>> loop.run_until_complete(ainject(ctx, lambda user: user.upper()))
+        'USER 1'
+
+    :param context: The :class:`~potpy.context.Context` to take arguments
+        from.
+    :param func: The callable to inject arguments into.
+    :param \*\*kwargs: Specify values to override context items.
+    """
+    required, optional = get_plan(func)
+    lookups = []
+    for arg in required:
+        if arg not in kwargs:
+            lookups.append(aget(context, arg))
+    for arg, default in optional:
+        if arg not in kwargs:
+            lookups.append(_aget_default(context, arg, default))
+    if lookups:
+        found = iter((yield From(asyncio.gather(*lookups))))
+    values = [
+        kwargs[arg] if arg in kwargs else found.next()
+        for arg in required
+    ]
+    for arg, default in optional:
+        values.append(kwargs[arg] if arg in kwargs else found.next())
+    result = func(*values)
+    if _is_awaitable(result):
+        result = yield From(result)
+    raise Return(result)
+
+
+def _inject(context, func):
+    # Inject like ainject, but call func directly when each of its arguments
+    # is a plain value or a remembered result, so that a coroutine is only
+    # needed to wait for callable items.
+    required, optional = get_plan(func)
+    memo = context._memo
+    lookup = context._lookup
+    values = []
+    for arg in required:
+        if arg in memo:
+            value = memo[arg]
+        else:
+            value = lookup(arg, _missing)
+            if value is _missing or callable(value):
+                return ainject(context, func)
+        values.append(value)
+    for arg, default in optional:
+        if arg in memo:
+            value = memo[arg]
+        else:
+            value = lookup(arg, _missing)
+            if value is _missing and arg != 'context':
+                value = default
+            elif value is _missing or callable(value):
+                return ainject(context, func)
+        values.append(value)
+    return func(*values)
+
+
+# Steps for AsyncRoute. Plain results pass straight through; only awaitable
+# results are waited for in a coroutine.
+
+class _AsyncStep(object):
+    # Injects the handler of a basic step (see potpy.router._Step) with
+    # _inject.
+    __slots__ = ('step',)
+
+    def __init__(self, step):
+        self.step = step
+
+    def target(self, context, result):
+        return self.step.target(context, result)
+
+    def __call__(self, context, result):
+        return _inject(context, self.step.target(context, result))
+
+
+class _AsyncResolvingStep(object):
+    # ainject already resolves items in dependency order, so the resolution
+    # order isn't needed.
+    __slots__ = ('step', 'order')
+
+    def __init__(self, step, order):
+        self.step = step
+        self.order = order
+
+    def __call__(self, context, result):
+        return _inject(context, self.step.target(context, result))
+
+
+class _AsyncGuardedStep(_GuardedStep):
+    __slots__ = ()
+
+    def __call__(self, context, result):
+        handler = self.step.target(context, result)
+        try:
+            result = _inject(context, handler)
+        except Exception:
+            return self.handle(context, sys.exc_info())
+        if _is_awaitable(result):
+            return self._guard(context, result)
+        return result
+
+    @asyncio.coroutine
+    def _guard(self, context, result):
+        try:
+            result = yield From(result)
+        except Exception:
+            result = self.handle(context, sys.exc_info())
+            if _is_awaitable(result):
+                result = yield From(result)
+        raise Return(result)
+
+
+class _AsyncCachedStep(_CachedStep):
+    __slots__ = ()
+
+    def compute(self, context, result, values):
+        # Cache a future rather than a coroutine, so that it can be waited
+        # for more than once, and forget it if it fails.
+        result = self.step(context, result)
+        if _is_awaitable(result):
+            result = asyncio.ensure_future(result)
+            def discard(future):
+                if future.cancelled() or future.exception() is not None:
+                    self.cache._discard(self.handler, values, future)
+            result.add_done_callback(discard)
+        return result
+
+    def __call__(self, context, result):
+        values = tuple([context[key] for key in self.keys])
+        result = self.cache.get(
+            self.handler, values, self.compute, context, result, values)
+        if isinstance(result, asyncio.Future):
+            return asyncio.shield(result)
+        return result
+
+
+class _AsyncNamedStep(_NamedStep):
+    __slots__ = ()
+
+    def __call__(self, context, result):
+        result = self.step(context, result)
+        if _is_awaitable(result):
+            return self._name(context, result)
+        if type(result) is not Route.Stop:
+            context[self.name] = result
+        return result
+
+    @asyncio.coroutine
+    def _name(self, context, result):
+        result = yield From(result)
+        if type(result) is not Route.Stop:
+            context[self.name] = result
+        raise Return(result)
+
+
+class _AsyncReleasingStep(_ReleasingStep):
+    __slots__ = ()
+
+    def __call__(self, context, result):
+        result = self.step(context, result)
+        if _is_awaitable(result):
+            return self._release(context, result)
+        for key in self.keys:
+            context.pop(key, None)
+        return result
+
+    @asyncio.coroutine
+    def _release(self, context, result):
+        result = yield From(result)
+        for key in self.keys:
+            context.pop(key, None)
+        raise Return(result)
+
+
+class _AsyncInstrumentedStep(_InstrumentedStep):
+    __slots__ = ()
+
+    def __call__(self, context, result):
+        info = self.info
+        tokens = [instrument.before(info, context)
+                  for instrument in self.instruments]
+        try:
+            result = self.step(context, result)
+        except Exception:
+            self.after(context, tokens, sys.exc_info()[0])
+            raise
+        if _is_awaitable(result):
+            return self._await(context, tokens, result)
+        self.after(context, tokens, _stop_type(result))
+        return result
+
+    def after(self, context, tokens, exc_type):
+        if exc_type is None:
+            outcome = 'ok'
+        elif issubclass(exc_type, Route.Stop):
+            outcome = 'stop'
+        else:
+            outcome = 'error'
+        for instrument, token in zip(self.instruments, tokens):
+            instrument.after(self.info, context, token, outcome)
+
+    @asyncio.coroutine
+    def _await(self, context, tokens, result):
+        try:
+            result = yield From(result)
+        except BaseException:
+            self.after(context, tokens, sys.exc_info()[0])
+            raise
+        self.after(context, tokens, _stop_type(result))
+        raise Return(result)
+
+
+class _AsyncParallelStep(_ParallelStep):
+    __slots__ = ()
+
+    @asyncio.coroutine
+    def run(self, context):
+        results = []
+        tasks = {}
+        try:
+            for index, (name, member) in enumerate(self.members):
+                result = member(context, None)
+                if _is_awaitable(result):
+                    result = tasks[index] = asyncio.ensure_future(result)
+                results.append(result)
+            if tasks:
+                done, pending = yield From(asyncio.wait(
+                    tasks.values(), return_when=asyncio.FIRST_EXCEPTION))
+                for index in sorted(tasks):
+                    task = tasks[index]
+                    if task in done and task.exception() is not None:
+                        task.result()
+        finally:
+            for task in tasks.itervalues():
+                if not task.done():
+                    task.cancel()
+        for index in tasks:
+            results[index] = tasks[index].result()
+        for result in results:
+            if type(result) is Route.Stop:
+                raise Return(result)
+        for (name, member), result in zip(self.members, results):
+            context[name] = result
+        raise Return(tuple(results))
+
+
+class AsyncRoute(Route):
+    """
+    A :class:`~potpy.router.Route` whose handlers may be coroutines.
+
+    Calling the route returns a coroutine. Handlers (and exception handlers)
+    are called as in a :class:`~potpy.router.Route`; when one returns a
+    coroutine or future, it is waited for before the route moves on. Plain
+    handlers are called directly. :class:`~potpy.router.Route.Stop`,
+    :attr:`~potpy.router.Route.previous` and
+    :attr:`~potpy.router.Route.context` work as they do in a plain route.
+
+    Handlers are injected as by :func:`ainject`, so callable context items
+    may be coroutines too: they are waited for, and their results
+    remembered for later handlers. Handlers whose arguments are all plain
+    values or remembered results are called without a coroutine.
+
+    Example::
+
+        >>> from potpy.context import Context
+        >>> @asyncio.coroutine
+        ... def load(user_id):
+        ...     yield From(asyncio.sleep(0))    # simulate a slow lookup
+        ...     raise Return('user %d' % (user_id,))
+        ...
+        >>> route = AsyncRoute(
+        ...     (load, 'user'),
+        ...     lambda user: user.upper(),
+        ... )
+        >>> loop = asyncio.get_event_loop()
+        >>> loop.run_until_complete(route(Context(user_id=1)))
+        'USER 1'
+
+    To wrap a :class:`~potpy.router.Router`'s handlers in AsyncRoutes, set
+    its :attr:`~potpy.router.Router.route_class`; calling the router then
+    returns the route's coroutine.
+    """
+    _guarded_step = _AsyncGuardedStep
+    _resolving_step = _AsyncResolvingStep
+    _cached_step = _AsyncCachedStep
+    _named_step = _AsyncNamedStep
+    _parallel_step = _AsyncParallelStep
+    _instrumented_step = _AsyncInstrumentedStep
+    _releasing_step = _AsyncReleasingStep
+
+    def _handler_step(self, handler):
+        step = Route._handler_step(self, handler)
+        if isinstance(step, _RouterStep):
+            return step
+        return _AsyncStep(step)
+
+    @asyncio.coroutine
+    def __call__(self, context):
+        """Call the handlers in the route, in order, with the given context,
+        waiting for any that return coroutines or futures.
+        """
+        steps = self._steps
+        if steps is None:
+            steps = self.compile()
+        Stop = self.Stop
+        result = None
+        try:
+            for step in steps:
+                value = step(context, result)
+                if _is_awaitable(value):
+                    value = yield From(value)
+                if type(value) is Stop:
+                    break
+                result = value
+            else:
+                raise Return(result)
+        except Stop, value:
+            pass
+        if value.value is not value.NoValue:
+            result = value.value
+        raise Return(result)
@@ -0,0 +1,252 @@
+"""
+This module provides caching of handler results.
+
+A :class:`Cache` holds handler results keyed on the values of selected
+context items. Add a handler to a route with a cache to use it (see
+:meth:`potpy.router.Route.add`)::
+
+    >>> from potpy.context import Context
+    >>> from potpy.router import Route
+    >>> calls = []
+    >>> def load_todos(user_id):
+    ...     calls.append(user_id)
+    ...     return ['todo for user %d' % (user_id,)]
+    ...
+    >>> todos = Cache(keys=['user_id'], maxsize=100, ttl=60)
+    >>> route = Route()
+    >>> route.add(load_todos, 'todos', cache=todos)
+    >>> route(Context(user_id=1))
+    ['todo for user 1']
+    >>> route(Context(user_id=1))
+    ['todo for user 1']
+    >>> calls
+    [1]
+    >>> todos.hits, todos.misses
+    (1, 1)
+    >>> todos.hit_ratio
+    0.5
+
+Entries can be invalidated by handler, by key, or both::
+
+    >>> todos.invalidate(load_todos, (1,))
+    >>> len(todos)
+    0
+"""
+import threading
+import time
+from weakref import WeakKeyDictionary
+
+
+# Every live cache, for invalidate().
+_caches = WeakKeyDictionary()
+
+# Fields of the links in a cache's LRU list.
+_PREV, _NEXT, _KEY, _VALUE, _EXPIRES = range(5)
+
+
+class _Flight(object):
+    """A computation that concurrent misses for the same key wait for."""
+    __slots__ = ('running', 'ok', 'stale', 'value')
+
+    def __init__(self):
+        # held until the computation finishes; much cheaper than an Event
+        self.running = threading.Lock()
+        self.running.acquire()
+        self.ok = False
+        self.stale = False
+        self.value = None
+
+    def wait(self):
+        self.running.acquire()
+        self.running.release()
+
+
+class Cache(object):
+    """
+    A least-recently-used cache of handler results, with optional expiry.
+
+    Results are keyed on the handler and the values of the context items
+    named in ``keys``, which must be hashable. When several threads miss the
+    same key at once, the value is computed once and the others wait for it.
+    If the computation fails, nothing is cached and the waiting threads try
+    again themselves.
+
+    :param keys: The names of the context items to key results on.
+    :param maxsize: The most results to keep. When full, the least recently
+        used result is dropped. ``None`` for no limit.
+    :param ttl: Optional. The number of seconds a result is kept for.
+    :param timer: The clock used for expiry.
+
+    .. attribute:: hits
+
+        The number of lookups that found a result.
+
+    .. attribute:: misses
+
+        The number of lookups that computed a result.
+    """
+    def __init__(self, keys=(), maxsize=128, ttl=None, timer=time.time):
+        self.keys = tuple(keys)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._pending = {}
+        self._root = root = []
+        root[:] = [root, root, None, None, None]
+        _caches[self] = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_ratio(self):
+        """The fraction of lookups that found a result, or ``None`` if there
+        haven't been any.
+        """
+        lookups = self.hits + self.misses
+        if not lookups:
+            return None
+        return float(self.hits) / lookups
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _unlink(self, link):
+        link[_PREV][_NEXT] = link[_NEXT]
+        link[_NEXT][_PREV] = link[_PREV]
+        del self._entries[link[_KEY]]
+
+    def _store(self, key, value):
+        link = self._entries.get(key)
+        if link is not None:
+            self._unlink(link)
+        if self.maxsize is not None and self.maxsize <= 0:
+            return
+        expires = self.timer() + self.ttl if self.ttl is not None else None
+        root = self._root
+        last = root[_PREV]
+        link = [last, root, key, value, expires]
+        last[_NEXT] = root[_PREV] = self._entries[key] = link
+        if self.maxsize is not None and len(self._entries) > self.maxsize:
+            self._unlink(root[_NEXT])
+
+    def get(self, handler, values, func, *args):
+        """Look up a result, computing it on a miss.
+
+        :param handler: The handler the result belongs to.
+        :param values: A tuple of the values of :attr:`keys`.
+        :param func: Called with ``args`` to compute the result on a miss.
+        :returns: The cached or computed result.
+        """
+        key = (handler, values)
+        while True:
+            self._lock.acquire()
+            try:
+                link = self._entries.get(key)
+                if link is not None:
+                    if link[_EXPIRES] is None or \
+                            link[_EXPIRES] > self.timer():
+                        # move to the most recently used end
+                        link[_PREV][_NEXT] = link[_NEXT]
+                        link[_NEXT][_PREV] = link[_PREV]
+                        root = self._root
+                        last = link[_PREV] = root[_PREV]
+                        last[_NEXT] = root[_PREV] = link
+                        link[_NEXT] = root
+                        self.hits += 1
+                        return link[_VALUE]
+                    self._unlink(link)
+                flight = self._pending.get(key)
+                if flight is None:
+                    flight = self._pending[key] = _Flight()
+                    self.misses += 1
+                    break
+            finally:
+                self._lock.release()
+            flight.wait()
+            if flight.ok:
+                self._lock.acquire()
+                self.hits += 1
+                self._lock.release()
+                return flight.value
+        try:
+            value = func(*args)
+            self._lock.acquire()
+            try:
+                if not flight.stale:
+                    self._store(key, value)
+            finally:
+                self._lock.release()
+            flight.value = value
+            flight.ok = True
+        finally:
+            self._lock.acquire()
+            try:
+                del self._pending[key]
+            finally:
+                self._lock.release()
+            flight.running.release()
+        return value
+
+    def _discard(self, handler, values, value):
+        # Drop an entry, if it still holds the given value.
+        self._lock.acquire()
+        try:
+            link = self._entries.get((handler, values))
+            if link is not None and link[_VALUE] is value:
+                self._unlink(link)
+        finally:
+            self._lock.release()
+
+    def invalidate(self, handler=None, key=None):
+        """Drop cached results.
+
+        Results being computed when this is called are not cached.
+
+        :param handler: Optional. Only drop results of this handler.
+        :param key: Optional. Only drop results for this tuple of
+            :attr:`keys` values.
+        """
+        def matches(entry):
+            return (handler is None or entry[0] == handler) and (
+                key is None or entry[1] == key)
+        self._lock.acquire()
+        try:
+            for entry in [entry for entry in self._entries if matches(entry)]:
+                self._unlink(self._entries[entry])
+            for entry, flight in self._pending.iteritems():
+                if matches(entry):
+                    flight.stale = True
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Drop all cached results."""
+        self.invalidate()
+
+
+class cached(object):
+    """
+    Marks a route handler whose results are kept in a :class:`Cache`.
+
+    Created by :meth:`potpy.router.Route.add` when given a cache; there's
+    usually no need to use this class directly.
+    """
+    __slots__ = ('handler', 'cache')
+
+    def __init__(self, handler, cache):
+        self.handler = handler
+        self.cache = cache
+
+
+def invalidate(handler, key=None):
+    """Drop the results of a handler from every cache.
+
+    See :meth:`Cache.invalidate`.
+    """
+    for cache in _caches.keys():
+        cache.invalidate(handler, key)
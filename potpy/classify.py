@@ -0,0 +1,147 @@
+"""
+Count the requests in an access log that each route of a router would have
+handled, without calling any handlers (see
+:meth:`potpy.router.Router.classify_many`).
+
+Run it with the router to use, as ``module:name``, and any number of log
+files (standard input by default)::
+
+    $ python -m potpy.classify myapp.urls:router access.log
+       hits  route
+      10234  /posts/{slug}
+       1280  /
+         17  (no route)
+
+``name`` may also refer to a :class:`potpy.wsgi.App`, whose router is used.
+Paths are taken from the request line of Common or Combined Log Format
+lines, or from the start of lines that begin with ``/``. Query strings are
+dropped and escapes are decoded, as they are in ``PATH_INFO``. Other lines
+are skipped.
+
+Options:
+
+``-p N``, ``--processes N``
+    Spread the work over ``N`` worker processes.
+
+``-c N``, ``--chunksize N``
+    Send ``N`` paths to a worker at a time (default 1000).
+"""
+import re
+import sys
+from optparse import OptionParser
+from urllib import unquote
+
+
+_request_line = re.compile(r'"[A-Z]+ (\S+)[^"]*"')
+
+
+def read_paths(lines):
+    """Extract request paths from access log lines.
+
+        >>> list(read_paths([
+        ...     '127.0.0.1 - - [10/Oct/2000:13:55:36 -0700] '
+        ...     '"GET /posts/a%20b?page=2 HTTP/1.0" 200 2326',
+        ...     '/about 200',
+        ...     'garbage',
+        ... ]))
+        ['/posts/a b', '/about']
+    """
+    for line in lines:
+        m = _request_line.search(line)
+        if m is not None:
+            path = m.group(1)
+        elif line.startswith('/'):
+            path = line.split(None, 1)[0]
+        else:
+            continue
+        yield unquote(path.split('?', 1)[0])
+
+
+def count_hits(router, paths, processes=None, chunksize=1000):
+    """Count the paths each of a router's routes would handle.
+
+    :returns: A list of ``(hits, route name)`` tuples, busiest first, where
+        routes are named by :meth:`~potpy.router.Router.route_name`. Paths no
+        route matches are counted under ``None``. Routes without hits are
+        left out.
+
+        >>> from potpy.wsgi import PathRouter
+        >>> router = PathRouter(
+        ...     ('/', lambda: None),
+        ...     ('/posts/{slug}', lambda: None),
+        ... )
+        >>> count_hits(router, ['/posts/foo', '/', '/posts/bar', '/baz'])
+        [(2, '/posts/{slug}'), (1, '/'), (1, None)]
+    """
+    counts = {}
+    for index, params in router.classify_many(paths, processes, chunksize):
+        counts[index] = counts.get(index, 0) + 1
+    hits = []
+    for index, count in counts.iteritems():
+        if index is None:
+            name = None
+        else:
+            name = router.route_name(router.routes[index][0])
+        hits.append((count, name))
+    hits.sort(key=lambda hit: (-hit[0], hit[1] is None, hit[1]))
+    return hits
+
+
+def load_router(spec):
+    """Import a router given as ``module:name``."""
+    module_name, sep, name = spec.partition(':')
+    if not sep or not name:
+        raise ValueError('expected module:name, got %r' % (spec,))
+    __import__(module_name)
+    obj = sys.modules[module_name]
+    for part in name.split('.'):
+        obj = getattr(obj, part)
+    from .wsgi import App
+    if isinstance(obj, App):
+        obj = obj.router
+    return obj
+
+
+def _lines(filenames):
+    if not filenames:
+        filenames = ['-']
+    for filename in filenames:
+        if filename == '-':
+            for line in sys.stdin:
+                yield line
+            continue
+        f = open(filename)
+        try:
+            for line in f:
+                yield line
+        finally:
+            f.close()
+
+
+def main(argv=None, out=None):
+    """Run the command line interface."""
+    if out is None:
+        out = sys.stdout
+    parser = OptionParser(
+        usage='%prog [options] module:router [logfile ...]')
+    parser.add_option('-p', '--processes', type='int',
+                      help='number of worker processes')
+    parser.add_option('-c', '--chunksize', type='int', default=1000,
+                      help='paths sent to a worker at a time')
+    options, args = parser.parse_args(argv)
+    if not args:
+        parser.error('no router given')
+    try:
+        router = load_router(args[0])
+    except (ValueError, ImportError, AttributeError), exc:
+        parser.error('can\'t load router: %s' % (exc,))
+    hits = count_hits(router, read_paths(_lines(args[1:])),
+                      options.processes, options.chunksize)
+    out.write('%7s  %s\n' % ('hits', 'route'))
+    for count, name in hits:
+        out.write('%7d  %s\n' % (
+            count, '(no route)' if name is None else name))
+
+
+if __name__ == '__main__':
+    main()
@@ -44,6 +44,29 @@ following lines.
         ValidationError, BadFooError: show_foo_errors
         IOError: show_system_errors
 
+The results of a handler can be cached (see :mod:`potpy.cache`) by following
+it with ``cache(...)``, listing the context items to key results on, and
+optionally a ``maxsize`` and a ``ttl`` in seconds. Each handler line gets its
+own :class:`~potpy.cache.Cache`.
+
+::
+
+    read_foo (foo) cache(foo_id, maxsize=100, ttl=30)
+    list_foos (foos) cache(ttl=5):
+        IOError: show_system_errors
+
+A path ending with ``/*`` mounts a router under the rest of the path (see
+:meth:`potpy.wsgi.PathRouter.mount`). It is followed by URLs, indented, which
+are matched against the rest of the path, and may mount routers of their own.
+
+::
+
+    api /api/v{version:\d+}/* (version: int):
+        posts /posts:
+            views.list_posts
+        post /posts/{slug}:
+            views.show_post
+
 Complete Example::
 
     index /:
@@ -60,11 +83,16 @@ Complete Example::
         auth.require_admin (user)  # run this regardless of request_method
         * GET, HEAD:
             views.admin_console
+    api /api/*:
+        articles /articles:
+            * GET, HEAD:
+                api.list_articles
 """
 import re
 import sys
 from pkg_resources import resource_stream
 
+from .cache import Cache
 from .router import Route
 from .wsgi import PathRouter, MethodRouter
 
@@ -85,8 +113,11 @@ _method_name = '[^%s\x7f()<>@,;:\\\\"/[\]?={} \t%s]+' % (
 )
 _method_spec = re.compile(r'\*\s+(%s(?:,\s*%s)*):$' % (
     _method_name, _method_name))
-_handler_spec = re.compile(r'(%s)(?:\s+\((%s)\))?:?$' % (
-    _dotted_identifier, _identifier))
+_cache_spec = r'cache\(\s*(|%s(?:\s*,\s*%s)*)\s*\)' % (
+    r'%s(?:\s*=\s*[0-9.]+)?' % (_identifier,),
+    r'%s(?:\s*=\s*[0-9.]+)?' % (_identifier,))
+_handler_spec = re.compile(r'(%s)(?:\s+\((%s)\))?(?:\s+%s)?:?$' % (
+    _dotted_identifier, _identifier, _cache_spec))
 _exc_spec = re.compile(r'(%s(?:,\s*%s)*):\s*(%s)$' % (
     _dotted_identifier, _dotted_identifier, _dotted_identifier))
 
@@ -112,7 +143,32 @@ def parse_handler_spec(spec):
     m = _handler_spec.match(spec)
     if not m:
         raise SyntaxError('expecting handler spec')
-    return tuple(m.groups())
+    return m.group(1, 2)
+
+
+def parse_cache_spec(spec):
+    m = _handler_spec.match(spec)
+    if not m:
+        raise SyntaxError('expecting handler spec')
+    if m.group(3) is None:
+        return None
+    keys = []
+    options = {}
+    for arg in filter(None, (a.strip() for a in m.group(3).split(','))):
+        if '=' not in arg:
+            keys.append(arg)
+            continue
+        option, value = (s.strip() for s in arg.split('='))
+        try:
+            if option == 'maxsize':
+                options[option] = int(value)
+            elif option == 'ttl':
+                options[option] = float(value)
+            else:
+                raise SyntaxError('unknown cache option %r' % (option,))
+        except ValueError:
+            raise SyntaxError('bad value for cache option %r' % (option,))
+    return keys, options
 
 
 def parse_exception_handler_spec(spec):
@@ -196,10 +252,10 @@ def _calling_scope(depth=1):
     return scope
 
 
-def read_exception_handler_block(lines, module):
+def read_exception_handler_block(lines, module, handler_depth=2):
     exc_handlers = []
     for depth, line in lines:
-        if depth < 3:
+        if depth <= handler_depth:
             lines.back()
             break
         types, handler = parse_exception_handler_spec(line)
@@ -231,11 +287,16 @@ def read_handler_block(lines, module):
                 method_router = None
             handler, name = parse_handler_spec(line)
             handler = find_object(module, handler)
+            cache = parse_cache_spec(line)
+            if cache is not None:
+                keys, options = cache
+                cache = Cache(keys, **options)
             if line.endswith(':'):
-                exc_handlers = read_exception_handler_block(lines, module)
+                exc_handlers = read_exception_handler_block(
+                    lines, module, depth)
             else:
                 exc_handlers = ()
-            handlers.append((handler, name, exc_handlers))
+            handlers.append((handler, name, exc_handlers, cache))
     if method_router is not None:
         handlers.append(method_router)
     return handlers
@@ -269,12 +330,21 @@ def parse_config(lines, module=None):
     """
     if module is None:
         module = _calling_scope(2)
-    lines = IndentChecker(lines)
+    return read_path_block(IndentChecker(lines), module)
+
+
+def read_path_block(lines, module, path_depth=0):
     path_router = PathRouter()
     for depth, line in lines:
-        if depth > 0:
+        if depth < path_depth:
+            lines.back()
+            break
+        if depth > path_depth:
             raise SyntaxError('unexpected indent')
         name, path, types = parse_path_spec(line)
+        mount = path.endswith('/*')
+        if mount:
+            path = path[:-2]
         if types:
             template_arg = (path, dict(
                 (k, find_object(module, v))
@@ -282,8 +352,12 @@ def parse_config(lines, module=None):
             ))
         else:
             template_arg = path
-        handler = read_handler_block(lines, module)
-        path_router.add(name, template_arg, handler)
+        if mount:
+            router = read_path_block(lines, module, path_depth + 1)
+            path_router.mount(name, template_arg, router)
+        else:
+            handler = read_handler_block(lines, module)
+            path_router.add(name, template_arg, handler)
     return path_router
 
 
@@ -1,4 +1,341 @@
 import inspect
+import weakref
+import threading
+
+
+# Injection plans and compiled injectors, keyed weakly on the callable they
+# were built for (or on the underlying function for methods, whose bound
+# objects are transient).
+_plans = weakref.WeakKeyDictionary()
+_method_plans = weakref.WeakKeyDictionary()
+_injectors = weakref.WeakKeyDictionary()
+_method_injectors = weakref.WeakKeyDictionary()
+
+# Injector factories, keyed on the argument names they fetch.
+_injector_factories = {}
+
+_missing = object()
+
+
+def _get_argspec(obj):
+    if not callable(obj):
+        raise TypeError('%r is not callable' % (obj,))
+    if isinstance(obj, Lifetime):
+        return _get_argspec(obj.provider)
+    if inspect.isfunction(obj):
+        spec = inspect.getargspec(obj)
+        if not spec[0] and spec[1] and hasattr(obj, '__wrapped__'):
+            # a generic (*args, **kwargs) decorator that kept a reference to
+            # the function it wraps, such as @trollius.coroutine
+            return _get_argspec(obj.__wrapped__)
+        return spec
+    if hasattr(obj, 'im_func'):
+        spec = _get_argspec(obj.im_func)
+        del spec[0][0]
+        return spec
+    if inspect.isclass(obj):
+        if '__init__' not in obj.__dict__:
+            return [], [], None, None
+        return _get_argspec(obj.__init__)
+    return _get_argspec(obj.__call__)
+
+
+def _make_plan(obj):
+    args, varargs, keywords, defaults = _get_argspec(obj)
+    if defaults:
+        required = tuple(args[:-len(defaults)])
+        optional = tuple(zip(args[len(required):], defaults))
+    else:
+        required = tuple(args)
+        optional = ()
+    return required, optional
+
+
+def get_plan(obj):
+    """Return the injection plan for a callable.
+
+    The plan is a ``(required, optional)`` tuple, where ``required`` is a
+    tuple of argument names and ``optional`` is a tuple of ``(name,
+    default)`` pairs. Plans are computed once per callable and cached for as
+    long as the callable is alive:
+
+        >>> def func(foo, bar=42):
+        ...     pass
+        ...
+        >>> get_plan(func)
+        (('foo',), (('bar', 42),))
+        >>> get_plan(func) is get_plan(func)
+        True
+
+    Callables that cannot be weakly referenced (or hashed) are supported, but
+    their plans are recomputed on every call.
+    """
+    return _cached(obj, _plans, _method_plans, _make_plan)
+
+
+def _cached(obj, cache, method_cache, make):
+    key = getattr(obj, 'im_func', None)
+    if key is None:
+        key = obj
+    else:
+        cache = method_cache
+    try:
+        return cache[key]
+    except (KeyError, TypeError):
+        pass
+    value = make(obj)
+    try:
+        cache[key] = value
+    except TypeError:
+        pass
+    return value
+
+
+_required_arg = """
+        if %(key)r in _memo:
+            _a%(i)d = _memo[%(key)r]
+        else:
+            _a%(i)d = _lookup(%(key)r, _missing)
+            if _a%(i)d is _missing or _callable(_a%(i)d):
+                _a%(i)d = _context[%(key)r]"""
+
+_optional_arg = """
+        if %(key)r in _memo:
+            _a%(i)d = _memo[%(key)r]
+        else:
+            _a%(i)d = _lookup(%(key)r, _missing)
+            if _a%(i)d is _missing:
+                _a%(i)d = _d%(i)d
+            elif _callable(_a%(i)d):
+                try:
+                    _a%(i)d = _context[%(key)r]
+                except KeyError:
+                    _a%(i)d = _d%(i)d"""
+
+_context_arg = """
+        _a%(i)d = _context['context']"""
+
+
+def _make_injector_factory(required, optional):
+    lines = ['def _factory(_defaults):']
+    if optional:
+        lines.append('    %s, = _defaults' % (', '.join(
+            '_d%d' % (i,) for i in xrange(len(required), len(required) +
+                                         len(optional))),))
+    lines.extend([
+        '    def inject(_context, _func):',
+        '        _memo = _context._memo',
+        '        _lookup = _context._lookup',
+    ])
+    for i, key in enumerate(required + optional):
+        if key == 'context':
+            template = _context_arg
+        elif i < len(required):
+            template = _required_arg
+        else:
+            template = _optional_arg
+        lines.append(template % {'i': i, 'key': key})
+    lines.extend([
+        '        return _func(%s)' % (', '.join(
+            '_a%d' % (i,) for i in xrange(len(required) + len(optional))),),
+        '    return inject',
+    ])
+    namespace = {'_missing': _missing, '_callable': callable}
+    exec '\n'.join(lines) in namespace
+    return namespace['_factory']
+
+
+def _make_injector(obj):
+    required, optional = get_plan(obj)
+    shape = (required, tuple(arg for arg, default in optional))
+    try:
+        factory = _injector_factories[shape]
+    except KeyError:
+        factory = _injector_factories[shape] = _make_injector_factory(*shape)
+    return factory(tuple(default for arg, default in optional))
+
+
+def get_injector(obj):
+    """Return a compiled injector for a callable.
+
+    The injector is a function generated for the callable's injection plan
+    (see :func:`get_plan`), which takes a :class:`Context` and the callable,
+    and calls the callable with exactly the arguments it needs. Non-callable
+    items are fetched directly from the context without going through
+    :meth:`Context.__getitem__`. Injectors are cached like plans, and the
+    generated code is shared between callables whose arguments have the same
+    names:
+
+        >>> def func(foo, bar=42):
+        ...     return foo, bar
+        ...
+        >>> get_injector(func)(Context(foo='foo'), func)
+        ('foo', 42)
+
+    Used by :meth:`Context.inject` when :attr:`Context.compiled` is on.
+    """
+    return _cached(obj, _injectors, _method_injectors, _make_injector)
+
+
+class Lifetime(object):
+    """
+    Base class for context item lifetimes.
+
+    A lifetime wraps a provider (a callable context item), and decides when
+    the provider is called and how long its result is kept. Subclasses
+    implement :meth:`provide`. Lifetimes can be injected like the provider
+    they wrap.
+
+    :param provider: The callable context item.
+    """
+    def __init__(self, provider):
+        self.provider = provider
+
+    def __call__(self, *args):
+        return self.provider(*args)
+
+    def provide(self, context, key, build):
+        """Return the value of the context item.
+
+        :param context: The :class:`Context` the item is being looked up in.
+        :param key: The key the item is being looked up by.
+        :param build: Call this with :attr:`provider` to call the provider,
+            injected from ``context``.
+        """
+        raise NotImplementedError()
+
+
+class volatile(Lifetime):
+    """
+    Mark a callable context item to be called on every lookup.
+
+    By default a :class:`Context` calls each callable item at most once and
+    remembers the result. Wrap a provider in ``volatile`` to opt out of this:
+
+        >>> from itertools import count
+        >>> counter = count()
+        >>> ctx = Context(n=volatile(lambda: counter.next()))
+        >>> ctx['n'], ctx['n']
+        (0, 1)
+    """
+    def provide(self, context, key, build):
+        return build(self.provider)
+
+
+class per_request(Lifetime):
+    """
+    Mark a callable context item to be called at most once per context.
+
+    This is what a :class:`Context` does by default, but items marked
+    ``per_request`` are remembered even when :attr:`Context.memoize` is off
+    or their key is in :attr:`Context.volatile_keys`.
+    """
+    def provide(self, context, key, build):
+        result = build(self.provider)
+        context._remember(key, self, result)
+        return result
+
+
+class singleton(Lifetime):
+    """
+    Mark a callable context item to be called at most once per process.
+
+    The provider is called the first time the item is looked up, injected
+    from whichever context looked it up, and its result is shared by every
+    context from then on. Construction is thread-safe: concurrent first
+    lookups wait for a single call to the provider. If the provider raises,
+    the next lookup calls it again.
+
+        >>> from itertools import count
+        >>> counter = count()
+        >>> defaults = {'n': singleton(lambda: counter.next())}
+        >>> Context(defaults)['n'], Context(defaults)['n']
+        (0, 0)
+
+    .. note::
+
+        A singleton keeps whatever it was injected with the first time, so it
+        should only depend on items that are themselves singletons or plain
+        values.
+    """
+    def __init__(self, provider):
+        Lifetime.__init__(self, provider)
+        self._lock = threading.RLock()
+        self._value = _missing
+
+    def provide(self, context, key, build):
+        value = self._value
+        if value is _missing:
+            self._lock.acquire()
+            try:
+                value = self._value
+                if value is _missing:
+                    value = self._value = build(self.provider)
+            finally:
+                self._lock.release()
+        return value
+
+    def reset(self):
+        """Forget the provider's result, so it will be called again."""
+        self._value = _missing
+
+    # For potpy.aio.aget, which waits for the provider without holding the
+    # lock: the result, or _missing; the future of the call in progress; and
+    # storing them.
+    _future = None
+
+    def _result(self):
+        return self._value
+
+    def _store(self, value):
+        self._value = value
+
+    def _pending(self):
+        return self._future
+
+    def _set_pending(self, future):
+        self._future = future
+
+
+class per_thread(Lifetime):
+    """
+    Mark a callable context item to be called at most once per thread.
+
+    Like :class:`singleton`, but each thread gets its own result. Useful for
+    objects that are expensive to build but not safe to share between
+    threads, such as some database connections.
+    """
+    def __init__(self, provider):
+        Lifetime.__init__(self, provider)
+        self._local = threading.local()
+
+    def provide(self, context, key, build):
+        try:
+            return self._local.value
+        except AttributeError:
+            value = self._local.value = build(self.provider)
+            return value
+
+    def reset(self):
+        """Forget the provider's result in the calling thread."""
+        try:
+            del self._local.value
+        except AttributeError:
+            pass
+
+    # See singleton.
+
+    def _result(self):
+        return getattr(self._local, 'value', _missing)
+
+    def _store(self, value):
+        self._local.value = value
+
+    def _pending(self):
+        return getattr(self._local, 'future', None)
+
+    def _set_pending(self, future):
+        self._local.future = future
 
 
 class Context(dict):
@@ -27,6 +364,33 @@ class Context(dict):
             >>> Context(foo=lambda: 42)['foo']
             42
 
+    Each callable item is called at most once per context, and its result is
+    remembered for later lookups:
+
+    >>> from itertools import count
+    >>> counter = count()
+    >>> ctx = Context(n=lambda: counter.next())
+    >>> ctx['n'], ctx['n']
+    (0, 0)
+
+    A remembered result is forgotten when the item, or any item it was
+    injected with, is changed:
+
+    >>> ctx = Context(foo=lambda bar: bar.upper(), bar='qux')
+    >>> ctx['foo']
+    'QUX'
+    >>> ctx['bar'] = 'quux'
+    >>> ctx['foo']
+    'QUUX'
+
+    Items whose keys are listed in :attr:`volatile_keys`, or that are wrapped
+    in :class:`volatile`, are called on every lookup instead. Setting
+    :attr:`memoize` to ``False`` turns remembering off altogether.
+
+    Items can also be wrapped in :class:`singleton` or :class:`per_thread`,
+    to share their results between contexts, or :class:`per_request`. See
+    :class:`Lifetime`.
+
     Contexts have ``'context'`` as an implicit a member, so callables can
     refer to the context itself:
 
@@ -55,56 +419,290 @@ class Context(dict):
             >>> ctx.inject(lambda n: int(n))
             42
     """
-    def _get_argspec(self, obj):
-        if not callable(obj):
-            raise TypeError('%r is not callable' % (obj,))
-        if inspect.isfunction(obj):
-            return inspect.getargspec(obj)
-        if hasattr(obj, 'im_func'):
-            spec = self._get_argspec(obj.im_func)
-            del spec[0][0]
-            return spec
-        if inspect.isclass(obj):
-            if '__init__' not in obj.__dict__:
-                return [], [], None, None
-            return self._get_argspec(obj.__init__)
-        return self._get_argspec(obj.__call__)
+    #: Remember the results of callable items (see above).
+    memoize = True
+
+    #: Keys of callable items that should be called on every lookup.
+    volatile_keys = frozenset()
+
+    #: Use compiled injectors (see :func:`get_injector`) in :meth:`inject`
+    #: when no keyword arguments are given. Subclasses that override
+    #: :meth:`__getitem__` should leave this off, since compiled injectors
+    #: bypass it for non-callable items.
+    compiled = False
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._memo = {}
+        self._dependents = {}
 
     def __getitem__(self, key):
-        if key == 'context':
-            value = dict.get(self, key, self)
-        else:
-            value = dict.__getitem__(self, key)
-        if callable(value):
+        memo = self._memo
+        if key in memo:
+            return memo[key]
+        value = self._lookup(key, _missing)
+        if value is _missing:
+            if key != 'context':
+                raise KeyError(key)
+            return self._context_item()
+        if not callable(value):
+            return value
+        if isinstance(value, Lifetime):
+            return value.provide(self, key, self.inject)
+        if not self.memoize or key in self.volatile_keys:
             return self.inject(value)
+        result = self.inject(value)
+        self._remember(key, value, result)
+        return result
+
+    _lookup = dict.get
+
+    def _context_item(self):
+        # The value of the implicit 'context' item.
+        return self
+
+    def _remember(self, key, provider, result):
+        self._memo[key] = result
+        required, optional = get_plan(provider)
+        dependents = self._dependents
+        for arg in required:
+            dependents.setdefault(arg, []).append(key)
+        for arg, default in optional:
+            dependents.setdefault(arg, []).append(key)
+
+    def _forget(self, key):
+        memo = self._memo
+        if not memo:
+            return
+        dependents = self._dependents
+        keys = [key, 'context']
+        while keys:
+            key = keys.pop()
+            memo.pop(key, None)
+            keys.extend(dependents.pop(key, ()))
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._forget(key)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._forget(key)
+
+    def update(self, *args, **kwargs):
+        items = dict(*args, **kwargs)
+        dict.update(self, items)
+        if self._memo:
+            for key in items:
+                self._forget(key)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self._lookup(key)
+
+    def pop(self, key, *args):
+        value = dict.pop(self, key, *args)
+        self._forget(key)
         return value
 
+    def popitem(self):
+        key, value = dict.popitem(self)
+        self._forget(key)
+        return key, value
+
+    def clear(self):
+        dict.clear(self)
+        self._memo.clear()
+        self._dependents.clear()
+
     def get(self, key, default=None):
         try:
             return self[key]
         except KeyError:
             return default
 
+    def __reduce__(self):
+        # Unpickling sets items before restoring attributes, so leave the
+        # remembered results out and let __init__ start afresh.
+        state = self.__dict__.copy()
+        del state['_memo'], state['_dependents']
+        return type(self), (), state, None, dict.iteritems(self)
+
+    def resolve(self, keys):
+        """Look up each of the given keys, in order.
+
+        Call this with a resolution order (dependencies before dependents,
+        see :meth:`potpy.router.Route.analyze`) to evaluate callable items
+        without recursing through :meth:`__getitem__`, since each item's
+        dependencies will already have been remembered. Does nothing if
+        :attr:`memoize` is off, and skips :attr:`volatile_keys`.
+
+            >>> calls = []
+            >>> ctx = Context(
+            ...     foo=lambda bar: calls.append('foo') or bar.upper(),
+            ...     bar=lambda: calls.append('bar') or 'qux')
+            >>> ctx.resolve(['bar', 'foo'])
+            >>> calls
+            ['bar', 'foo']
+            >>> ctx['foo']
+            'QUX'
+            >>> calls
+            ['bar', 'foo']
+        """
+        if not self.memoize:
+            return
+        volatile_keys = self.volatile_keys
+        for key in keys:
+            if key not in volatile_keys:
+                self[key]
+
+    def ainject(self, func, **kwargs):
+        """Inject arguments from context into a callable, asynchronously.
+
+        Returns a coroutine; see :func:`potpy.aio.ainject`. Requires the
+        `trollius <https://pypi.python.org/pypi/trollius>`_ package.
+        """
+        from .aio import ainject
+        return ainject(self, func, **kwargs)
+
     def inject(self, func, **kwargs):
         """Inject arguments from context into a callable.
 
+        The signature of ``func`` is only inspected the first time it is
+        injected; see :func:`get_plan`.
+
         :param func: The callable to inject arguments into.
         :param \*\*kwargs: Specify values to override context items.
         """
-        args, varargs, keywords, defaults = self._get_argspec(func)
-        if defaults:
-            required_args = args[:-len(defaults)]
-            optional_args = args[len(required_args):]
+        if self.compiled and not kwargs:
+            return get_injector(func)(self, func)
+        required, optional = get_plan(func)
+        if kwargs:
+            values = [
+                kwargs[arg] if arg in kwargs else self[arg]
+                for arg in required
+            ]
+            for arg, default in optional:
+                values.append(
+                    kwargs[arg] if arg in kwargs else self.get(arg, default))
         else:
-            required_args = args
-            optional_args = []
-        values = [
-            kwargs[arg] if arg in kwargs else self[arg]
-            for arg in required_args
-        ]
-        if defaults:
-            values.extend(
-                kwargs[arg] if arg in kwargs else self.get(arg, default)
-                for arg, default in zip(optional_args, defaults)
-            )
+            values = [self[arg] for arg in required]
+            for arg, default in optional:
+                values.append(self.get(arg, default))
         return func(*values)
+
+
+class LayeredContext(Context):
+    """
+    A :class:`Context` layered over a shared, read-only mapping.
+
+    Items are looked up in the context itself first, then in ``parent``. The
+    parent mapping is referenced rather than copied, and is never written to:
+    setting, updating and deleting items only affect the context's own layer.
+    This makes it cheap to create many short-lived contexts that share a large
+    set of defaults:
+
+        >>> defaults = {'foo': lambda bar: bar.upper(), 'bar': 'qux'}
+        >>> ctx = LayeredContext(defaults, bar='quux')
+        >>> ctx.inject(lambda foo, bar: (foo, bar))
+        ('QUUX', 'quux')
+        >>> ctx['foo'] = 'foo'
+        >>> sorted(ctx.items())
+        [('bar', 'quux'), ('foo', 'foo')]
+        >>> sorted(defaults.items())    # doctest: +ELLIPSIS
+        [('bar', 'qux'), ('foo', <function <lambda> at ...>)]
+
+    Items that only exist in the parent can't be deleted from the context:
+
+        >>> del LayeredContext(defaults)['bar']
+        Traceback (most recent call last):
+            ...
+        KeyError: 'bar'
+
+    Looking up the implicit ``'context'`` item copies the parent's items into
+    the context's own layer first, so that callables taking the context get a
+    complete mapping, which :class:`dict`, ``**kwargs`` and :class:`Context`
+    can read like any other:
+
+        >>> ctx = LayeredContext(defaults, bar='quux')
+        >>> sorted(dict(ctx.inject(lambda context: context)))
+        ['bar', 'foo']
+
+    :param parent: The mapping to fall back to for missing items.
+    :param \*args, \*\*kwargs: The context's own items, as for :class:`dict`.
+    """
+    def __init__(self, parent, *args, **kwargs):
+        Context.__init__(self, *args, **kwargs)
+        self.parent = parent
+        self._parent_lookup = getattr(parent, '_lookup', parent.get)
+
+    def _context_item(self):
+        self._flatten()
+        return self
+
+    def _flatten(self):
+        parent_lookup = self._parent_lookup
+        for key in self.parent:
+            if not dict.__contains__(self, key):
+                dict.__setitem__(self, key, parent_lookup(key))
+        self.parent = {}
+        self._parent_lookup = self.parent.get
+
+    def _lookup(self, key, default=None):
+        value = dict.get(self, key, _missing)
+        if value is _missing:
+            return self._parent_lookup(key, default)
+        return value
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.parent
+
+    has_key = __contains__
+
+    def iterkeys(self):
+        for key in dict.iterkeys(self):
+            yield key
+        for key in self.parent:
+            if not dict.__contains__(self, key):
+                yield key
+
+    __iter__ = iterkeys
+
+    def itervalues(self):
+        for key in self.iterkeys():
+            yield self._lookup(key)
+
+    def iteritems(self):
+        for key in self.iterkeys():
+            yield key, self._lookup(key)
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def copy(self):
+        return dict(self.iteritems())
+
+    def __eq__(self, other):
+        return dict(self.iteritems()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '%s(%r, %s)' % (
+            type(self).__name__, self.parent, dict.__repr__(self))
+
+    def __reduce__(self):
+        cls, args, state, items, dictitems = Context.__reduce__(self)
+        del state['_parent_lookup']
+        return cls, (self.parent,), state, items, dictitems
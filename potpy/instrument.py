@@ -0,0 +1,180 @@
+"""
+This module provides instrumentation of route handlers.
+
+Instruments are attached to routes with :meth:`potpy.router.Route.instrument`
+or :meth:`potpy.router.Router.instrument`, and are told before and after each
+handler runs. Routes without instruments aren't affected at all: instruments
+are built into a route's steps when it is compiled.
+
+The :class:`Collector` instrument records call counts, exception counts, stop
+counts and latency histograms for each handler::
+
+    >>> from potpy.context import Context
+    >>> from potpy.router import Route
+    >>> def load_user(user_id):
+    ...     return 'user %d' % (user_id,)
+    ...
+    >>> route = Route((load_user, 'user'), lambda user: user.upper())
+    >>> collector = Collector()
+    >>> route.instrument(collector, 'users')
+    >>> route(Context(user_id=1))
+    'USER 1'
+    >>> stats = collector.snapshot()
+    >>> sorted(stats)
+    [('users', '<lambda>'), ('users', 'load_user')]
+    >>> stats['users', 'load_user']['calls']
+    1
+"""
+import inspect
+import threading
+import time
+from bisect import bisect_left
+
+
+def handler_name(handler):
+    """Return a readable name for a handler.
+
+    The qualified name of functions, methods and classes (without the module
+    name), the ``repr()`` of objects that define one, or otherwise the name
+    of the object's class.
+    """
+    if inspect.ismethod(handler):
+        cls = handler.im_class
+        if inspect.isclass(handler.im_self):
+            cls = handler.im_self
+        return '%s.%s' % (cls.__name__, handler.__name__)
+    if inspect.isfunction(handler) or inspect.isclass(handler):
+        return handler.__name__
+    if type(handler).__repr__ is object.__repr__:
+        return type(handler).__name__
+    return repr(handler)
+
+
+class StepInfo(object):
+    """
+    Describes an instrumented route step.
+
+    .. attribute:: route
+
+        The :class:`~potpy.router.Route` the step belongs to.
+
+    .. attribute:: index
+
+        The position of the step in the route.
+
+    .. attribute:: handler
+
+        The handler of the step.
+
+    .. attribute:: key
+
+        A ``(route name, handler name)`` tuple identifying the step. See
+        :func:`handler_name`.
+    """
+    __slots__ = ('route', 'index', 'handler', 'key')
+
+    def __init__(self, route, index, handler):
+        self.route = route
+        self.index = index
+        self.handler = handler
+        self.key = (route.name, handler_name(handler))
+
+
+class Instrument(object):
+    """
+    Base class for instruments.
+
+    Override :meth:`before` and :meth:`after`. An instrument may be attached
+    to many routes, and called from many threads at once.
+    """
+    def before(self, step, context):
+        """Called before a step runs.
+
+        :param step: A :class:`StepInfo` describing the step.
+        :param context: The context the route was called with.
+        :returns: A value passed on to :meth:`after`.
+        """
+
+    def after(self, step, context, token, outcome):
+        """Called after a step has run.
+
+        :param step: A :class:`StepInfo` describing the step.
+        :param context: The context the route was called with.
+        :param token: The value returned by :meth:`before`.
+        :param outcome: ``'ok'`` if the step returned, ``'stop'`` if it
+            raised :class:`~potpy.router.Route.Stop`, or ``'error'`` if it
+            raised any other exception.
+        """
+
+
+#: The upper bounds, in seconds, of the latency histogram buckets used by
+#: :class:`Collector` by default. A last bucket counts anything slower.
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class Collector(Instrument):
+    """
+    Records statistics for each step, keyed by :attr:`StepInfo.key`.
+
+    :param buckets: The upper bounds of the latency histogram buckets, in
+        seconds, in increasing order.
+    :param timer: The clock used for timing.
+    """
+    def __init__(self, buckets=BUCKETS, timer=time.time):
+        self.buckets = tuple(buckets)
+        self.timer = timer
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def before(self, step, context):
+        return self.timer()
+
+    def after(self, step, context, token, outcome):
+        elapsed = self.timer() - token
+        self._lock.acquire()
+        try:
+            stats = self._stats.get(step.key)
+            if stats is None:
+                stats = self._stats[step.key] = {
+                    'calls': 0, 'ok': 0, 'error': 0, 'stop': 0,
+                    'total': 0.0, 'max': 0.0,
+                    'histogram': [0] * (len(self.buckets) + 1),
+                }
+            stats['calls'] += 1
+            stats[outcome] += 1
+            stats['total'] += elapsed
+            if elapsed > stats['max']:
+                stats['max'] = elapsed
+            stats['histogram'][bisect_left(self.buckets, elapsed)] += 1
+        finally:
+            self._lock.release()
+
+    def snapshot(self, reset=False):
+        """Return a copy of the statistics recorded so far.
+
+        :param reset: If true, also forget the statistics, atomically.
+        :returns: A dict mapping ``(route name, handler name)`` keys to dicts
+            with ``calls``, ``ok``, ``error`` and ``stop`` counts, the
+            ``total`` and ``max`` latency in seconds, and a ``histogram``
+            list of counts, one for each bucket plus one for anything
+            slower.
+        """
+        self._lock.acquire()
+        try:
+            snapshot = dict(
+                (key, dict(stats, histogram=list(stats['histogram'])))
+                for key, stats in self._stats.iteritems()
+            )
+            if reset:
+                self._stats.clear()
+        finally:
+            self._lock.release()
+        return snapshot
+
+    def reset(self):
+        """Forget the statistics recorded so far."""
+        self._lock.acquire()
+        try:
+            self._stats.clear()
+        finally:
+            self._lock.release()
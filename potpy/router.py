@@ -1,4 +1,617 @@
 import sys
+import threading
+from itertools import islice
+from operator import attrgetter
+
+from .context import get_plan, volatile
+from .cache import cached
+from .instrument import StepInfo
+
+
+# Stands in for context items whose values aren't known until a route runs.
+_unknown = object()
+
+
+try:
+    attrgetter('real.real')(0)
+    _attrgetter = attrgetter
+except AttributeError:
+    # Python 2.5's attrgetter doesn't follow dotted names.
+    def _attrgetter(name):
+        getters = [attrgetter(part) for part in name.split('.')]
+        def getter(obj):
+            for get in getters:
+                obj = get(obj)
+            return obj
+        return getter
+
+
+class Dependencies(object):
+    """
+    The context dependencies of a :class:`Route` or :class:`Router`, as found
+    by :meth:`Route.analyze` or :meth:`Router.analyze`.
+
+    .. attribute:: steps
+
+        A list of :class:`StepDependencies`, one for each handler and
+        exception handler that was analyzed, including those of nested routes
+        and routers.
+
+    .. attribute:: missing
+
+        A dict mapping each missing context key to a list of the handlers that
+        require it.
+
+    .. attribute:: cycles
+
+        A list of tuples of context keys whose items depend on each other in
+        a cycle. The first key is repeated at the end, eg. ``('a', 'b',
+        'a')``.
+
+    .. attribute:: last_use
+
+        A dict mapping each analyzed :class:`Route` to a dict of the names
+        given to its handlers' results (including results named in nested
+        routes), each mapped to the position of the last handler in the
+        route that needs it: the last one that reads it, directly or through
+        context items, nested routes and routers, or otherwise the one that
+        names it. Handlers that take the whole ``context``, or whose
+        arguments can't be known in advance (such as :attr:`Route.previous`
+        and references to named results), count as reading every name given
+        before them. Routes nested directly in other routes are left out,
+        since their names outlive them.
+    """
+    def __init__(self):
+        self.steps = []
+        self.missing = {}
+        self.cycles = []
+        self.last_use = {}
+        self._nested = set()
+
+    @property
+    def ok(self):
+        """``True`` if there are no missing keys or cycles."""
+        return not (self.missing or self.cycles)
+
+    def _add_missing(self, key, handler):
+        handlers = self.missing.setdefault(key, [])
+        if handler not in handlers:
+            handlers.append(handler)
+
+    def _add_cycle(self, cycle):
+        i = cycle.index(min(cycle))
+        cycle = tuple(cycle[i:] + cycle[:i] + cycle[i:i+1])
+        if cycle not in self.cycles:
+            self.cycles.append(cycle)
+
+    def _install(self, release=False):
+        routes = set(self.last_use)
+        routes.update(step.route for step in self.steps)
+        routes.discard(None)
+        for route in routes:
+            route._resolution = None
+            route._releases = None
+            route._steps = None
+        for step in self.steps:
+            route = step.route
+            if route is None or step.exception_handler or not step.order:
+                continue
+            if route._resolution is None:
+                route._resolution = [()] * len(route.route)
+            # handlers in a parallel group share their step's order
+            order = route._resolution[step.index]
+            route._resolution[step.index] = order + tuple(
+                key for key in step.order if key not in order)
+        if not release:
+            return
+        for route, last_use in self.last_use.iteritems():
+            if route in self._nested or not last_use:
+                continue
+            releases = {}
+            for key, index in last_use.iteritems():
+                releases.setdefault(index, []).append(key)
+            route._releases = dict(
+                (index, tuple(sorted(keys)))
+                for index, keys in releases.iteritems())
+
+
+class StepDependencies(object):
+    """
+    The context dependencies of a single handler.
+
+    .. attribute:: route
+
+        The :class:`Route` the handler belongs to, or ``None`` for a
+        :class:`Router` analyzed on its own.
+
+    .. attribute:: index
+
+        The position of the handler in the route.
+
+    .. attribute:: handler
+
+        The handler (or exception handler) itself.
+
+    .. attribute:: exception_handler
+
+        ``True`` if :attr:`handler` is an exception handler.
+
+    .. attribute:: graph
+
+        A dict mapping the key of each callable context item the handler
+        depends on, directly or indirectly, to a tuple of the keys that item
+        is injected with.
+
+    .. attribute:: order
+
+        A list of the keys in :attr:`graph` ordered so that each item comes
+        after the items it depends on. Items that are only needed for
+        optional arguments, and :class:`~potpy.context.volatile` items, are
+        left out.
+    """
+    def __init__(self, route, index, handler, exception_handler=False):
+        self.route = route
+        self.index = index
+        self.handler = handler
+        self.exception_handler = exception_handler
+        self.graph = {}
+        self.order = []
+        self._seen = {}
+
+
+def _plan_args(func):
+    try:
+        required, optional = get_plan(func)
+    except TypeError:
+        return []
+    return [(arg, True) for arg in required] + [
+        (arg, False) for arg, default in optional]
+
+
+def _visit(report, step, known, key, required, path):
+    if key in path:
+        report._add_cycle(path[path.index(key):])
+        return
+    if key in step._seen and (step._seen[key] or not required):
+        return
+    step._seen[key] = required
+    if key not in known:
+        if required and key != 'context':
+            report._add_missing(key, step.handler)
+        return
+    value = known[key]
+    if not callable(value):
+        return
+    args = _plan_args(value)
+    step.graph[key] = tuple(arg for arg, arg_required in args)
+    path.append(key)
+    for arg, arg_required in args:
+        _visit(report, step, known, arg, required and arg_required, path)
+    path.pop()
+    if required and not isinstance(value, volatile):
+        step.order.append(key)
+
+
+def _analyze_handler(report, known, route, index, handler, args,
+                     exception_handler=False):
+    step = StepDependencies(route, index, handler, exception_handler)
+    for arg, required in args:
+        _visit(report, step, known, arg, required, [])
+    report.steps.append(step)
+
+
+def _result_names(name, handler):
+    # The names a handler's results are given, including those given in
+    # nested routes and parallel groups.
+    names = [name] if name else []
+    if isinstance(handler, cached):
+        handler = handler.handler
+    if isinstance(handler, Route):
+        items = handler.route
+    elif isinstance(handler, Route.parallel):
+        items = handler.handlers
+    else:
+        items = ()
+    for item in items:
+        names.extend(_result_names(item[0], item[1]))
+    return names
+
+
+_immutable_types = (basestring, int, long, float, complex, type(None))
+
+
+def _immutable(value):
+    if isinstance(value, (tuple, frozenset)):
+        return all(_immutable(item) for item in value)
+    return isinstance(value, _immutable_types)
+
+
+def _analysis_context(context):
+    if hasattr(context, 'items'):
+        return dict(context.items())
+    return dict.fromkeys(context, _unknown)
+
+
+# Compiled route steps. Each step is called with the context and the result
+# of the previous step, and returns its own result. The basic steps below
+# differ in what they inject; ``target`` returns the callable to inject.
+
+class _Step(object):
+    __slots__ = ('handler',)
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def target(self, context, result):
+        return self.handler
+
+    def __call__(self, context, result):
+        return context.inject(self.handler)
+
+
+class _ContextRefStep(_Step):
+    __slots__ = ()
+
+    def target(self, context, result):
+        return self.handler(context)
+
+    def __call__(self, context, result):
+        return context.inject(self.handler(context))
+
+
+class _PreviousStep(_Step):
+    __slots__ = ()
+
+    def target(self, context, result):
+        return result
+
+    def __call__(self, context, result):
+        return context.inject(result)
+
+
+class _PreviousRefStep(_Step):
+    __slots__ = ()
+
+    def target(self, context, result):
+        return self.handler(result)
+
+    def __call__(self, context, result):
+        return context.inject(self.handler(result))
+
+
+class _RouterStep(_Step):
+    # Routes without injecting the router, which would look up the context
+    # itself (making a layered context copy its parent's items).
+    __slots__ = ('arg',)
+
+    def __init__(self, handler, arg):
+        self.handler = handler
+        self.arg = arg
+
+    def target(self, context, result):
+        return lambda: self(context, result)
+
+    def __call__(self, context, result):
+        router = self.handler
+        obj = context[self.arg]
+        route = router._find(context, obj)
+        if route is None:
+            raise router.NoRoute(obj)
+        return route(context)
+
+
+class _ContextClassStep(_Step):
+    __slots__ = ()
+
+    def target(self, context, result):
+        raise TypeError("can't refer to context directly")
+
+    def __call__(self, context, result):
+        self.target(context, result)
+
+
+# Wrappers adding resolution orders, exception handlers and named results to
+# a basic step.
+
+class _ResolvingStep(object):
+    __slots__ = ('step', 'order')
+
+    def __init__(self, step, order):
+        self.step = step
+        self.order = order
+
+    def __call__(self, context, result):
+        handler = self.step.target(context, result)
+        context.resolve(self.order)
+        return context.inject(handler)
+
+
+class _GuardedStep(object):
+    __slots__ = ('step', 'order', 'exception_handlers', 'exc_info_in_context',
+                 'dispatch')
+
+    def __init__(self, step, order, exception_handlers, exc_info_in_context):
+        self.step = step
+        self.order = order
+        self.exception_handlers = exception_handlers
+        self.exc_info_in_context = exc_info_in_context
+        # maps concrete exception types to their handler, or None
+        self.dispatch = {}
+
+    def find_handler(self, exc_type):
+        for types, exc_handler in self.exception_handlers:
+            if issubclass(exc_type, types):
+                return exc_handler
+        return None
+
+    def handle(self, context, exc_info):
+        exc_handler = self.dispatch.get(exc_info[0], _unknown)
+        if exc_handler is _unknown:
+            exc_handler = self.dispatch[exc_info[0]] = \
+                self.find_handler(exc_info[0])
+        if exc_handler is None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        if not self.exc_info_in_context:
+            return context.inject(exc_handler, exc_info=exc_info)
+        context['exc_info'] = exc_info
+        try:
+            return context.inject(exc_handler)
+        finally:
+            del context['exc_info']
+
+    def __call__(self, context, result):
+        handler = self.step.target(context, result)
+        try:
+            if self.order:
+                context.resolve(self.order)
+            return context.inject(handler)
+        except Exception:
+            return self.handle(context, sys.exc_info())
+
+
+class _NamedStep(object):
+    __slots__ = ('step', 'name')
+
+    def __init__(self, step, name):
+        self.step = step
+        self.name = name
+
+    def __call__(self, context, result):
+        result = self.step(context, result)
+        if type(result) is not Route.Stop:
+            context[self.name] = result
+        return result
+
+
+class _ReleaseStep(object):
+    # Drops named results from the context once nothing needs them.
+    __slots__ = ('keys',)
+
+    def __init__(self, keys):
+        self.keys = keys
+
+    def __call__(self, context, result):
+        for key in self.keys:
+            context.pop(key, None)
+        return result
+
+
+class _ReleasingStep(_ReleaseStep):
+    __slots__ = ('step',)
+
+    def __init__(self, step, keys):
+        self.step = step
+        self.keys = keys
+
+    def __call__(self, context, result):
+        result = self.step(context, result)
+        for key in self.keys:
+            context.pop(key, None)
+        return result
+
+
+class _CachedStep(object):
+    __slots__ = ('step', 'handler', 'keys', 'cache')
+
+    def __init__(self, step, handler, cache):
+        self.step = step
+        self.handler = handler
+        self.keys = cache.keys
+        self.cache = cache
+
+    def __call__(self, context, result):
+        values = tuple([context[key] for key in self.keys])
+        return self.cache.get(self.handler, values, self.step, context, result)
+
+
+class _InstrumentedStep(object):
+    __slots__ = ('step', 'info', 'instruments')
+
+    def __init__(self, step, info, instruments):
+        self.step = step
+        self.info = info
+        self.instruments = instruments
+
+    def __call__(self, context, result):
+        info = self.info
+        tokens = [instrument.before(info, context)
+                  for instrument in self.instruments]
+        outcome = 'error'
+        try:
+            result = self.step(context, result)
+            outcome = 'stop' if type(result) is Route.Stop else 'ok'
+        except Route.Stop:
+            outcome = 'stop'
+            raise
+        finally:
+            for instrument, token in zip(self.instruments, tokens):
+                instrument.after(info, context, token, outcome)
+        return result
+
+
+# Steps added when nested routes are inlined into a flat plan (see
+# Route.flatten): the nested route starts with no previous result, and its
+# result may be named.
+
+class _ResetStep(object):
+    __slots__ = ()
+
+    def __call__(self, context, result):
+        return None
+
+
+class _StoreStep(object):
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self, context, result):
+        context[self.name] = result
+        return result
+
+
+def _run_flat(plan, context):
+    steps, stops, tail = plan
+    Stop = Route.Stop
+    while True:
+        result = None
+        i = 0
+        n = len(steps)
+        while i < n:
+            try:
+                for i in xrange(i, n):
+                    value = steps[i](context, result)
+                    if type(value) is Stop:
+                        break
+                    result = value
+                else:
+                    break
+            except Stop, value:
+                pass
+            if value.value is not value.NoValue:
+                result = value.value
+            i = stops[i]
+            if i is None:
+                return result
+        if tail is None:
+            return result
+        router, arg = tail
+        obj = context[arg]
+        route = router._find(context, obj)
+        if route is None:
+            raise router.NoRoute(obj)
+        if route._steps is None or route._flat is None:
+            return route(context)
+        steps, stops, tail = route._flat
+
+
+def _dispatch_arg(router):
+    # The name of the argument a router is called with, if it dispatches
+    # like Router.__call__ (possibly with renamed arguments; see
+    # potpy.util.rename_args).
+    func = getattr(type(router).__call__, 'im_func', None)
+    code = getattr(func, 'func_code', None)
+    if code is None or \
+            code.co_code != Router.__call__.im_func.func_code.co_code:
+        return None
+    return code.co_varnames[2]
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _default_executor():
+    global _executor
+    if _executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _executor_lock.acquire()
+        try:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=16)
+        finally:
+            _executor_lock.release()
+    return _executor
+
+
+# The router being classified by worker processes, and the positions of its
+# routes, which they inherit when the pool forks them (see
+# Router.classify_many).
+_classifying = None
+_classifying_lock = threading.Lock()
+
+
+def _classify_chunk(objs):
+    router, positions = _classifying
+    return list(router._classify(objs, positions))
+
+
+def _classify_in_processes(router, positions, objs, processes, chunksize):
+    global _classifying
+    from multiprocessing import Pool
+    _classifying_lock.acquire()
+    try:
+        _classifying = router, positions
+        pool = Pool(processes)
+    finally:
+        _classifying = None
+        _classifying_lock.release()
+    try:
+        objs = iter(objs)
+        chunks = iter(lambda: list(islice(objs, chunksize)), [])
+        while True:
+            # a few chunks per worker at a time, so that the input is read
+            # as it is needed
+            batch = list(islice(chunks, processes * 4))
+            if not batch:
+                break
+            for results in pool.imap(_classify_chunk, batch):
+                for result in results:
+                    yield result
+    finally:
+        pool.terminate()
+
+
+class _ParallelStep(object):
+    __slots__ = ('members', 'executor')
+
+    def __init__(self, group, handler_step, guarded_step):
+        self.members = []
+        for name, handler, exception_handlers in group.handlers:
+            member = handler_step(handler)
+            if exception_handlers:
+                # exc_info can't be shared through the context by handlers
+                # running at the same time
+                member = guarded_step(
+                    member, (), tuple(exception_handlers), False)
+            self.members.append((name, member))
+        self.executor = group.executor
+
+    def target(self, context, result):
+        return self.run
+
+    def __call__(self, context, result):
+        return self.run(context)
+
+    def run(self, context):
+        from concurrent.futures import wait, FIRST_EXCEPTION
+        executor = self.executor or _default_executor()
+        futures = [executor.submit(member, context, None)
+                   for name, member in self.members]
+        done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in pending:
+            future.cancel()
+        for future in futures:
+            if future in done and future.exception() is not None:
+                future.result()
+        results = [future.result() for future in futures]
+        for result in results:
+            if type(result) is Route.Stop:
+                return result
+        for (name, member), result in zip(self.members, results):
+            context[name] = result
+        return tuple(results)
 
 
 class Route(object):
@@ -8,7 +621,8 @@ class Route(object):
 
     Initializer can also be called with a single (non-tuple) iterable of
     handlers. Each handler item is either a callable or a tuple: ``(handler,
-    name, exception_handlers)`` -- see :meth:`add` for details of this tuple.
+    name, exception_handlers, cache)`` -- see :meth:`add` for details of this
+    tuple.
     """
 
     class Stop(Exception):
@@ -18,6 +632,12 @@ class Route(object):
         If an argument is provided, it will be used as the route return value,
         otherwise the return value of the previous handler will be returned.
 
+        Handlers (and exception handlers) may also return a Stop instance
+        instead of raising it, which has the same effect without the cost of
+        raising and catching an exception. A returned Stop is not added to
+        the context, even if the handler's result is named. Only instances
+        of Stop itself are recognized when returned, not of subclasses.
+
         Example::
             >>> from potpy.context import Context
 
@@ -30,6 +650,14 @@ class Route(object):
             >>> route = Route(stopper, foobar)
             >>> route(Context())
             'stops here'
+
+            >>> def validate(user_id):
+            ...     if user_id < 0:
+            ...         return Route.Stop('invalid')
+            ...
+            >>> route = Route(validate, foobar)
+            >>> route(Context(user_id=-1))
+            'invalid'
         """
         NoValue = type('NoValue', (), {})
         def __init__(self, value=NoValue):
@@ -53,21 +681,42 @@ class Route(object):
             ... )
             >>> route(Context())
             42
+
+        References are compared by the attributes they refer to, so equal
+        references can be shared::
+
+            >>> Route.previous.foo.bar == Route.previous.foo.bar
+            True
+            >>> Route.previous.foo.bar
+            Route.previous.foo.bar
         """
+        __slots__ = ('name', '_get')
+
         class __metaclass__(type):
             def __getattr__(cls, name):
                 return cls(name)
 
         def __init__(self, name):
             self.name = name
+            self._get = _attrgetter(name)
 
         def __getattr__(self, name):
             return type(self)('.'.join((self.name, name)))
 
         def __call__(self, obj):
-            for name in self.name.split('.'):
-                obj = getattr(obj, name)
-            return obj
+            return self._get(obj)
+
+        def __eq__(self, other):
+            return type(other) is type(self) and other.name == self.name
+
+        def __ne__(self, other):
+            return not self == other
+
+        def __hash__(self):
+            return hash(self.name)
+
+        def __repr__(self):
+            return 'Route.previous.%s' % (self.name,)
 
     class context(object):
         """
@@ -86,7 +735,17 @@ class Route(object):
             ... )
             >>> route(Context(inst=MyClass()))
             42
+
+        As with :class:`previous`, references are compared by the item and
+        attributes they refer to::
+
+            >>> Route.context['inst'].foo == Route.context.inst.foo
+            True
+            >>> Route.context.inst.foo
+            Route.context['inst'].foo
         """
+        __slots__ = ('key', 'name', '_get')
+
         class __metaclass__(type):
             def __getitem__(cls, key):
                 return cls(key)
@@ -95,6 +754,7 @@ class Route(object):
         def __init__(self, key, name=None):
             self.key = key
             self.name = name
+            self._get = name and _attrgetter(name)
 
         def __getattr__(self, name):
             if self.name:
@@ -102,14 +762,135 @@ class Route(object):
             return type(self)(self.key, name)
 
         def __call__(self, context):
-            obj = context[self.key]
+            if self._get:
+                return self._get(context[self.key])
+            return context[self.key]
+
+        def __eq__(self, other):
+            return (type(other) is type(self) and other.key == self.key and
+                    other.name == self.name)
+
+        def __ne__(self, other):
+            return not self == other
+
+        def __hash__(self):
+            return hash((self.key, self.name))
+
+        def __repr__(self):
             if self.name:
-                for name in self.name.split('.'):
-                    obj = getattr(obj, name)
-            return obj
+                return 'Route.context[%r].%s' % (self.key, self.name)
+            return 'Route.context[%r]' % (self.key,)
+
+    class parallel(object):
+        """
+        A group of handlers to run at the same time.
+
+        Add a group to a route like any other handler. Each handler in the
+        group is given as a ``(handler, name, exception_handlers)`` tuple,
+        where ``name`` is required and ``exception_handlers`` is optional (see
+        :meth:`Route.add`). When the route reaches the group, all of its
+        handlers are started at once, each injected with the same context.
+        Once they have all finished, each result is added to the context
+        under its name, and the route moves on. The result of the group
+        itself is a tuple of the results, in order.
+
+        If a handler raises an exception that its exception handlers don't
+        handle, handlers that haven't started yet are cancelled and the
+        exception is raised from the group. Exception handlers in a group
+        receive ``exc_info`` as an argument only; it is not added to the
+        context (see :attr:`Route.exc_info_in_context`).
+
+        In a :class:`Route`, the handlers run in threads, taken from
+        ``executor`` if given (a :class:`concurrent.futures.Executor`), or
+        otherwise from a shared thread pool. This requires the
+        `futures <https://pypi.python.org/pypi/futures>`_ package. In a
+        :class:`potpy.aio.AsyncRoute`, the handlers are called in turn on
+        the event loop and the coroutines they return run concurrently;
+        ``executor`` is not used.
+
+        Handlers in a group can't see each other's results. Callable context
+        items they share may be called more than once, unless the route has
+        been prepared (see :meth:`Route.prepare`), in which case they are
+        resolved before the group starts.
+
+        Example::
+
+            >>> from potpy.context import Context
+
+            >>> route = Route(
+            ...     Route.parallel(
+            ...         (lambda user_id: 'user %d' % (user_id,), 'user'),
+            ...         (lambda: {}['settings'], 'settings', [
+            ...             (KeyError, lambda: 'defaults')
+            ...         ]),
+            ...     ),
+            ...     lambda user, settings: (user, settings),
+            ... )
+            >>> route(Context(user_id=1))
+            ('user 1', 'defaults')
+        """
+        def __init__(self, *handlers, **kwargs):
+            self.executor = kwargs.pop('executor', None)
+            if kwargs:
+                raise TypeError('unexpected keyword arguments: %s' % (
+                    ', '.join(sorted(kwargs)),))
+            self.handlers = []
+            for handler in handlers:
+                self.add(*handler)
+
+        def add(self, handler, name, exception_handlers=()):
+            """Add a handler to the group.
+
+            See :meth:`Route.add`. Adding handlers to a group that has
+            already been compiled into a route has no effect until
+            :meth:`Route.compile` is called again.
+            """
+            self.handlers.append((name, handler, exception_handlers))
+
+    class DependencyError(Exception):
+        """
+        Raised by :meth:`Route.prepare` and :meth:`Router.prepare` when
+        context items are missing or depend on each other in a cycle.
+
+        Has a ``dependencies`` attribute holding the :class:`Dependencies`
+        found.
+        """
+        def __init__(self, dependencies):
+            self.dependencies = dependencies
+            problems = ['missing %r' % (key,)
+                        for key in sorted(dependencies.missing)]
+            problems.extend('cycle %s' % (' -> '.join(cycle),)
+                            for cycle in dependencies.cycles)
+            Exception.__init__(self, ', '.join(problems))
+
+    #: Whether ``exc_info`` is added to the context while an exception
+    #: handler runs (see :meth:`add`). When ``False``, it is only passed to
+    #: the exception handler itself, leaving the context untouched.
+    exc_info_in_context = True
+
+    #: The name of the route, used to identify its steps to instruments. See
+    #: :meth:`instrument`.
+    name = None
+
+    #: The instruments attached to the route. See :meth:`instrument`.
+    instruments = ()
+
+    # Wrappers for steps with exception handlers, resolution orders, cached
+    # and named results, and the step running parallel groups.
+    _guarded_step = _GuardedStep
+    _resolving_step = _ResolvingStep
+    _cached_step = _CachedStep
+    _named_step = _NamedStep
+    _parallel_step = _ParallelStep
+    _instrumented_step = _InstrumentedStep
+    _releasing_step = _ReleasingStep
 
     def __init__(self, *handlers):
         self.route = []
+        self._resolution = None
+        self._releases = None
+        self._steps = None
+        self._flat = None
         if len(handlers) == 1 and not isinstance(handlers[0], tuple):
             try:
                 handlers = iter(handlers[0])
@@ -121,7 +902,7 @@ class Route(object):
             else:
                 self.add(handler)
 
-    def add(self, handler, name=None, exception_handlers=()):
+    def add(self, handler, name=None, exception_handlers=(), cache=None):
         """Add a handler to the route.
 
         :param handler: The "handler" callable to add.
@@ -130,18 +911,26 @@ class Route(object):
         :param exception_handlers: Optional. A list of ``(types, handler)``
             tuples, where ``types`` is an exception type (or tuple of types)
             to handle, and ``handler`` is a callable. See below for example.
+        :param cache: Optional. A :class:`~potpy.cache.Cache` to keep the
+            handler's results in, keyed on the values of the context items it
+            names. On a hit, the handler (and its exception handlers) are not
+            called, and the cached result is used in their place.
 
         **Exception Handlers**
 
-        When an exception occurs in a handler, ``exc_info`` will be
-        temporarily added to the context and the list of exception handlers
+        When an exception occurs in a handler, the list of exception handlers
         will be checked for an appropriate handler. If no handler can be
         found, the exception will be re-raised to the caller of the route.
+        The handler found for each exception type (or the lack of one) is
+        remembered, so the list is only checked once per type.
 
-        If an appropriate exception handler is found, it will be called (the
-        context will be injected, so handlers may take an ``exc_info``
-        argument), and its return value will be used in place of the original
-        handler's return value.
+        If an appropriate exception handler is found, ``exc_info`` will be
+        temporarily added to the context and the exception handler will be
+        called (the context will be injected, so handlers may take an
+        ``exc_info`` argument). Its return value will be used in place of the
+        original handler's return value. Set :attr:`exc_info_in_context` to
+        ``False`` to pass ``exc_info`` to exception handlers without adding it
+        to the context.
 
         Examples:
 
@@ -181,41 +970,379 @@ class Route(object):
                 ...
             KeyError: 'foo'
         """
+        if cache is not None:
+            handler = cached(handler, cache)
         self.route.append((name, handler, exception_handlers))
+        self._resolution = None
+        self._releases = None
+        self._steps = None
 
-    def __call__(self, context):
-        """Call the handlers in the route, in order,  with the given context."""
-        result = None
-        for name, handler, exception_handlers in self.route:
-            if handler is self.context:
-                raise TypeError("can't refer to context directly")
-            elif isinstance(handler, self.context):
-                handler = handler(context)
-            elif handler is self.previous:
-                handler = result
-            elif isinstance(handler, self.previous):
-                handler = handler(result)
-            try:
+    def analyze(self, context=()):
+        """Find the context items each handler in the route depends on.
+
+        Follows callable items through the arguments they are injected with,
+        and through nested routes and routers, without calling anything.
+        Names given to handler results (see :meth:`add`) are taken into
+        account for later handlers, and ``exc_info`` for exception handlers.
+
+        :param context: The context items that will be available when the
+            route is called: a mapping, in which callable values are followed
+            as they would be by :class:`~potpy.context.Context`, or an
+            iterable of keys.
+        :returns: A :class:`Dependencies` instance.
+
+        Example:
+
+            >>> route = Route(
+            ...     (lambda user: user.upper(), 'name'),
+            ...     lambda name, account: (name, account),
+            ... )
+            >>> deps = route.analyze({
+            ...     'user': lambda session: session['user'],
+            ...     'session': lambda user: {},
+            ... })
+            >>> deps.missing.keys()
+            ['account']
+            >>> deps.cycles
+            [('session', 'user', 'session')]
+        """
+        report = Dependencies()
+        self._analyze(_analysis_context(context), report)
+        return report
+
+    def prepare(self, context=(), release=False):
+        """Analyze the route, and have it follow the resolution orders found.
+
+        Like :meth:`analyze`, but raises :exc:`DependencyError` if any context
+        items are missing or form a cycle. Otherwise, when the route is
+        called, the callable items each handler depends on are resolved in
+        order (see :meth:`potpy.context.Context.resolve`) before the handler
+        is injected. Adding handlers to the route discards the orders.
+
+        :param release: If true, named results are also removed from the
+            context as soon as the last handler that needs them has run (see
+            :attr:`Dependencies.last_use`), rather than kept until the
+            request ends. Only turn this on if nothing reads the context
+            after the route returns, and no handler reads named results
+            through a ``context`` argument or a nested router's routes.
+        :returns: A :class:`Dependencies` instance.
+
+        Example::
+
+            >>> from potpy.context import Context
+            >>> route = Route(
+            ...     (lambda: 'x' * 1000, 'payload'),
+            ...     (lambda payload: len(payload), 'size'),
+            ...     lambda size: size * 2,
+            ... )
+            >>> deps = route.prepare(release=True)
+            >>> sorted(deps.last_use[route].items())
+            [('payload', 1), ('size', 2)]
+            >>> context = Context()
+            >>> route(context)
+            2000
+            >>> context
+            {}
+        """
+        report = self.analyze(context)
+        if not report.ok:
+            raise self.DependencyError(report)
+        report._install(release)
+        return report
+
+    def _analyze(self, known, report, nested=False):
+        # Returns True if a handler reads the context in a way that can't be
+        # followed, so that parents can't release anything before it.
+        opaque = False
+        last_use = {}
+        for index, (name, handler, exception_handlers) in enumerate(
+                self.route):
+            start = len(report.steps)
+            step_opaque = self._analyze_step(known, report, index, handler,
+                                             exception_handlers)
+            for step in report.steps[start:]:
+                if 'context' in step._seen and \
+                        not isinstance(step.handler, Router):
+                    step_opaque = True
+                for key in step._seen:
+                    if key in last_use:
+                        last_use[key] = index
+            if step_opaque:
+                opaque = True
+                for key in last_use:
+                    last_use[key] = index
+            for key in _result_names(name, handler):
+                last_use[key] = index
+            if name:
+                known[name] = _unknown
+        if nested:
+            report._nested.add(self)
+        else:
+            merged = report.last_use.setdefault(self, {})
+            for key, index in last_use.iteritems():
+                merged[key] = max(index, merged.get(key, index))
+        return opaque
+
+    def _analyze_step(self, known, report, index, handler,
+                      exception_handlers):
+        opaque = False
+        if isinstance(handler, cached):
+            _analyze_handler(report, known, self, index, handler.handler,
+                             [(key, True) for key in handler.cache.keys])
+            handler = handler.handler
+        if isinstance(handler, Route):
+            opaque = handler._analyze(known, report, True)
+        elif isinstance(handler, Router):
+            _analyze_handler(report, known, self, index, handler,
+                             _plan_args(handler))
+            opaque = handler._analyze(known, report)
+        elif isinstance(handler, self.context):
+            args = [(handler.key, True)]
+            value = known.get(handler.key)
+            opaque = True
+            if value is not _unknown and not callable(value):
                 try:
-                    result = context.inject(handler)
+                    args.extend(_plan_args(handler(known)))
+                    opaque = False
                 except Exception:
-                    context['exc_info'] = sys.exc_info()
-                    exc_type = sys.exc_info()[0]
-                    try:
-                        for types, exc_handler in exception_handlers:
-                            if issubclass(exc_type, types):
-                                result = context.inject(exc_handler)
-                                break
-                        else:
-                            raise
-                    finally:
-                        del context['exc_info']
-            except self.Stop, stop:
-                if stop.value is not stop.NoValue:
-                    result = stop.value
-                break
+                    pass
+            _analyze_handler(report, known, self, index, handler, args)
+        elif isinstance(handler, self.parallel):
+            # members can't see each other's results
+            for member in handler.handlers:
+                if self._analyze_step(known, report, index, member[1],
+                                      member[2]):
+                    opaque = True
+            for member in handler.handlers:
+                known[member[0]] = _unknown
+        elif handler is self.previous or isinstance(handler, self.previous):
+            opaque = True
+        elif handler is not self.context:
+            _analyze_handler(report, known, self, index, handler,
+                             _plan_args(handler))
+        if exception_handlers:
+            exc_known = dict(known, exc_info=_unknown)
+            for types, exc_handler in exception_handlers:
+                _analyze_handler(report, exc_known, self, index,
+                                 exc_handler, _plan_args(exc_handler),
+                                 True)
+        return opaque
+
+    def compile(self):
+        """Build the route's execution plan.
+
+        Each handler is classified once, into a step object that knows how
+        to call it: whether it refers to the context or to the previous
+        result, whether its result is named, and whether it has exception
+        handlers. Called automatically the first time the route is called,
+        and again after :meth:`add` or :meth:`prepare`. Exception handler
+        lookups are remembered per step, so compiling also forgets them.
+
+        .. note::
+
+            Modifying the ``route`` list directly does not invalidate the
+            plan; call this method afterwards.
+
+        :returns: The list of steps.
+        """
+        steps = []
+        resolution = self._resolution
+        releases = self._releases
+        for index, (name, handler, exception_handlers) in enumerate(
+                self.route):
+            cache = None
+            if isinstance(handler, cached):
+                cache = handler.cache
+                handler = handler.handler
+            if isinstance(handler, self.parallel):
+                step = self._parallel_step(
+                    handler, self._handler_step, self._guarded_step)
+            else:
+                step = self._handler_step(handler)
+            order = resolution[index] if resolution is not None else ()
+            if exception_handlers:
+                step = self._guarded_step(
+                    step, order, tuple(exception_handlers),
+                    self.exc_info_in_context)
+            elif order:
+                step = self._resolving_step(step, order)
+            if cache is not None:
+                step = self._cached_step(step, handler, cache)
             if name:
-                context[name] = result
+                step = self._named_step(step, name)
+            if self.instruments:
+                step = self._instrumented_step(
+                    step, StepInfo(self, index, handler), self.instruments)
+            if releases and index in releases:
+                step = self._releasing_step(step, releases[index])
+            steps.append(step)
+        self._steps = steps
+        self._flat = None
+        return steps
+
+    def _handler_step(self, handler):
+        # The basic step calling a handler (or a member of a parallel
+        # group).
+        if handler is self.context:
+            return _ContextClassStep(handler)
+        if isinstance(handler, self.context):
+            return _ContextRefStep(handler)
+        if handler is self.previous:
+            return _PreviousStep(handler)
+        if isinstance(handler, self.previous):
+            return _PreviousRefStep(handler._get)
+        if isinstance(handler, Router) and _dispatch_arg(handler) is not None:
+            return _RouterStep(handler, _dispatch_arg(handler))
+        return _Step(handler)
+
+    def flatten(self):
+        """Compile the route, and the routes nested in it, into a flat plan.
+
+        Nested routes are inlined into the route's list of steps, so that a
+        single loop runs them all, with :class:`Stop` still ending only the
+        route it is raised in. A router at the end of the route is followed
+        directly into the matching route's own flat plan. Routes and routers
+        can't be inlined when they have exception handlers or a cache, when
+        the route has instruments, or when they are subclasses that change
+        how they are called (such as :class:`potpy.aio.AsyncRoute`); they are
+        called as usual.
+
+        Adding handlers to the route, or preparing it, discards the flat plan
+        (the route is then compiled as usual). Changes to nested routes made
+        after flattening are not seen until this method is called again.
+
+        Example::
+
+            >>> from potpy.context import Context
+            >>> def stopper():
+            ...     raise Route.Stop('inner')
+            ...
+            >>> route = Route(
+            ...     (Route(stopper, lambda: 'never'), 'nested'),
+            ...     lambda nested: nested.upper(),
+            ... )
+            >>> route.flatten()
+            >>> route(Context())
+            'INNER'
+        """
+        for handler in self._nested():
+            handler.flatten()
+        self.compile()
+        steps, stops, tail = self._flat_steps(True)
+        # if nothing was inlined, the usual loop is faster
+        if tail is not None or steps != self._steps:
+            self._flat = steps, stops, tail
+
+    def _flat_steps(self, top):
+        steps = []
+        stops = []
+        tail = None
+        compiled = self._steps
+        if compiled is None:
+            compiled = self.compile()
+        resolution = self._resolution
+        releases = self._releases or {}
+        last = len(self.route) - 1
+        for index, (name, handler, exception_handlers) in enumerate(
+                self.route):
+            nested = not exception_handlers and not self.instruments
+            if nested and isinstance(handler, Route) and \
+                    type(handler).__call__.im_func is Route.__call__.im_func:
+                inner, inner_stops, inner_tail = handler._flat_steps(False)
+                # even if the nested route's first handler doesn't take the
+                # previous result, stopping there must leave it None
+                steps.append(_ResetStep())
+                stops.append(None)
+                offset = len(steps)
+                end = offset + len(inner)
+                for step, stop in zip(inner, inner_stops):
+                    steps.append(step)
+                    stops.append(end if stop is None else stop + offset)
+                if name:
+                    steps.append(_StoreStep(name))
+                    stops.append(None)
+                if index in releases:
+                    steps.append(_ReleaseStep(releases[index]))
+                    stops.append(None)
+            elif nested and top and index == last and not name and \
+                    isinstance(handler, Router) and \
+                    not (resolution and resolution[index]) and \
+                    index not in releases and \
+                    _dispatch_arg(handler) is not None:
+                tail = (handler, _dispatch_arg(handler))
+            else:
+                steps.append(compiled[index])
+                stops.append(None)
+        return steps, stops, tail
+
+    def instrument(self, instrument, name=None):
+        """Attach an instrument to the route, and to nested routes and routers.
+
+        The instrument is told before and after each handler runs (see
+        :class:`potpy.instrument.Instrument`). Nested routes without a name
+        take the route's name, and nested routers name their routes after it
+        (see :meth:`Router.instrument`).
+
+        :param instrument: A :class:`~potpy.instrument.Instrument`.
+        :param name: Optional. Sets :attr:`name`.
+        """
+        if name is not None:
+            self.name = name
+        if instrument not in self.instruments:
+            self.instruments = self.instruments + (instrument,)
+            self._steps = None
+        for handler in self._nested():
+            if isinstance(handler, Route):
+                handler.instrument(
+                    instrument, self.name if handler.name is None else None)
+            else:
+                handler.instrument(instrument, self.name)
+
+    def uninstrument(self, instrument=None):
+        """Detach an instrument, or all instruments, from the route and from
+        nested routes and routers.
+        """
+        instruments = tuple(i for i in self.instruments
+                            if instrument is not None and i is not instrument)
+        if instruments != self.instruments:
+            self.instruments = instruments
+            self._steps = None
+        for handler in self._nested():
+            handler.uninstrument(instrument)
+
+    def _nested(self):
+        for name, handler, exception_handlers in self.route:
+            if isinstance(handler, cached):
+                handler = handler.handler
+            if isinstance(handler, self.parallel):
+                handlers = [member[1] for member in handler.handlers]
+            else:
+                handlers = [handler]
+            for handler in handlers:
+                if isinstance(handler, (Route, Router)):
+                    yield handler
+
+    def __call__(self, context):
+        """Call the handlers in the route, in order,  with the given context."""
+        steps = self._steps
+        if steps is None:
+            steps = self.compile()
+        elif self._flat is not None:
+            return _run_flat(self._flat, context)
+        Stop = self.Stop
+        result = None
+        try:
+            for step in steps:
+                value = step(context, result)
+                if type(value) is Stop:
+                    break
+                result = value
+            else:
+                return result
+        except Stop, value:
+            pass
+        if value.value is not value.NoValue:
+            result = value.value
         return result
 
 
@@ -235,6 +1362,49 @@ class Router(object):
     it and provide an appropriate match method to define a Router. See
     :class:`potpy.wsgi.PathRouter` and :class:`potpy.wsgi.MethodRouter` for
     example subclasses.
+
+    **Indexing**
+
+    Routes are checked in the order they were added, so finding a route
+    takes longer the more routes there are. Subclasses whose ``match``
+    arguments are exact values can avoid the scan by implementing
+    :meth:`index_key` and :meth:`lookup_key`. Routes with an index key are
+    kept in a dict, and only those whose key equals the lookup key of the
+    object (along with any routes without an index key) are checked, still
+    in the order they were added, so the first match wins as before::
+
+        >>> from potpy.context import Context
+        >>> class KeyRouter(Router):
+        ...     def match(self, key, obj):
+        ...         if key == obj or key == '*':
+        ...             return {}
+        ...     def index_key(self, key):
+        ...         if key != '*':
+        ...             return key
+        ...     lookup_key = lambda self, obj: obj
+        ...
+        >>> router = KeyRouter(
+        ...     ('a', lambda: 'a'),
+        ...     ('*', lambda: 'anything'),  # not indexed, checked for all keys
+        ...     ('b', lambda: 'b'),
+        ... )
+        >>> router(Context(), 'a'), router(Context(), 'b')
+        ('a', 'anything')
+
+    **Caching**
+
+    When the same objects are routed over and over, set
+    :attr:`dispatch_cache` to a :class:`~potpy.cache.Cache` to remember the
+    route each object matched (or that none did), and the result of
+    :meth:`match`::
+
+        >>> from potpy.cache import Cache
+        >>> router.dispatch_cache = Cache(maxsize=1000)
+        >>> for i in range(3):
+        ...     result = router(Context(), 'b')
+        ...
+        >>> router.dispatch_cache.hits, router.dispatch_cache.misses
+        (2, 1)
     """
     class NoRoute(Exception):
         """
@@ -242,6 +1412,30 @@ class Router(object):
         """
         pass
 
+    #: The class used to wrap handlers that aren't already :class:`Route`
+    #: instances. Set to :class:`potpy.aio.AsyncRoute` for coroutine
+    #: handlers.
+    route_class = Route
+
+    #: Optional. A :class:`~potpy.cache.Cache` remembering the route each
+    #: routed object matched. Objects must be hashable to be cached; others
+    #: are matched as usual. The dict returned by :meth:`match` is remembered
+    #: too if its values are all immutable (strings, numbers, ``None``, and
+    #: tuples and frozensets of these). Otherwise, or for routes where
+    #: :meth:`cache_match` is false, only the route is remembered, and
+    #: :meth:`match` is called again for it, so that requests don't share
+    #: mutable values. The cache may be shared between routers, and entries
+    #: for a router are dropped when a route is added to it (or it is
+    #: reindexed).
+    dispatch_cache = None
+
+    # The indexed routes for each lookup key, each with the number of
+    # unindexed routes before it, and the unindexed routes, which are all
+    # that is checked for any other key; built on the first call after routes
+    # are added.
+    _index = None
+    _unindexed = ()
+
     def __init__(self, *routes):
         self.routes = []
         for route in routes:
@@ -253,12 +1447,94 @@ class Router(object):
         :param match: The first argument passed to the :meth:`match` method
             when checking against this handler.
         :param handler: A callable or :class:`Route` instance that will handle
-            matching calls. If not a Route instance, will be wrapped in one.
+            matching calls. If not a Route instance, will be wrapped in one
+            (see :attr:`route_class`).
+
+        .. note::
+
+            Modifying the ``routes`` list directly does not update the index
+            (see :meth:`index_key`); call :meth:`reindex` afterwards.
         """
         self.routes.append((match, (
-            Route(handler) if not isinstance(handler, Route)
+            self.route_class(handler) if not isinstance(handler, Route)
             else handler
         )))
+        self._index = None
+        if self.dispatch_cache is not None:
+            self.dispatch_cache.invalidate(self)
+
+    def index_key(self, match):
+        """Return the index key of a route, or ``None`` to always check it.
+
+        Subclasses may implement this, along with :meth:`lookup_key`, to
+        avoid checking every route in turn (see :class:`Router`). The
+        :meth:`match` method must only ever succeed for objects whose
+        :meth:`lookup_key` equals the ``match`` argument's index key. The
+        base implementation returns ``None``, so nothing is indexed.
+
+        :param match: The ``match`` argument corresponding to a handler
+            registered with :meth:`add`.
+        :returns: A hashable key, or ``None``.
+        """
+        return None
+
+    def lookup_key(self, obj):
+        """Return the key to look up routes for an object in the index.
+
+        See :meth:`index_key`. If this returns ``None``, every route is
+        checked. The base implementation returns ``None``.
+
+        :param obj: The object to match against.
+        """
+        return None
+
+    def cache_match(self, match):
+        """Return whether the :attr:`dispatch_cache` may keep the dict
+        :meth:`match` returns for a route.
+
+        If not, cached dispatches to the route still skip checking the
+        routes before it, but call :meth:`match` for it each time. The base
+        implementation returns ``True``.
+
+        :param match: The ``match`` argument corresponding to a handler
+            registered with :meth:`add`.
+        """
+        return True
+
+    def reindex(self):
+        """Rebuild the index of routes from the ``routes`` list, and forget
+        cached dispatches (see :attr:`dispatch_cache`).
+
+        The index is built automatically on the first call after :meth:`add`.
+        """
+        if self.dispatch_cache is not None:
+            self.dispatch_cache.invalidate(self)
+        self._build_index()
+
+    def _build_index(self):
+        index = {}
+        unindexed = []
+        for entry in self.routes:
+            key = self.index_key(entry[0])
+            if key is None:
+                unindexed.append(entry)
+            else:
+                index.setdefault(key, []).append((len(unindexed), entry))
+        self._index = index
+        self._unindexed = unindexed
+
+    def _indexed_routes(self, positions):
+        # The routes to check for a key with the given indexed routes: each
+        # after the unindexed routes before it, then the remaining ones.
+        unindexed = self._unindexed
+        start = 0
+        for stop, entry in positions:
+            for other in islice(unindexed, start, stop):
+                yield other
+            yield entry
+            start = stop
+        for other in islice(unindexed, start, None):
+            yield other
 
     def __call__(self, context, obj):
         """Route the given object to a matching handler.
@@ -266,13 +1542,233 @@ class Router(object):
         :param context: The :class:`~potpy.context.Context` object used when
             calling the matching handler.
         :param obj: The object to match against.
+        :returns: The result of the matching route. For an
+            :class:`~potpy.aio.AsyncRoute`, this is a coroutine, so an
+            asynchronous caller can wait for it.
         """
-        for match, route in self.routes:
-            m = self.match(match, obj)
-            if m is not None:
+        route = self._find(context, obj)
+        if route is None:
+            raise self.NoRoute(obj)
+        return route(context)
+
+    def try_route(self, context, obj):
+        """Route the given object, without raising :exc:`NoRoute`.
+
+        Like calling the router, except that if no route matches, :attr:`Miss`
+        is returned instead of raising :exc:`NoRoute`, which is cheaper when
+        misses are common. Routers nested in the matching route still raise
+        when they miss.
+
+            >>> from potpy.context import Context
+            >>> from potpy.wsgi import MethodRouter
+            >>> router = MethodRouter(('GET', lambda: 'got'))
+            >>> router.try_route(Context(), 'GET')
+            'got'
+            >>> router.try_route(Context(), 'POST') is router.Miss
+            True
+        """
+        route = self._find(context, obj)
+        if route is None:
+            return self.Miss
+        return route(context)
+
+    #: Returned by :meth:`try_route` when no route matches.
+    Miss = type('Miss', (), {})
+
+    def _find(self, context, obj):
+        # Find the matching route, and update the context with the match, or
+        # return None.
+        cache = self.dispatch_cache
+        if cache is not None:
+            try:
+                hash(obj)
+            except TypeError:
+                pass
+            else:
+                fresh = []
+                found = cache.get(
+                    self, obj, self._dispatch_entry, obj, fresh)
+                if found is None:
+                    return None
+                route, m, rematch = found
+                if rematch:
+                    # m is the route's match argument
+                    m = fresh[0] if fresh else self.match(m, obj)
                 context.update(m)
-                return route(context)
-        raise self.NoRoute(obj)
+                return route
+        found = self._dispatch(obj)
+        if found is None:
+            return None
+        context.update(found[1])
+        return found[0][1]
+
+    def _dispatch(self, obj):
+        # Find the matching (match, route) entry and match dict, or return
+        # None.
+        index = self._index
+        if index is None:
+            self._build_index()
+            index = self._index
+        routes = self.routes
+        if index:
+            key = self.lookup_key(obj)
+            if key is not None:
+                positions = index.get(key)
+                if positions is None:
+                    routes = self._unindexed
+                else:
+                    routes = self._indexed_routes(positions)
+        for entry in routes:
+            m = self.match(entry[0], obj)
+            if m is not None:
+                return entry, m
+
+    def _dispatch_entry(self, obj, fresh):
+        # A dispatch cache entry: the route, the match dict and False; or
+        # the route, its match argument and True, to match again for each
+        # call (except this one: the match dict is added to fresh).
+        found = self._dispatch(obj)
+        if found is None:
+            return None
+        entry, m = found
+        if self.cache_match(entry[0]) and \
+                all(_immutable(v) for v in m.itervalues()):
+            return entry[1], m, False
+        fresh.append(m)
+        return entry[1], entry[0], True
+
+    def classify_many(self, objs, processes=None, chunksize=1000):
+        """Match many objects against the router's routes, without calling
+        any handlers.
+
+        Useful for working out which routes a log of requests would have
+        hit. Routers nested in the routes are not followed, and the
+        :attr:`dispatch_cache` is not used.
+
+            >>> from potpy.wsgi import PathRouter
+            >>> router = PathRouter(
+            ...     ('/posts', lambda: None),
+            ...     ('/posts/{slug}', lambda: None),
+            ... )
+            >>> for result in router.classify_many(['/posts/foo', '/bar']):
+            ...     print result
+            (1, {'slug': 'foo'})
+            (None, None)
+
+        :param objs: An iterable of objects to match, read as they are
+            needed.
+        :param processes: Optional. The number of worker processes to spread
+            the work over. Workers are forked, so the router doesn't have to
+            be pickled, but objects and match results do. By default,
+            objects are matched in the calling process.
+        :param chunksize: The number of objects sent to a worker at a time.
+        :returns: An iterator of ``(index, params)`` tuples, one for each
+            object, in order: the position in ``routes`` of the first route
+            that matches the object and the dict returned by :meth:`match`,
+            or ``(None, None)`` if no route matches.
+        """
+        # built once here, rather than in each worker
+        if self._index is None:
+            self._build_index()
+        positions = dict(
+            (id(entry), index) for index, entry in enumerate(self.routes))
+        if processes is None:
+            return self._classify(objs, positions)
+        return _classify_in_processes(
+            self, positions, objs, processes, chunksize)
+
+    def _classify(self, objs, positions):
+        dispatch = self._dispatch
+        for obj in objs:
+            found = dispatch(obj)
+            if found is None:
+                yield None, None
+            else:
+                yield positions[id(found[0])], found[1]
+
+    DependencyError = Route.DependencyError
+
+    def instrument(self, instrument, name=None):
+        """Attach an instrument to the router's routes.
+
+        Each route without a name is named by :meth:`route_name`, after
+        ``name`` if given. See :meth:`Route.instrument`.
+        """
+        for match, route in self.routes:
+            if route.name is not None:
+                route.instrument(instrument)
+                continue
+            route_name = self.route_name(match)
+            if name is not None:
+                route_name = '%s %s' % (name, route_name)
+            route.instrument(instrument, route_name)
+
+    def uninstrument(self, instrument=None):
+        """Detach an instrument, or all instruments, from the router's routes.
+        """
+        for match, route in self.routes:
+            route.uninstrument(instrument)
+
+    def flatten(self):
+        """Flatten the router's routes. See :meth:`Route.flatten`."""
+        for match, route in self.routes:
+            route.flatten()
+
+    def route_name(self, match):
+        """Name a route for instrumentation.
+
+        The base implementation returns ``repr(match)``.
+
+        :param match: The ``match`` argument corresponding to a handler
+            registered with :meth:`add`.
+        """
+        return repr(match)
+
+    def analyze(self, context=()):
+        """Find the context items the router and its routes depend on.
+
+        See :meth:`Route.analyze`. Each route is analyzed with the keys given
+        by :meth:`match_keys` for its ``match`` argument added to the
+        context.
+        """
+        report = Dependencies()
+        known = _analysis_context(context)
+        _analyze_handler(report, known, None, None, self, _plan_args(self))
+        self._analyze(known, report)
+        return report
+
+    def prepare(self, context=(), release=False):
+        """Analyze the router and prepare its routes.
+
+        See :meth:`Route.prepare`.
+        """
+        report = self.analyze(context)
+        if not report.ok:
+            raise self.DependencyError(report)
+        report._install(release)
+        return report
+
+    def _analyze(self, known, report):
+        opaque = False
+        for match, route in self.routes:
+            branch = dict(known)
+            for key in self.match_keys(match):
+                branch[key] = _unknown
+            if route._analyze(branch, report):
+                opaque = True
+        return opaque
+
+    def match_keys(self, match):
+        """List the context keys added by a successful match.
+
+        Used by :meth:`analyze`. The base implementation returns an empty
+        list; subclasses whose :meth:`match` method returns a non-empty dict
+        should override this.
+
+        :param match: The ``match`` argument corresponding to a handler
+            registered with :meth:`add`.
+        """
+        return []
 
     def match(self, match, obj):
         """Check for a match.
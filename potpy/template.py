@@ -93,6 +93,11 @@ class Template(object):
         >>> t.fill(answer=42)
         'The answer is 42'
     """
+    #: Whether routers may keep the parameters matched from a string and
+    #: reuse them, rather than matching (and converting) the string again.
+    #: See :meth:`potpy.wsgi.PathRouter.cache_match`.
+    cacheable = True
+
     def __init__(self, template, **type_converters):
         self.template = template
         self.type_converters = type_converters
@@ -24,6 +24,8 @@ class Loader(object):
                 continue
             try:
                 docsuite = DocTestSuite(name)
+            except ImportError:
+                continue    # optional dependency not installed
             except ValueError, err:
                 if err.args[1] != 'has no tests':
                     raise
@@ -0,0 +1,598 @@
+from __future__ import with_statement
+import unittest
+if not hasattr(unittest.TestCase, 'assertIs'):
+    import unittest2 as unittest
+
+from mock import sentinel, Mock
+
+from potpy.context import (Context, volatile, singleton, per_thread,
+                           per_request)
+from potpy.router import Route, Router
+from potpy.cache import Cache
+from potpy.instrument import Collector
+try:
+    from potpy import aio
+    from trollius import coroutine, sleep, From, Return, get_event_loop
+    from trollius import CancelledError, gather, new_event_loop
+except ImportError:
+    aio = None
+
+
+class AsyncTestCase(unittest.TestCase):
+    def setUp(self):
+        if aio is None:
+            self.skipTest('trollius is not installed')
+        self.loop = get_event_loop()
+
+    def run_coroutine(self, coro):
+        return self.loop.run_until_complete(coro)
+
+
+class TestAInject(AsyncTestCase):
+    def setUp(self):
+        super(TestAInject, self).setUp()
+        self.running = 0
+        self.max_running = 0
+        self.calls = []
+
+    def slow(self, name, value):
+        @coroutine
+        def provider():
+            self.calls.append(name)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            yield From(sleep(0))
+            self.running -= 1
+            raise Return(value)
+        return provider
+
+    def test_injects_plain_values(self):
+        ctx = Context(foo=sentinel.foo)
+        self.assertIs(
+            self.run_coroutine(aio.ainject(ctx, lambda foo: foo)),
+            sentinel.foo
+        )
+
+    def test_injects_self_as_context(self):
+        ctx = Context()
+        self.assertIs(
+            self.run_coroutine(aio.ainject(ctx, lambda context: context)),
+            ctx
+        )
+
+    def test_waits_for_coroutine_providers(self):
+        ctx = Context(foo=self.slow('foo', sentinel.foo))
+        self.assertIs(
+            self.run_coroutine(aio.ainject(ctx, lambda foo: foo)),
+            sentinel.foo
+        )
+
+    def test_waits_for_coroutine_handlers(self):
+        ctx = Context(bar=sentinel.bar)
+        @coroutine
+        def handler(bar):
+            yield From(sleep(0))
+            raise Return((bar, sentinel.result))
+        self.assertEqual(
+            self.run_coroutine(aio.ainject(ctx, handler)),
+            (sentinel.bar, sentinel.result)
+        )
+
+    def test_injects_into_wrapped_coroutine_functions(self):
+        ctx = Context(bar=sentinel.bar)
+        handler = coroutine(lambda bar: bar)
+        self.assertIs(self.run_coroutine(aio.ainject(ctx, handler)),
+                      sentinel.bar)
+
+    def test_resolves_independent_providers_concurrently(self):
+        ctx = Context(
+            user=self.slow('user', sentinel.user),
+            account=self.slow('account', sentinel.account),
+            settings=self.slow('settings', sentinel.settings),
+        )
+        self.assertEqual(
+            self.run_coroutine(aio.ainject(
+                ctx, lambda user, account, settings: (
+                    user, account, settings))),
+            (sentinel.user, sentinel.account, sentinel.settings)
+        )
+        self.assertEqual(self.max_running, 3)
+
+    def test_resolves_shared_providers_once(self):
+        ctx = Context(
+            user=self.slow('user', sentinel.user),
+            account=lambda user: (user, sentinel.account),
+            settings=lambda user: (user, sentinel.settings),
+        )
+        self.run_coroutine(aio.ainject(
+            ctx, lambda user, account, settings: None))
+        self.assertEqual(self.calls, ['user'])
+        self.assertEqual(ctx['account'], (sentinel.user, sentinel.account))
+        self.assertEqual(self.calls, ['user'])
+
+    def test_volatile_providers_are_called_every_time(self):
+        ctx = Context(user=volatile(self.slow('user', sentinel.user)))
+        self.run_coroutine(aio.ainject(ctx, lambda user: None))
+        self.run_coroutine(aio.ainject(ctx, lambda user: None))
+        self.assertEqual(self.calls, ['user', 'user'])
+
+    def test_singleton_coroutine_providers_are_shared(self):
+        defaults = {'user': singleton(self.slow('user', sentinel.user))}
+        for i in range(2):
+            self.assertIs(
+                self.run_coroutine(aio.ainject(
+                    Context(defaults), lambda user: user)),
+                sentinel.user
+            )
+        self.assertEqual(self.calls, ['user'])
+
+    def test_failed_singleton_coroutine_is_called_again(self):
+        provider = Mock(side_effect=[ValueError, sentinel.user])
+        defaults = {'user': singleton(lambda: provider())}
+        with self.assertRaises(ValueError):
+            self.run_coroutine(aio.ainject(
+                Context(defaults), lambda user: user))
+        self.assertIs(
+            self.run_coroutine(aio.ainject(
+                Context(defaults), lambda user: user)),
+            sentinel.user
+        )
+
+    def test_concurrent_singleton_lookups_share_call(self):
+        defaults = {'user': singleton(self.slow('user', sentinel.user))}
+        self.assertEqual(
+            self.run_coroutine(gather(aio.aget(Context(defaults), 'user'),
+                                      aio.aget(Context(defaults), 'user'))),
+            [sentinel.user, sentinel.user]
+        )
+        self.assertEqual(self.calls, ['user'])
+
+    def test_awaited_singletons_keep_result(self):
+        for lifetime in singleton, per_thread:
+            defaults = {'user': lifetime(self.slow('user', sentinel.user))}
+            self.run_coroutine(aio.aget(Context(defaults), 'user'))
+            self.assertIs(Context(defaults)['user'], sentinel.user)
+            loop = new_event_loop()
+            try:
+                self.assertIs(
+                    loop.run_until_complete(
+                        aio.aget(Context(defaults), 'user')),
+                    sentinel.user
+                )
+            finally:
+                loop.close()
+        self.assertEqual(self.calls, ['user', 'user'])
+
+    def test_singleton_built_synchronously_can_be_awaited(self):
+        defaults = {'user': singleton(lambda: sentinel.user)}
+        Context(defaults)['user']
+        self.assertIs(
+            self.run_coroutine(aio.ainject(
+                Context(defaults), lambda user: user)),
+            sentinel.user
+        )
+
+    def test_per_request_providers_are_remembered(self):
+        ctx = Context(user=per_request(self.slow('user', sentinel.user)))
+        ctx.memoize = False
+        self.run_coroutine(aio.ainject(ctx, lambda user: None))
+        self.run_coroutine(aio.ainject(ctx, lambda user: None))
+        self.assertEqual(self.calls, ['user'])
+
+    def test_optional_args_use_default_when_missing(self):
+        ctx = Context()
+        self.assertIs(
+            self.run_coroutine(aio.ainject(
+                ctx, lambda foo=sentinel.default: foo)),
+            sentinel.default
+        )
+
+    def test_missing_args_raise_KeyError(self):
+        with self.assertRaises(KeyError):
+            self.run_coroutine(aio.ainject(Context(), lambda foo: foo))
+
+    def test_can_override_with_kwargs(self):
+        ctx = Context(foo=Mock(side_effect=AssertionError))
+        self.assertEqual(
+            self.run_coroutine(aio.ainject(
+                ctx, lambda foo, bar=None: (foo, bar),
+                foo=sentinel.foo, bar=sentinel.bar)),
+            (sentinel.foo, sentinel.bar)
+        )
+
+    def test_failed_providers_are_not_remembered(self):
+        provider = Mock(side_effect=[ValueError, sentinel.foo])
+        ctx = Context(foo=lambda: provider())
+        with self.assertRaises(ValueError):
+            self.run_coroutine(aio.ainject(ctx, lambda foo: foo))
+        self.assertIs(
+            self.run_coroutine(aio.ainject(ctx, lambda foo: foo)),
+            sentinel.foo
+        )
+
+    def test_context_ainject(self):
+        ctx = Context(foo=self.slow('foo', sentinel.foo))
+        self.assertIs(
+            self.run_coroutine(ctx.ainject(lambda foo: foo)),
+            sentinel.foo
+        )
+
+
+
+class TestAsyncRoute(AsyncTestCase):
+    def later(self, value):
+        @coroutine
+        def handler():
+            yield From(sleep(0))
+            raise Return(value)
+        return handler
+
+    def test_returns_coroutine(self):
+        route = aio.AsyncRoute(lambda: sentinel.result)
+        coro = route(Context())
+        self.assertTrue(aio._is_awaitable(coro))
+        self.assertIs(self.run_coroutine(coro), sentinel.result)
+
+    def test_waits_for_coroutine_handlers(self):
+        calls = []
+        route = aio.AsyncRoute(
+            self.later(sentinel.first),
+            lambda: calls.append(sentinel.second),
+            self.later(sentinel.third),
+        )
+        self.assertIs(self.run_coroutine(route(Context())), sentinel.third)
+        self.assertEqual(calls, [sentinel.second])
+
+    def test_names_awaited_results(self):
+        route = aio.AsyncRoute(
+            (self.later(sentinel.first), 'first'),
+            (lambda: sentinel.second, 'second'),
+            lambda first, second: (first, second),
+        )
+        context = Context()
+        self.assertEqual(self.run_coroutine(route(context)),
+                         (sentinel.first, sentinel.second))
+        self.assertIs(context['first'], sentinel.first)
+
+    def test_handlers_share_coroutine_context_items(self):
+        calls = []
+        @coroutine
+        def user(user_id):
+            calls.append(user_id)
+            yield From(sleep(0))
+            raise Return('user %d' % (user_id,))
+        route = aio.AsyncRoute(
+            (lambda user: user, 'first'),
+            lambda first, user: (first, user),
+        )
+        context = Context(user_id=1, user=user)
+        self.assertEqual(self.run_coroutine(route(context)),
+                         ('user 1', 'user 1'))
+        self.assertEqual(calls, [1])
+
+    def test_resolves_coroutine_items_of_prepared_routes(self):
+        @coroutine
+        def user(user_id):
+            yield From(sleep(0))
+            raise Return('user %d' % (user_id,))
+        context = Context(
+            user_id=1, user=user, name=lambda user: user.upper())
+        route = aio.AsyncRoute(lambda name: name)
+        route.prepare(context)
+        self.assertEqual(self.run_coroutine(route(context)), 'USER 1')
+
+    def test_previous_refers_to_awaited_result(self):
+        class Obj(object):
+            def method(self):
+                return sentinel.result
+        route = aio.AsyncRoute(self.later(Obj()), Route.previous.method)
+        self.assertIs(self.run_coroutine(route(Context())), sentinel.result)
+
+    def test_context_references(self):
+        class Obj(object):
+            def method(self):
+                return sentinel.result
+        route = aio.AsyncRoute(Route.context.obj.method)
+        self.assertIs(self.run_coroutine(route(Context(obj=Obj()))),
+                      sentinel.result)
+
+    def test_stop_from_coroutine(self):
+        @coroutine
+        def stopper():
+            yield From(sleep(0))
+            raise Route.Stop(sentinel.stopped)
+        route = aio.AsyncRoute(
+            stopper, lambda: Mock(side_effect=AssertionError)())
+        self.assertIs(self.run_coroutine(route(Context())), sentinel.stopped)
+
+    def test_stop_without_value_returns_previous_result(self):
+        route = aio.AsyncRoute(
+            self.later(sentinel.first),
+            lambda: Mock(side_effect=Route.Stop)()
+        )
+        self.assertIs(self.run_coroutine(route(Context())), sentinel.first)
+
+    def test_exception_handlers_catch_coroutine_failures(self):
+        MyException = type('MyException', (Exception,), {})
+        @coroutine
+        def raiser():
+            yield From(sleep(0))
+            raise MyException()
+        route = aio.AsyncRoute(
+            (raiser, 'result', [
+                (MyException, self.later(sentinel.handled))
+            ]),
+            lambda result: result
+        )
+        self.assertIs(self.run_coroutine(route(Context())), sentinel.handled)
+
+    def test_exception_handlers_get_exc_info(self):
+        MyException = type('MyException', (Exception,), {})
+        @coroutine
+        def raiser():
+            yield From(sleep(0))
+            raise MyException()
+        route = aio.AsyncRoute()
+        route.add(raiser, exception_handlers=[
+            (MyException, lambda exc_info: exc_info[0])
+        ])
+        self.assertIs(self.run_coroutine(route(Context())), MyException)
+
+    def test_unhandled_exceptions_are_raised(self):
+        MyException = type('MyException', (Exception,), {})
+        OtherException = type('OtherException', (Exception,), {})
+        @coroutine
+        def raiser():
+            yield From(sleep(0))
+            raise MyException()
+        route = aio.AsyncRoute()
+        route.add(raiser, exception_handlers=[
+            (OtherException, lambda: Mock(side_effect=AssertionError)())
+        ])
+        with self.assertRaises(MyException):
+            self.run_coroutine(route(Context()))
+
+    def test_sync_exceptions_are_handled(self):
+        MyException = type('MyException', (Exception,), {})
+        route = aio.AsyncRoute()
+        route.add(lambda: Mock(side_effect=MyException)(),
+                  exception_handlers=[
+                      (MyException, self.later(sentinel.handled))
+                  ])
+        self.assertIs(self.run_coroutine(route(Context())), sentinel.handled)
+
+    def test_async_subroutes(self):
+        route = aio.AsyncRoute(
+            aio.AsyncRoute((self.later(sentinel.inner), 'inner')),
+            lambda inner: (inner, sentinel.outer),
+        )
+        self.assertEqual(self.run_coroutine(route(Context())),
+                         (sentinel.inner, sentinel.outer))
+
+    def test_router_route_class(self):
+        class AsyncRouter(Router):
+            route_class = aio.AsyncRoute
+            def match(self, match, obj):
+                if match == obj:
+                    return {}
+        router = AsyncRouter(('foo', self.later(sentinel.foo)))
+        self.assertIsInstance(router.routes[0][1], aio.AsyncRoute)
+        route = aio.AsyncRoute(
+            lambda: 'foo',
+            lambda context: router(context, 'foo'),
+        )
+        self.assertIs(self.run_coroutine(route(Context())), sentinel.foo)
+
+
+class TestAsyncParallel(AsyncTestCase):
+    def setUp(self):
+        super(TestAsyncParallel, self).setUp()
+        self.running = 0
+        self.max_running = 0
+        self.cancelled = []
+
+    def slow(self, name, value, delay=0):
+        @coroutine
+        def handler():
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            try:
+                yield From(sleep(delay))
+            except CancelledError:
+                self.cancelled.append(name)
+                raise
+            finally:
+                self.running -= 1
+            raise Return(value)
+        return handler
+
+    def test_runs_coroutines_concurrently(self):
+        route = aio.AsyncRoute(
+            Route.parallel(
+                (self.slow('foo', sentinel.foo), 'foo'),
+                (lambda: sentinel.bar, 'bar'),
+                (self.slow('baz', sentinel.baz), 'baz'),
+            ),
+            lambda foo, bar, baz: (foo, bar, baz),
+        )
+        self.assertEqual(self.run_coroutine(route(Context())),
+                         (sentinel.foo, sentinel.bar, sentinel.baz))
+        self.assertEqual(self.max_running, 2)
+
+    def test_handlers_can_refer_to_context_items(self):
+        class Repo(object):
+            getall = staticmethod(self.slow('getall', sentinel.todos))
+            def count(self):
+                return 2
+        route = aio.AsyncRoute(Route.parallel(
+            (Route.context.repo.getall, 'todos'),
+            (Route.context.repo.count, 'count'),
+        ))
+        self.assertEqual(self.run_coroutine(route(Context(repo=Repo()))),
+                         (sentinel.todos, 2))
+
+    def test_exception_handlers_per_handler(self):
+        MyException = type('MyException', (Exception,), {})
+        @coroutine
+        def raiser():
+            yield From(sleep(0))
+            raise MyException()
+        route = aio.AsyncRoute(Route.parallel(
+            (raiser, 'foo', [
+                (MyException, lambda exc_info: exc_info[0])
+            ]),
+            (self.slow('bar', sentinel.bar), 'bar'),
+        ))
+        self.assertEqual(self.run_coroutine(route(Context())),
+                         (MyException, sentinel.bar))
+
+    def test_first_failure_cancels_the_rest(self):
+        MyException = type('MyException', (Exception,), {})
+        @coroutine
+        def raiser():
+            yield From(sleep(0))
+            raise MyException()
+        context = Context()
+        route = aio.AsyncRoute(Route.parallel(
+            (self.slow('foo', sentinel.foo, 5), 'foo'),
+            (raiser, 'bar'),
+        ))
+        with self.assertRaises(MyException):
+            self.run_coroutine(route(context))
+        self.run_coroutine(sleep(0))
+        self.assertEqual(self.cancelled, ['foo'])
+        self.assertNotIn('foo', context)
+
+    def test_sync_failure_cancels_started_coroutines(self):
+        MyException = type('MyException', (Exception,), {})
+        route = aio.AsyncRoute(Route.parallel(
+            (self.slow('foo', sentinel.foo, 5), 'foo'),
+            (lambda: Mock(side_effect=MyException)(), 'bar'),
+        ))
+        with self.assertRaises(MyException):
+            self.run_coroutine(route(Context()))
+        self.run_coroutine(sleep(0))
+        self.assertEqual(self.running, 0)
+
+
+
+class TestAsyncCache(AsyncTestCase):
+    def test_caches_coroutine_results(self):
+        calls = []
+        @coroutine
+        def handler(foo):
+            calls.append(foo)
+            yield From(sleep(0))
+            raise Return(foo)
+        route = aio.AsyncRoute()
+        route.add(handler, 'result', cache=Cache(['foo']))
+        route.add(lambda result: result)
+        for i in range(2):
+            self.assertIs(self.run_coroutine(route(Context(foo=sentinel.foo))),
+                          sentinel.foo)
+        self.assertEqual(calls, [sentinel.foo])
+
+    def test_concurrent_misses_wait_for_the_same_result(self):
+        calls = []
+        @coroutine
+        def handler():
+            calls.append(None)
+            yield From(sleep(0))
+            raise Return(sentinel.result)
+        route = aio.AsyncRoute()
+        route.add(handler, cache=Cache())
+        self.assertEqual(
+            self.run_coroutine(gather(route(Context()), route(Context()))),
+            [sentinel.result, sentinel.result]
+        )
+        self.assertEqual(len(calls), 1)
+
+    def test_failed_coroutines_are_not_cached(self):
+        results = [ValueError(), sentinel.result]
+        @coroutine
+        def handler():
+            yield From(sleep(0))
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            raise Return(result)
+        route = aio.AsyncRoute()
+        route.add(handler, cache=Cache())
+        with self.assertRaises(ValueError):
+            self.run_coroutine(route(Context()))
+        self.assertIs(self.run_coroutine(route(Context())), sentinel.result)
+
+
+class TestAsyncInstrumentation(AsyncTestCase):
+    def test_times_coroutines_until_they_finish(self):
+        times = [0, 1, 5, 8]
+        collector = Collector(buckets=(2,), timer=lambda: times.pop(0))
+        @coroutine
+        def handler():
+            yield From(sleep(0))
+        route = aio.AsyncRoute(handler, lambda: Mock(side_effect=Route.Stop)())
+        route.instrument(collector, 'route')
+        self.run_coroutine(route(Context()))
+        stats = collector.snapshot()
+        self.assertEqual(
+            (stats['route', 'handler']['total'],
+             stats['route', 'handler']['ok']),
+            (1, 1)
+        )
+        self.assertEqual(stats['route', '<lambda>']['stop'], 1)
+
+    def test_records_coroutine_failures(self):
+        collector = Collector()
+        @coroutine
+        def handler():
+            yield From(sleep(0))
+            raise ValueError()
+        route = aio.AsyncRoute(handler)
+        route.instrument(collector, 'route')
+        with self.assertRaises(ValueError):
+            self.run_coroutine(route(Context()))
+        self.assertEqual(collector.snapshot()['route', 'handler']['error'], 1)
+
+
+class TestAsyncStop(AsyncTestCase):
+    def test_returned_stop(self):
+        @coroutine
+        def stopper():
+            yield From(sleep(0))
+            raise Return(Route.Stop(sentinel.stopped))
+        route = aio.AsyncRoute((stopper, 'name'), lambda: sentinel.not_result)
+        context = Context()
+        self.assertIs(self.run_coroutine(route(context)), sentinel.stopped)
+        self.assertNotIn('name', context)
+
+    def test_returned_stop_is_reported_to_instruments(self):
+        collector = Collector()
+        route = aio.AsyncRoute(lambda: Route.Stop())
+        route.instrument(collector, 'route')
+        self.run_coroutine(route(Context()))
+        self.assertEqual(collector.snapshot()['route', '<lambda>']['stop'], 1)
+
+
+class TestAsyncRelease(AsyncTestCase):
+    def test_releases_coroutine_results_after_last_use(self):
+        @coroutine
+        def load():
+            yield From(sleep(0))
+            raise Return(sentinel.payload)
+        @coroutine
+        def transform(payload):
+            yield From(sleep(0))
+            raise Return(payload)
+        route = aio.AsyncRoute(
+            (load, 'payload'),
+            (transform, 'result'),
+            lambda result: result,
+        )
+        route.prepare(release=True)
+        context = Context()
+        self.assertIs(self.run_coroutine(route(context)), sentinel.payload)
+        self.assertEqual(context, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
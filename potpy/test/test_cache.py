@@ -0,0 +1,207 @@
+from __future__ import with_statement
+import unittest
+if not hasattr(unittest.TestCase, 'assertIs'):
+    import unittest2 as unittest
+
+import threading
+from mock import sentinel, Mock
+
+from potpy.context import Context
+from potpy.router import Route
+from potpy import cache
+
+
+class Timer(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.timer = Timer()
+        self.cache = cache.Cache(['foo'], maxsize=2, ttl=10, timer=self.timer)
+
+    def test_computes_on_miss(self):
+        func = Mock(return_value=sentinel.result)
+        self.assertIs(
+            self.cache.get(sentinel.handler, (1,), func, sentinel.arg),
+            sentinel.result
+        )
+        func.assert_called_once_with(sentinel.arg)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 1))
+
+    def test_returns_cached_result_on_hit(self):
+        func = Mock(return_value=sentinel.result)
+        self.cache.get(sentinel.handler, (1,), func)
+        self.assertIs(self.cache.get(sentinel.handler, (1,), func),
+                      sentinel.result)
+        self.assertEqual(func.call_count, 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_hit_ratio(self):
+        self.assertIs(self.cache.hit_ratio, None)
+        for i in range(4):
+            self.cache.get(sentinel.handler, (1,), lambda: sentinel.result)
+        self.assertEqual(self.cache.hit_ratio, 0.75)
+
+    def test_keys_on_handler_and_values(self):
+        self.cache.get(sentinel.handler, (1,), lambda: sentinel.first)
+        self.assertIs(
+            self.cache.get(sentinel.handler, (2,), lambda: sentinel.second),
+            sentinel.second
+        )
+        self.assertIs(
+            self.cache.get(sentinel.other, (1,), lambda: sentinel.third),
+            sentinel.third
+        )
+
+    def test_drops_least_recently_used(self):
+        self.cache.get(sentinel.handler, (1,), lambda: 1)
+        self.cache.get(sentinel.handler, (2,), lambda: 2)
+        self.cache.get(sentinel.handler, (1,), lambda: None)
+        self.cache.get(sentinel.handler, (3,), lambda: 3)
+        self.assertEqual(len(self.cache), 2)
+        self.assertIn((sentinel.handler, (1,)), self.cache)
+        self.assertNotIn((sentinel.handler, (2,)), self.cache)
+        self.assertIn((sentinel.handler, (3,)), self.cache)
+
+    def test_unbounded(self):
+        c = cache.Cache(maxsize=None)
+        for i in range(200):
+            c.get(sentinel.handler, (i,), lambda: i)
+        self.assertEqual(len(c), 200)
+
+    def test_results_expire(self):
+        self.cache.get(sentinel.handler, (1,), lambda: sentinel.first)
+        self.timer.now = 9
+        self.assertIs(
+            self.cache.get(sentinel.handler, (1,), lambda: sentinel.second),
+            sentinel.first
+        )
+        self.timer.now = 10
+        self.assertIs(
+            self.cache.get(sentinel.handler, (1,), lambda: sentinel.second),
+            sentinel.second
+        )
+
+    def test_failures_are_not_cached(self):
+        func = Mock(side_effect=[ValueError, sentinel.result])
+        with self.assertRaises(ValueError):
+            self.cache.get(sentinel.handler, (1,), func)
+        self.assertIs(self.cache.get(sentinel.handler, (1,), func),
+                      sentinel.result)
+
+    def test_invalidate_by_handler(self):
+        self.cache.get(sentinel.handler, (1,), lambda: 1)
+        self.cache.get(sentinel.other, (1,), lambda: 2)
+        self.cache.invalidate(sentinel.handler)
+        self.assertEqual(self.cache._entries.keys(), [(sentinel.other, (1,))])
+
+    def test_invalidate_by_key(self):
+        self.cache.get(sentinel.handler, (1,), lambda: 1)
+        self.cache.get(sentinel.handler, (2,), lambda: 2)
+        self.cache.invalidate(key=(1,))
+        self.assertEqual(self.cache._entries.keys(),
+                         [(sentinel.handler, (2,))])
+
+    def test_invalidate_by_handler_and_key(self):
+        self.cache.get(sentinel.handler, (1,), lambda: 1)
+        self.cache.get(sentinel.other, (1,), lambda: 2)
+        self.cache.invalidate(sentinel.other, (1,))
+        self.assertEqual(self.cache._entries.keys(),
+                         [(sentinel.handler, (1,))])
+
+    def test_clear(self):
+        self.cache.get(sentinel.handler, (1,), lambda: 1)
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_module_invalidate_covers_every_cache(self):
+        other = cache.Cache()
+        self.cache.get(sentinel.handler, (1,), lambda: 1)
+        other.get(sentinel.handler, (), lambda: 1)
+        cache.invalidate(sentinel.handler)
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(len(other), 0)
+
+    def test_concurrent_misses_compute_once(self):
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        def func():
+            calls.append(None)
+            started.set()
+            release.wait(5)
+            return sentinel.result
+        results = []
+        def get():
+            results.append(self.cache.get(sentinel.handler, (1,), func))
+        threads = [threading.Thread(target=get) for i in range(3)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [sentinel.result] * 3)
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+
+    def test_invalidated_computation_is_not_cached(self):
+        def func():
+            self.cache.invalidate(sentinel.handler)
+            return sentinel.result
+        self.assertIs(self.cache.get(sentinel.handler, (1,), func),
+                      sentinel.result)
+        self.assertEqual(len(self.cache), 0)
+
+
+class TestRouteCache(unittest.TestCase):
+    def test_caches_handler_results_by_key(self):
+        calls = []
+        def handler(foo, bar):
+            calls.append((foo, bar))
+            return foo, bar
+        route = Route()
+        route.add(handler, 'result', cache=cache.Cache(['foo']))
+        route.add(lambda result: result)
+        self.assertEqual(route(Context(foo=1, bar=1)), (1, 1))
+        self.assertEqual(route(Context(foo=1, bar=2)), (1, 1))
+        self.assertEqual(route(Context(foo=2, bar=2)), (2, 2))
+        self.assertEqual(calls, [(1, 1), (2, 2)])
+
+    def test_caches_results_of_context_references(self):
+        calls = []
+        class Repository(object):
+            def getall(self):
+                calls.append(None)
+                return sentinel.todos
+        route = Route()
+        route.add(Route.context.repository.getall, cache=cache.Cache())
+        for i in range(2):
+            self.assertIs(route(Context(repository=Repository())),
+                          sentinel.todos)
+        self.assertEqual(len(calls), 1)
+
+    def test_caches_exception_handler_results(self):
+        handler = Mock(side_effect=KeyError)
+        route = Route()
+        route.add(lambda: handler(), exception_handlers=[
+            (KeyError, lambda: sentinel.handled)
+        ], cache=cache.Cache())
+        for i in range(2):
+            self.assertIs(route(Context()), sentinel.handled)
+        self.assertEqual(handler.call_count, 1)
+
+    def test_analysis_includes_cache_keys(self):
+        route = Route()
+        route.add(lambda: None, cache=cache.Cache(['foo']))
+        self.assertEqual(route.analyze({}).missing.keys(), ['foo'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+from __future__ import with_statement
+import unittest
+if not hasattr(unittest.TestCase, 'assertIs'):
+    import unittest2 as unittest
+
+import os
+import tempfile
+from StringIO import StringIO
+
+from potpy.wsgi import PathRouter, App
+from potpy import classify
+
+
+router = PathRouter(
+    ('/', lambda: None),
+    ('/posts/{slug}', lambda: None),
+)
+app = App(router)
+
+
+class TestReadPaths(unittest.TestCase):
+    def test_reads_combined_log_format(self):
+        line = ('127.0.0.1 - frank [10/Oct/2000:13:55:36 -0700] '
+                '"POST /posts/foo HTTP/1.1" 200 2326 "http://example.com/" '
+                '"Mozilla/5.0"\n')
+        self.assertEqual(list(classify.read_paths([line])), ['/posts/foo'])
+
+    def test_reads_bare_paths(self):
+        self.assertEqual(list(classify.read_paths(['/foo\n', '/bar 200\n'])),
+                         ['/foo', '/bar'])
+
+    def test_drops_query_and_decodes_escapes(self):
+        self.assertEqual(
+            list(classify.read_paths(['"GET /a%2Fb?c=d HTTP/1.0"'])),
+            ['/a/b'])
+
+    def test_skips_other_lines(self):
+        self.assertEqual(list(classify.read_paths(['\n', 'foo\n'])), [])
+
+
+class TestCountHits(unittest.TestCase):
+    def test_counts_hits_per_route(self):
+        self.assertEqual(
+            classify.count_hits(router, ['/posts/a', '/x', '/posts/b', '/']),
+            [(2, '/posts/{slug}'), (1, '/'), (1, None)]
+        )
+
+    def test_worker_processes(self):
+        paths = ['/posts/a', '/x', '/'] * 10
+        self.assertEqual(
+            classify.count_hits(router, paths, processes=2, chunksize=4),
+            classify.count_hits(router, paths)
+        )
+
+
+class TestLoadRouter(unittest.TestCase):
+    def test_loads_router(self):
+        self.assertIs(
+            classify.load_router('potpy.test.test_classify:router'), router)
+
+    def test_loads_router_of_app(self):
+        self.assertIs(
+            classify.load_router('potpy.test.test_classify:app'), router)
+
+    def test_requires_name(self):
+        with self.assertRaises(ValueError):
+            classify.load_router('potpy.test.test_classify')
+
+
+class TestMain(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        f = os.fdopen(fd, 'w')
+        f.write('"GET /posts/a HTTP/1.1" 200\n'
+                '"GET /posts/b HTTP/1.1" 200\n'
+                '"GET /missing HTTP/1.1" 404\n')
+        f.close()
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_prints_hit_counts(self):
+        out = StringIO()
+        classify.main(['potpy.test.test_classify:router', self.filename], out)
+        self.assertEqual(out.getvalue(), (
+            '   hits  route\n'
+            '      2  /posts/{slug}\n'
+            '      1  (no route)\n'
+        ))
+
+
+if __name__ == '__main__':
+    unittest.main()
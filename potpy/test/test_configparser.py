@@ -87,6 +87,40 @@ class TestParseHandlerSpec(unittest.TestCase):
             str(assertion.exception), 'expecting handler spec')
 
 
+class TestParseCacheSpec(unittest.TestCase):
+    def test_no_cache(self):
+        self.assertIs(configparser.parse_cache_spec('foo.bar (baz):'), None)
+
+    def test_empty_cache(self):
+        self.assertEqual(configparser.parse_cache_spec('foo.bar cache()'),
+                         ([], {}))
+
+    def test_keys_and_options(self):
+        self.assertEqual(
+            configparser.parse_cache_spec(
+                'foo.bar (baz) cache(a, b, maxsize=10, ttl=1.5):'),
+            (['a', 'b'], {'maxsize': 10, 'ttl': 1.5})
+        )
+
+    def test_handler_spec_ignores_cache(self):
+        self.assertEqual(
+            configparser.parse_handler_spec('foo.bar (baz) cache(a)'),
+            ('foo.bar', 'baz')
+        )
+
+    def test_raises_SyntaxError_for_unknown_option(self):
+        with self.assertRaises(SyntaxError) as assertion:
+            configparser.parse_cache_spec('foo.bar cache(size=1)')
+        self.assertEqual(
+            str(assertion.exception), "unknown cache option 'size'")
+
+    def test_raises_SyntaxError_for_bad_value(self):
+        with self.assertRaises(SyntaxError) as assertion:
+            configparser.parse_cache_spec('foo.bar cache(maxsize=1.5)')
+        self.assertEqual(
+            str(assertion.exception), "bad value for cache option 'maxsize'")
+
+
 class TestParseExceptionHandlerSpec(unittest.TestCase):
     def test_single_type(self):
         types, handler = configparser.parse_exception_handler_spec(
@@ -130,6 +164,10 @@ class TestSplitIndent(unittest.TestCase):
             configparser.split_indent('foo#bar'), (0, 'foo'))
 
 
+def ctx_inject(router, **kwargs):
+    return Context(**kwargs).inject(router)
+
+
 class TestParseConfig(unittest.TestCase):
     def test_simple_config(self):
         module = ModuleType('module')
@@ -212,6 +250,58 @@ class TestParseConfig(unittest.TestCase):
             (sentinel.a7, sentinel.a8, sentinel.a9)
         )
 
+    def test_mounts(self):
+        module = ModuleType('module')
+        module.handler1 = lambda script_name, path_info, slug: (
+            script_name, path_info, slug)
+        module.handler2 = lambda version: version
+        module.exc1 = type('exc1', (Exception,), {})
+        module.handler3 = lambda: Mock(side_effect=module.exc1)()
+        module.handler4 = lambda: sentinel.a4
+        config = """
+        api /api/v{version:\d+}/* (version: int):
+            posts /posts/*:
+                post /{slug}:
+                    handler1
+            version /version:
+                handler2
+        /error:
+            handler3:
+                exc1: handler4
+        """
+        router = configparser.parse_config(config.splitlines(), module)
+        self.assertEqual(
+            ctx_inject(router, path_info='/api/v2/posts/foo'),
+            ('/api/v2/posts', '/foo', 'foo'))
+        self.assertEqual(ctx_inject(router, path_info='/api/v3/version'), 3)
+        self.assertIs(ctx_inject(router, path_info='/error'), sentinel.a4)
+        self.assertEqual(router.reverse('api', version=2), '/api/v2')
+
+    def test_cached_handler(self):
+        module = ModuleType('module')
+        calls = []
+        module.handler1 = lambda a1: calls.append(a1) or sentinel.a2
+        module.handler2 = lambda a2: a2
+        module.exc1 = type('exc1', (Exception,), {})
+        config = """
+        /{a1}:
+            * GET:
+                handler1 (a2) cache(a1, maxsize=10, ttl=30):
+                    exc1: handler2
+                handler2
+        """
+        router = configparser.parse_config(config.splitlines(), module)
+        for i in range(2):
+            self.assertIs(
+                ctx_inject(router, path_info='/foo', request_method='GET'),
+                sentinel.a2
+            )
+        self.assertEqual(calls, ['foo'])
+        method_router = router.routes[0][1].route[0][1]
+        c = method_router.routes[0][1].route[0][1].cache
+        self.assertEqual(
+            (c.keys, c.maxsize, c.ttl, c.hits), (('a1',), 10, 30.0, 1))
+
     def test_omitting_module_uses_calling_module(self):
         config = """
         /:
@@ -3,11 +3,18 @@ import unittest
 if not hasattr(unittest.TestCase, 'assertIs'):
     import unittest2 as unittest
 
+import gc
+import pickle
+import threading
 from mock import sentinel, Mock
 
 from potpy import context
 
 
+def shout(name):
+    return name.upper()
+
+
 class TestContext(unittest.TestCase):
     def setUp(self):
         self.context = context.Context(
@@ -119,5 +126,451 @@ class TestContext(unittest.TestCase):
         )
 
 
+class TestMemoization(unittest.TestCase):
+    def setUp(self):
+        self.provider = Mock(return_value=sentinel.result)
+        self.context = context.Context(
+            foo=lambda: self.provider(),
+            bar=lambda foo: (foo, self.provider()),
+            baz=sentinel.baz,
+        )
+
+    def test_callable_items_are_called_once(self):
+        self.assertIs(self.context['foo'], sentinel.result)
+        self.assertIs(self.context['foo'], sentinel.result)
+        self.assertEqual(self.provider.call_count, 1)
+
+    def test_injected_items_are_remembered(self):
+        self.context.inject(lambda foo, bar: None)
+        self.context.inject(lambda foo, bar: None)
+        self.assertEqual(self.provider.call_count, 2)
+
+    def test_replacing_item_forgets_result(self):
+        self.context['foo']
+        self.context['foo'] = lambda: sentinel.other
+        self.assertIs(self.context['foo'], sentinel.other)
+
+    def test_changing_dependency_forgets_dependents(self):
+        self.context['bar']
+        self.context['foo'] = sentinel.foo
+        self.assertEqual(
+            self.context['bar'], (sentinel.foo, sentinel.result))
+
+    def test_changing_dependency_forgets_transitive_dependents(self):
+        self.context['foo'] = lambda baz: baz
+        self.context['bar'] = lambda foo: foo
+        self.assertIs(self.context['bar'], sentinel.baz)
+        self.context.update(baz=sentinel.other)
+        self.assertIs(self.context['bar'], sentinel.other)
+
+    def test_updating_from_iterator_forgets_dependents(self):
+        self.context['bar']
+        self.context.update(iter([('foo', sentinel.foo)]))
+        self.assertEqual(
+            self.context['bar'], (sentinel.foo, sentinel.result))
+
+    def test_deleting_dependency_forgets_dependents(self):
+        self.context['foo'] = lambda baz=sentinel.default: baz
+        self.assertIs(self.context['foo'], sentinel.baz)
+        del self.context['baz']
+        self.assertIs(self.context['foo'], sentinel.default)
+
+    def test_changes_forget_items_that_take_the_context(self):
+        self.context['foo'] = lambda context: context['baz']
+        self.assertIs(self.context['foo'], sentinel.baz)
+        self.context['baz'] = sentinel.other
+        self.assertIs(self.context['foo'], sentinel.other)
+
+    def test_volatile_keys_are_called_every_time(self):
+        self.context.volatile_keys = frozenset(['foo'])
+        self.context['foo']
+        self.context['foo']
+        self.assertEqual(self.provider.call_count, 2)
+
+    def test_volatile_providers_are_called_every_time(self):
+        self.context['foo'] = context.volatile(lambda baz: self.provider(baz))
+        self.context['foo']
+        self.context['foo']
+        self.assertEqual(
+            self.provider.call_args_list,
+            [((sentinel.baz,),), ((sentinel.baz,),)]
+        )
+
+    def test_volatile_providers_can_be_injected(self):
+        self.assertIs(
+            self.context.inject(context.volatile(lambda baz: baz)),
+            sentinel.baz
+        )
+
+    def test_memoize_can_be_disabled(self):
+        self.context.memoize = False
+        self.context['foo']
+        self.context['foo']
+        self.assertEqual(self.provider.call_count, 2)
+
+    def test_resolve_remembers_items(self):
+        self.context.resolve(['foo', 'bar'])
+        self.context['bar']
+        self.assertEqual(self.provider.call_count, 2)
+
+    def test_resolve_skips_volatile_keys(self):
+        self.context.volatile_keys = frozenset(['foo'])
+        self.context.resolve(['foo'])
+        self.assertFalse(self.provider.called)
+
+    def test_resolve_does_nothing_when_not_memoizing(self):
+        self.context.memoize = False
+        self.context.resolve(['foo'])
+        self.assertFalse(self.provider.called)
+
+    def test_failed_calls_are_not_remembered(self):
+        self.provider.side_effect = [KeyError, sentinel.result]
+        with self.assertRaises(KeyError):
+            self.context['foo']
+        self.assertIs(self.context['foo'], sentinel.result)
+
+    def test_can_be_pickled(self):
+        ctx = context.Context(name='foo', shout=shout)
+        ctx.volatile_keys = frozenset(['name'])
+        self.assertEqual(ctx['shout'], 'FOO')
+        for protocol in xrange(pickle.HIGHEST_PROTOCOL + 1):
+            copy = pickle.loads(pickle.dumps(ctx, protocol))
+            self.assertEqual(copy, {'name': 'foo', 'shout': shout})
+            self.assertEqual(copy.volatile_keys, frozenset(['name']))
+            self.assertEqual(copy['shout'], 'FOO')
+            copy['name'] = 'bar'
+            self.assertEqual(copy['shout'], 'BAR')
+
+
+class TestLifetimes(unittest.TestCase):
+    def setUp(self):
+        self.provider = Mock(side_effect=lambda foo: object())
+
+    def test_per_request_items_are_remembered_when_not_memoizing(self):
+        ctx = context.Context(
+            foo=sentinel.foo,
+            bar=context.per_request(lambda foo: self.provider(foo)),
+        )
+        ctx.memoize = False
+        self.assertIs(ctx['bar'], ctx['bar'])
+        self.provider.assert_called_once_with(sentinel.foo)
+        self.assertIsNot(context.Context(ctx)['bar'], ctx['bar'])
+
+    def test_per_request_items_are_forgotten_on_change(self):
+        ctx = context.Context(
+            foo=sentinel.foo,
+            bar=context.per_request(lambda foo: self.provider(foo)),
+        )
+        ctx['bar']
+        ctx['foo'] = sentinel.other
+        ctx['bar']
+        self.assertEqual(
+            self.provider.call_args_list,
+            [((sentinel.foo,),), ((sentinel.other,),)]
+        )
+
+    def test_singleton_items_are_shared_between_contexts(self):
+        defaults = {
+            'foo': sentinel.foo,
+            'bar': context.singleton(lambda foo: self.provider(foo)),
+        }
+        self.assertIs(
+            context.Context(defaults)['bar'],
+            context.LayeredContext(defaults, foo=sentinel.other)['bar']
+        )
+        self.provider.assert_called_once_with(sentinel.foo)
+
+    def test_singleton_reset(self):
+        bar = context.singleton(lambda foo: self.provider(foo))
+        ctx = context.Context(foo=sentinel.foo, bar=bar)
+        first = ctx['bar']
+        bar.reset()
+        self.assertIsNot(context.Context(ctx)['bar'], first)
+
+    def test_failed_singleton_is_called_again(self):
+        self.provider.side_effect = [ValueError, sentinel.bar]
+        defaults = {
+            'foo': sentinel.foo,
+            'bar': context.singleton(lambda foo: self.provider(foo)),
+        }
+        with self.assertRaises(ValueError):
+            context.Context(defaults)['bar']
+        self.assertIs(context.Context(defaults)['bar'], sentinel.bar)
+
+    def test_singleton_is_built_once_by_concurrent_threads(self):
+        started = threading.Event()
+        def provider():
+            started.wait()
+            return object()
+        bar = context.singleton(provider)
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(context.Context(bar=bar)['bar']))
+            for i in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        started.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 4)
+        self.assertEqual(len(set(map(id, results))), 1)
+
+    def test_per_thread_items_are_shared_within_a_thread(self):
+        defaults = {
+            'foo': sentinel.foo,
+            'bar': context.per_thread(lambda foo: self.provider(foo)),
+        }
+        first = context.Context(defaults)['bar']
+        self.assertIs(context.Context(defaults)['bar'], first)
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(context.Context(defaults)['bar']))
+        thread.start()
+        thread.join()
+        self.assertIsNot(results[0], first)
+        self.assertEqual(self.provider.call_count, 2)
+
+    def test_per_thread_reset(self):
+        bar = context.per_thread(lambda foo: self.provider(foo))
+        ctx = context.Context(foo=sentinel.foo, bar=bar)
+        first = ctx['bar']
+        bar.reset()
+        bar.reset()
+        self.assertIsNot(context.Context(ctx)['bar'], first)
+
+    def test_lifetimes_can_be_injected(self):
+        self.assertIs(
+            context.Context(baz=sentinel.baz).inject(
+                context.singleton(lambda baz: baz)),
+            sentinel.baz
+        )
+
+
+class TestLayeredContext(unittest.TestCase):
+    def setUp(self):
+        self.parent = {
+            'foo': sentinel.foo,
+            'bar': lambda foo: (foo, sentinel.bar),
+        }
+        self.context = context.LayeredContext(self.parent, baz=sentinel.baz)
+
+    def test_is_a_context(self):
+        self.assertTrue(isinstance(self.context, context.Context))
+
+    def test_looks_up_items_in_parent(self):
+        self.assertIs(self.context['foo'], sentinel.foo)
+        self.assertIs(self.context['baz'], sentinel.baz)
+
+    def test_injects_items_from_parent(self):
+        self.assertEqual(
+            self.context.inject(lambda bar, baz: (bar, baz)),
+            ((sentinel.foo, sentinel.bar), sentinel.baz)
+        )
+
+    def test_injects_self_as_context(self):
+        self.assertIs(
+            self.context.inject(lambda context: context), self.context)
+
+    def test_context_item_copies_parent_items(self):
+        ctx = self.context['context']
+        self.assertEqual(sorted(dict(ctx)), ['bar', 'baz', 'foo'])
+        self.assertIs(ctx['foo'], sentinel.foo)
+        del ctx['foo']
+        self.assertFalse('foo' in ctx)
+        self.assertEqual(sorted(self.parent), ['bar', 'foo'])
+
+    def test_parent_can_override_context(self):
+        self.parent['context'] = sentinel.context
+        self.assertIs(self.context['context'], sentinel.context)
+
+    def test_get_falls_back_to_parent_and_default(self):
+        self.assertIs(self.context.get('foo'), sentinel.foo)
+        self.assertIs(
+            self.context.get('frob', sentinel.default), sentinel.default)
+
+    def test_writes_shadow_parent(self):
+        self.context['foo'] = sentinel.other
+        self.context.update(bar=sentinel.other_bar)
+        self.assertIs(self.context['foo'], sentinel.other)
+        self.assertIs(self.context['bar'], sentinel.other_bar)
+        self.assertIs(self.parent['foo'], sentinel.foo)
+        self.assertTrue(callable(self.parent['bar']))
+
+    def test_writes_forget_remembered_parent_items(self):
+        self.assertEqual(self.context['bar'], (sentinel.foo, sentinel.bar))
+        self.context['foo'] = sentinel.other
+        self.assertEqual(self.context['bar'], (sentinel.other, sentinel.bar))
+
+    def test_deleting_parent_item_raises_KeyError(self):
+        with self.assertRaises(KeyError):
+            del self.context['foo']
+        self.assertIn('foo', self.parent)
+
+    def test_deleting_shadowing_item_reveals_parent_item(self):
+        self.context['foo'] = sentinel.other
+        del self.context['foo']
+        self.assertIs(self.context['foo'], sentinel.foo)
+
+    def test_mapping_methods_include_parent(self):
+        self.context['foo'] = sentinel.other
+        self.assertEqual(sorted(self.context), ['bar', 'baz', 'foo'])
+        self.assertEqual(len(self.context), 3)
+        self.assertIn('bar', self.context)
+        self.assertNotIn('frob', self.context)
+        self.assertEqual(self.context.copy(), {
+            'foo': sentinel.other,
+            'bar': self.parent['bar'],
+            'baz': sentinel.baz,
+        })
+        self.assertEqual(self.context, self.context.copy())
+
+    def test_layers_can_be_nested(self):
+        ctx = context.LayeredContext(self.context, frob=sentinel.frob)
+        self.assertEqual(
+            ctx.inject(lambda bar, baz, frob: (bar, baz, frob)),
+            ((sentinel.foo, sentinel.bar), sentinel.baz, sentinel.frob)
+        )
+
+    def test_can_be_pickled(self):
+        ctx = context.LayeredContext({'name': 'foo', 'shout': shout})
+        self.assertEqual(ctx['shout'], 'FOO')
+        for protocol in xrange(pickle.HIGHEST_PROTOCOL + 1):
+            copy = pickle.loads(pickle.dumps(ctx, protocol))
+            self.assertEqual(copy.parent, {'name': 'foo', 'shout': shout})
+            self.assertEqual(copy['shout'], 'FOO')
+            copy['name'] = 'bar'
+            self.assertEqual(copy['shout'], 'BAR')
+
+
+class TestGetPlan(unittest.TestCase):
+    def test_splits_required_and_optional_args(self):
+        def func(foo, bar, baz=sentinel.baz):
+            pass
+        self.assertEqual(
+            context.get_plan(func),
+            (('foo', 'bar'), (('baz', sentinel.baz),))
+        )
+
+    def test_plan_is_cached(self):
+        func = lambda foo: foo
+        self.assertIs(context.get_plan(func), context.get_plan(func))
+
+    def test_plan_is_evicted_with_callable(self):
+        func = lambda foo: foo
+        context.get_plan(func)
+        gc.collect()
+        count = len(context._plans)
+        del func
+        gc.collect()
+        self.assertEqual(len(context._plans), count - 1)
+
+    def test_bound_methods_share_plan(self):
+        class Cls(object):
+            def frob(self, baz):
+                return baz
+        plan = context.get_plan(Cls().frob)
+        self.assertEqual(plan, (('baz',), ()))
+        self.assertIs(context.get_plan(Cls().frob), plan)
+
+    def test_method_plan_does_not_clash_with_function_plan(self):
+        class Cls(object):
+            def frob(self, baz):
+                return baz
+        context.get_plan(Cls().frob)
+        self.assertEqual(
+            context.get_plan(Cls.__dict__['frob']),
+            (('self', 'baz'), ())
+        )
+
+    def test_unhashable_callables_are_not_cached(self):
+        class Cls(object):
+            __hash__ = None
+            def __call__(self, foo):
+                return foo
+        self.assertEqual(context.get_plan(Cls()), (('foo',), ()))
+        self.assertIs(
+            context.Context(foo=sentinel.foo).inject(Cls()),
+            sentinel.foo
+        )
+
+    def test_raises_TypeError_for_non_callable_objects(self):
+        class Cls(object):
+            pass
+        with self.assertRaises(TypeError):
+            context.get_plan(Cls())
+
+
+class TestCompiledInjection(unittest.TestCase):
+    def setUp(self):
+        self.provider = Mock(return_value=sentinel.provided)
+        self.context = context.Context(
+            foo=sentinel.foo,
+            bar=lambda: self.provider(),
+        )
+        self.context.compiled = True
+
+    def test_injects_values(self):
+        self.assertEqual(
+            self.context.inject(lambda foo, bar: (foo, bar)),
+            (sentinel.foo, sentinel.provided)
+        )
+
+    def test_callable_items_are_remembered(self):
+        self.context.inject(lambda bar: bar)
+        self.context.inject(lambda bar: bar)
+        self.assertEqual(self.provider.call_count, 1)
+
+    def test_optional_args(self):
+        self.context['baz'] = lambda frob: frob
+        self.assertEqual(
+            self.context.inject(
+                lambda foo=None, baz=sentinel.default, qux=sentinel.qux: (
+                    foo, baz, qux)),
+            (sentinel.foo, sentinel.default, sentinel.qux)
+        )
+
+    def test_injects_self_as_context(self):
+        self.assertIs(
+            self.context.inject(lambda context: context), self.context)
+        self.assertIs(
+            self.context.inject(lambda context=None: context), self.context)
+
+    def test_missing_args_raise_KeyError(self):
+        with self.assertRaises(KeyError):
+            self.context.inject(lambda frob: frob)
+
+    def test_injects_from_parent_layer(self):
+        ctx = context.LayeredContext(self.context, baz=sentinel.baz)
+        ctx.compiled = True
+        self.assertEqual(
+            ctx.inject(lambda foo, baz: (foo, baz)),
+            (sentinel.foo, sentinel.baz)
+        )
+
+    def test_kwargs_use_generic_injection(self):
+        self.assertEqual(
+            self.context.inject(lambda foo, bar: (foo, bar), bar=sentinel.bar),
+            (sentinel.foo, sentinel.bar)
+        )
+
+    def test_injects_bound_methods_of_different_instances(self):
+        class Cls(object):
+            def __init__(self, value):
+                self.value = value
+            def frob(self, foo):
+                return self.value, foo
+        self.context.inject(Cls(1).frob)
+        self.assertEqual(
+            self.context.inject(Cls(2).frob), (2, sentinel.foo))
+
+    def test_injector_code_is_shared_between_shapes(self):
+        first = context.get_injector(lambda foo, bar=1: None)
+        second = context.get_injector(lambda foo, bar=2: None)
+        self.assertIsNot(first, second)
+        self.assertIs(first.func_code, second.func_code)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,214 @@
+from __future__ import with_statement
+import unittest
+if not hasattr(unittest.TestCase, 'assertIs'):
+    import unittest2 as unittest
+
+from mock import Mock
+
+from potpy.context import Context
+from potpy.router import Route, Router
+from potpy.wsgi import PathRouter, MethodRouter
+from potpy import instrument
+
+
+class Recorder(instrument.Instrument):
+    def __init__(self):
+        self.calls = []
+
+    def before(self, step, context):
+        self.calls.append(('before', step.key))
+        return step.index
+
+    def after(self, step, context, token, outcome):
+        self.calls.append(('after', step.key, token, outcome))
+
+
+class Timer(object):
+    def __init__(self, *times):
+        self.times = list(times)
+
+    def __call__(self):
+        return self.times.pop(0)
+
+
+def load_user():
+    pass
+
+
+class Handlers(object):
+    def method(self):
+        pass
+
+    @classmethod
+    def classmethod(cls):
+        pass
+
+
+class TestHandlerName(unittest.TestCase):
+    def test_function(self):
+        self.assertEqual(instrument.handler_name(load_user), 'load_user')
+
+    def test_methods(self):
+        self.assertEqual(instrument.handler_name(Handlers().method),
+                         'Handlers.method')
+        self.assertEqual(instrument.handler_name(Handlers.method),
+                         'Handlers.method')
+        self.assertEqual(instrument.handler_name(Handlers.classmethod),
+                         'Handlers.classmethod')
+
+    def test_class(self):
+        self.assertEqual(instrument.handler_name(Handlers), 'Handlers')
+
+    def test_context_reference(self):
+        self.assertEqual(
+            instrument.handler_name(Route.context.repository.getall),
+            "Route.context['repository'].getall"
+        )
+
+    def test_object_without_repr(self):
+        self.assertEqual(instrument.handler_name(Route()), 'Route')
+
+
+class TestRouteInstrumentation(unittest.TestCase):
+    def test_uninstrumented_steps_are_not_wrapped(self):
+        route = Route(lambda: None)
+        self.assertNotIsInstance(route.compile()[0],
+                                 Route._instrumented_step)
+
+    def test_calls_instruments_around_each_step(self):
+        recorder = Recorder()
+        route = Route(load_user, (Handlers, 'handlers'))
+        route.instrument(recorder, 'users')
+        route(Context())
+        self.assertEqual(recorder.calls, [
+            ('before', ('users', 'load_user')),
+            ('after', ('users', 'load_user'), 0, 'ok'),
+            ('before', ('users', 'Handlers')),
+            ('after', ('users', 'Handlers'), 1, 'ok'),
+        ])
+
+    def test_outcomes(self):
+        recorder = Recorder()
+        route = Route(
+            lambda: Mock(side_effect=Route.Stop)(),
+        )
+        route.instrument(recorder)
+        route(Context())
+        failing = Route(lambda: Mock(side_effect=ValueError)())
+        failing.instrument(recorder)
+        with self.assertRaises(ValueError):
+            failing(Context())
+        self.assertEqual(
+            [call[3] for call in recorder.calls if call[0] == 'after'],
+            ['stop', 'error']
+        )
+
+    def test_handled_exceptions_are_ok(self):
+        recorder = Recorder()
+        route = Route()
+        route.add(lambda: Mock(side_effect=ValueError)(), exception_handlers=[
+            (ValueError, lambda: None)
+        ])
+        route.instrument(recorder)
+        route(Context())
+        self.assertEqual(recorder.calls[-1][3], 'ok')
+
+    def test_instruments_nested_routes_and_routers(self):
+        recorder = Recorder()
+        router = PathRouter(('/foo', MethodRouter(
+            ('GET', Route(load_user)),
+        )))
+        route = Route(Route(load_user), router)
+        route.instrument(recorder, 'app')
+        route(Context(path_info='/foo', request_method='GET'))
+        self.assertEqual(
+            [call[1] for call in recorder.calls if call[0] == 'before'], [
+                ('app', 'Route'),
+                ('app', 'load_user'),
+                ('app', 'PathRouter'),
+                ('app /foo', 'MethodRouter'),
+                ('app /foo GET', 'load_user'),
+            ])
+
+    def test_router_keeps_route_names(self):
+        recorder = Recorder()
+        router = PathRouter(('/foo', load_user), ('/bar', load_user))
+        router.routes[0][1].name = 'foo'
+        router.instrument(recorder, 'app')
+        self.assertEqual([route.name for match, route in router.routes],
+                         ['foo', 'app /bar'])
+
+    def test_adding_instrument_twice_has_no_effect(self):
+        recorder = Recorder()
+        route = Route(load_user)
+        route.instrument(recorder)
+        route.instrument(recorder)
+        route(Context())
+        self.assertEqual(len(recorder.calls), 2)
+
+    def test_uninstrument(self):
+        recorder = Recorder()
+        nested = Route(load_user)
+        route = Route(nested)
+        route.instrument(recorder)
+        route.instrument(Recorder())
+        route.uninstrument(recorder)
+        self.assertEqual(len(route.instruments), 1)
+        self.assertEqual(len(nested.instruments), 1)
+        route.uninstrument()
+        self.assertEqual(route.instruments, ())
+        self.assertEqual(nested.instruments, ())
+        self.assertNotIsInstance(route.compile()[0],
+                                 Route._instrumented_step)
+
+    def test_router_route_name(self):
+        self.assertEqual(Router().route_name('foo'), "'foo'")
+        self.assertEqual(MethodRouter().route_name(('GET', 'HEAD')),
+                         'GET, HEAD')
+
+
+class TestCollector(unittest.TestCase):
+    def setUp(self):
+        self.collector = instrument.Collector(
+            buckets=(1, 2), timer=Timer(0, 0.5, 10, 11.5, 20, 25))
+        self.route = Route(load_user)
+        self.route.instrument(self.collector, 'route')
+
+    def test_records_stats(self):
+        self.route(Context())
+        self.route(Context())
+        failing = Route(lambda: Mock(side_effect=Route.Stop)())
+        failing.instrument(self.collector, 'failing')
+        failing(Context())
+        self.assertEqual(self.collector.snapshot(), {
+            ('route', 'load_user'): {
+                'calls': 2, 'ok': 2, 'error': 0, 'stop': 0,
+                'total': 2.0, 'max': 1.5, 'histogram': [1, 1, 0],
+            },
+            ('failing', '<lambda>'): {
+                'calls': 1, 'ok': 0, 'error': 0, 'stop': 1,
+                'total': 5.0, 'max': 5.0, 'histogram': [0, 0, 1],
+            },
+        })
+
+    def test_snapshot_is_a_copy(self):
+        self.route(Context())
+        snapshot = self.collector.snapshot()
+        self.route(Context())
+        self.assertEqual(snapshot['route', 'load_user']['calls'], 1)
+        self.assertEqual(snapshot['route', 'load_user']['histogram'],
+                         [1, 0, 0])
+
+    def test_snapshot_and_reset(self):
+        self.route(Context())
+        self.assertEqual(len(self.collector.snapshot(reset=True)), 1)
+        self.assertEqual(self.collector.snapshot(), {})
+
+    def test_reset(self):
+        self.route(Context())
+        self.collector.reset()
+        self.assertEqual(self.collector.snapshot(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,10 +3,16 @@ import unittest
 if not hasattr(unittest.TestCase, 'assertIs'):
     import unittest2 as unittest
 
+import threading
 from types import TracebackType
 from mock import sentinel, Mock
+try:
+    from concurrent.futures import Future
+except ImportError:
+    Future = None
 
-from potpy.context import Context
+from potpy.context import Context, volatile
+from potpy.cache import Cache
 from potpy import router
 
 
@@ -97,6 +103,33 @@ class TestRoute(unittest.TestCase):
         self.assertIs(route(Context()), sentinel.result)
         self.assertEqual(self.calls, [sentinel.not_result])
 
+    def test_returned_stop(self):
+        route = router.Route(
+            self.handler(sentinel.result),
+            lambda: router.Route.Stop(),
+            self.handler(sentinel.not_result)
+        )
+        self.assertIs(route(Context()), sentinel.result)
+        self.assertEqual(self.calls, [sentinel.result])
+
+    def test_returned_stop_with_value(self):
+        route = router.Route(
+            self.handler(sentinel.not_result),
+            lambda: router.Route.Stop(sentinel.result),
+            self.handler(sentinel.also_not_result)
+        )
+        self.assertIs(route(Context()), sentinel.result)
+        self.assertEqual(self.calls, [sentinel.not_result])
+
+    def test_exception_handlers_can_return_stop(self):
+        route = router.Route(
+            (lambda: {}['foo'], None, [
+                (KeyError, lambda: router.Route.Stop(sentinel.result))]),
+            self.handler(sentinel.not_result)
+        )
+        self.assertIs(route(Context()), sentinel.result)
+        self.assertEqual(self.calls, [])
+
     def test_exceptions_are_raised(self):
         MyException = type('MyException', (Exception,), {})
         route = router.Route(lambda: Mock(side_effect=MyException)())
@@ -132,6 +165,51 @@ class TestRoute(unittest.TestCase):
             route(Context())
         self.assertFalse(exc_handler.called)
 
+    def test_exception_handler_lookup_is_remembered_per_type(self):
+        MyException = type('MyException', (Exception,), {})
+        SubException = type('SubException', (MyException,), {})
+        OtherException = type('OtherException', (Exception,), {})
+        raiser = Mock(side_effect=[SubException, OtherException,
+                                   SubException, OtherException])
+        route = router.Route()
+        route.add(lambda: raiser(), exception_handlers=[
+            (MyException, lambda: sentinel.handled)
+        ])
+        for i in range(2):
+            self.assertIs(route(Context()), sentinel.handled)
+            with self.assertRaises(OtherException):
+                route(Context())
+        self.assertEqual(route._steps[0].dispatch, {
+            SubException: route.route[0][2][0][1],
+            OtherException: None,
+        })
+
+    def test_exc_info_is_removed_from_context(self):
+        MyException = type('MyException', (Exception,), {})
+        context = Context()
+        route = router.Route()
+        route.add(lambda: Mock(side_effect=MyException)(),
+                  exception_handlers=[(MyException, lambda exc_info: None)])
+        route(context)
+        self.assertNotIn('exc_info', context)
+
+    def test_exc_info_can_be_kept_out_of_context(self):
+        MyException = type('MyException', (Exception,), {})
+        exc = MyException()
+        def raiser():
+            raise exc
+        context = Context()
+        route = router.Route()
+        route.exc_info_in_context = False
+        route.add(raiser, exception_handlers=[
+            (MyException, lambda exc_info, context: (
+                exc_info, 'exc_info' in context))
+        ])
+        self.assertEqual(
+            route(context),
+            ((MyException, exc, SOME_TRACEBACK), False)
+        )
+
     def test_result_of_exception_handler_is_added_to_context(self):
         MyException = type('MyException', (Exception,), {})
         exc = MyException()
@@ -211,6 +289,101 @@ class TestRoute(unittest.TestCase):
             "can't refer to context directly"
         )
 
+    def test_references_are_hashable(self):
+        refs = [
+            router.Route.previous.foo.bar,
+            router.Route.previous.foo.bar,
+            router.Route.previous.foo,
+            router.Route.context.foo.bar,
+            router.Route.context['foo'].bar,
+            router.Route.context.foo,
+            router.Route.context.bar,
+        ]
+        self.assertEqual(len(set(refs)), 5)
+        self.assertNotEqual(router.Route.previous.foo,
+                            router.Route.context.foo)
+
+    def test_references_are_compact(self):
+        for ref in router.Route.previous.foo, router.Route.context.foo:
+            with self.assertRaises(AttributeError):
+                object.__getattribute__(ref, '__dict__')
+
+    def test_missing_attribute_of_reference_raises_AttributeError(self):
+        route = router.Route(
+            lambda: sentinel.result, router.Route.previous.foo.bar)
+        with self.assertRaises(AttributeError):
+            route(Context())
+
+    def test_compiles_on_first_call(self):
+        route = router.Route(lambda: sentinel.result)
+        self.assertIs(route._steps, None)
+        route(Context())
+        steps = route._steps
+        self.assertEqual(len(steps), 1)
+        route(Context())
+        self.assertIs(route._steps, steps)
+
+    def test_compile_classifies_steps(self):
+        MyException = type('MyException', (Exception,), {})
+        route = router.Route(
+            lambda: None,
+            (lambda: None, 'named'),
+            (lambda: None, None, [(MyException, lambda: None)]),
+            router.Route.previous,
+            router.Route.previous.foo,
+            router.Route.context.foo,
+            router.Route.context,
+        )
+        self.assertEqual(
+            [type(step).__name__ for step in route.compile()],
+            ['_Step', '_NamedStep', '_GuardedStep', '_PreviousStep',
+             '_PreviousRefStep', '_ContextRefStep', '_ContextClassStep']
+        )
+
+    def test_add_invalidates_compiled_steps(self):
+        route = router.Route(self.handler(sentinel.first))
+        route(Context())
+        route.add(self.handler(sentinel.second))
+        self.assertIs(route._steps, None)
+        self.assertIs(route(Context()), sentinel.second)
+
+    def test_prepare_invalidates_compiled_steps(self):
+        route = router.Route(lambda foo: None)
+        route.compile()
+        route.prepare({'foo': lambda: None})
+        self.assertIs(route._steps, None)
+
+    def test_referring_to_context_directly_runs_earlier_handlers(self):
+        route = router.Route(
+            self.handler(sentinel.first), router.Route.context)
+        with self.assertRaises(TypeError):
+            route(Context())
+        self.assertEqual(self.calls, [sentinel.first])
+
+    def test_context_reference_errors_are_not_handled(self):
+        exc_handler = Mock()
+        route = router.Route(
+            (router.Route.context.missing, None, [(KeyError, exc_handler)]),
+        )
+        with self.assertRaises(KeyError):
+            route(Context())
+        self.assertFalse(exc_handler.called)
+
+    def test_stop_in_named_handler_does_not_name_result(self):
+        def stopper():
+            raise router.Route.Stop(sentinel.stopped)
+        route = router.Route((stopper, 'name'))
+        context = Context()
+        self.assertIs(route(context), sentinel.stopped)
+        self.assertNotIn('name', context)
+
+    def test_returned_stop_in_named_handler_does_not_name_result(self):
+        route = router.Route(
+            (lambda: router.Route.Stop(sentinel.stopped), 'name'))
+        context = Context()
+        self.assertIs(route(context), sentinel.stopped)
+        self.assertNotIn('name', context)
+
     def test_can_refer_to_attribute_of_context_item(self):
         class MyClass(object):
             class ChildClass(object):
@@ -222,6 +395,581 @@ class TestRoute(unittest.TestCase):
         route.add(route.context.bar.ChildClass.my_method)
         self.assertIs(route(ctx), sentinel.foo)
 
+    def test_routers_are_called_without_looking_up_context(self):
+        looked_up = []
+        class SpyContext(Context):
+            def __getitem__(self, key):
+                looked_up.append(key)
+                return Context.__getitem__(self, key)
+        r = KeyRouter(('key', lambda matched: matched))
+        for exception_handlers in [], [(KeyError, lambda: None)]:
+            route = router.Route((r, None, exception_handlers))
+            self.assertEqual(route(SpyContext(obj='key')), 'key')
+            with self.assertRaises(r.NoRoute):
+                route(SpyContext(obj='other'))
+        self.assertNotIn('context', looked_up)
+
+
+class KeyRouter(router.Router):
+    def match(self, match, obj):
+        if match == obj:
+            return {'matched': match}
+
+    def match_keys(self, match):
+        return ['matched']
+
+
+class TestFlatten(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def handler(self, value):
+        def handler():
+            self.calls.append(value)
+            return value
+        return handler
+
+    def stopper(self, *args):
+        def stopper():
+            raise router.Route.Stop(*args)
+        return stopper
+
+    def test_inlines_nested_routes(self):
+        route = router.Route(
+            self.handler(1),
+            router.Route(self.handler(2), router.Route(self.handler(3))),
+            self.handler(4),
+        )
+        route.flatten()
+        steps, stops, tail = route._flat
+        # each inlined route starts by resetting the previous result
+        self.assertEqual(len(steps), 6)
+        self.assertEqual(route(Context()), 4)
+        self.assertEqual(self.calls, [1, 2, 3, 4])
+
+    def test_stop_ends_only_the_nested_route(self):
+        route = router.Route(
+            (router.Route(
+                self.handler(1),
+                router.Route(self.stopper('stopped'), self.handler(2)),
+                self.handler(3),
+            ), 'nested'),
+            lambda nested: (nested, self.calls),
+        )
+        route.flatten()
+        self.assertEqual(route(Context()), (3, [1, 3]))
+
+    def test_stop_without_value_keeps_nested_result(self):
+        route = router.Route(
+            self.handler(1),
+            (router.Route(self.handler(2), self.stopper()), 'nested'),
+            lambda nested: nested,
+        )
+        route.flatten()
+        self.assertEqual(route(Context()), 2)
+
+    def test_stop_at_start_of_nested_route_gives_None(self):
+        for stopper in self.stopper(), lambda: router.Route.Stop():
+            route = router.Route(
+                self.handler('outer'),
+                (router.Route(stopper, self.handler('never')), 'nested'),
+                lambda nested: nested,
+            )
+            self.assertIs(route(Context()), None)
+            route.flatten()
+            self.assertIs(route(Context()), None)
+        self.assertEqual(self.calls, ['outer'] * 4)
+
+    def test_returned_stop_ends_only_the_nested_route(self):
+        route = router.Route(
+            router.Route(
+                self.handler(1),
+                lambda: router.Route.Stop(),
+                self.handler(2),
+            ),
+            self.handler(3),
+        )
+        route.flatten()
+        self.assertEqual(route(Context()), 3)
+        self.assertEqual(self.calls, [1, 3])
+
+    def test_stop_in_outer_route(self):
+        route = router.Route(
+            router.Route(self.handler(1)),
+            self.stopper('stopped'),
+            router.Route(self.handler(2)),
+        )
+        route.flatten()
+        self.assertEqual(route(Context()), 'stopped')
+        self.assertEqual(self.calls, [1])
+
+    def test_nested_routes_start_without_previous_result(self):
+        route = router.Route(
+            self.handler(1),
+            (router.Route(), 'empty'),
+            lambda empty: empty,
+        )
+        route.flatten()
+        self.assertIs(route(Context()), None)
+
+    def test_nested_routes_with_exception_handlers_are_not_inlined(self):
+        nested = router.Route(lambda: {}['foo'])
+        route = router.Route((nested, None, [(KeyError, lambda: 'handled')]))
+        route.flatten()
+        self.assertIs(route._flat, None)
+        self.assertEqual(route(Context()), 'handled')
+
+    def test_follows_terminal_router(self):
+        inner = router.Route(self.handler('foo'), lambda matched: matched)
+        r = KeyRouter(('foo', inner), ('bar', self.handler('bar')))
+        route = router.Route(lambda: None, r)
+        route.flatten()
+        self.assertEqual(route._flat[2][0], r)
+        context = Context(obj='foo')
+        self.assertEqual(route(context), 'foo')
+        self.assertEqual(self.calls, ['foo'])
+
+    def test_terminal_router_raises_NoRoute(self):
+        route = router.Route(KeyRouter(('foo', lambda: None)))
+        route.flatten()
+        with self.assertRaises(router.Router.NoRoute):
+            route(Context(obj='bar'))
+
+    def test_stop_before_terminal_router(self):
+        route = router.Route(
+            self.stopper('stopped'),
+            KeyRouter(('foo', self.handler('foo'))),
+        )
+        route.flatten()
+        self.assertEqual(route(Context(obj='foo')), 'stopped')
+        self.assertEqual(self.calls, [])
+
+    def test_named_router_is_not_followed(self):
+        r = KeyRouter(('foo', self.handler('foo')))
+        route = router.Route((r, 'name'))
+        route.flatten()
+        self.assertIs(route._flat, None)
+        self.assertEqual(route(Context(obj='foo')), 'foo')
+
+    def test_add_discards_flat_plan(self):
+        route = router.Route(router.Route(self.handler(1)))
+        route.flatten()
+        route.add(self.handler(2))
+        self.assertEqual(route(Context()), 2)
+        self.assertIs(route._flat, None)
+
+
+class TestRouteAnalysis(unittest.TestCase):
+    def test_finds_missing_keys(self):
+        handler = lambda foo, bar: None
+        deps = router.Route(handler).analyze({'foo': sentinel.foo})
+        self.assertEqual(deps.missing, {'bar': [handler]})
+        self.assertFalse(deps.ok)
+
+    def test_optional_args_are_not_missing(self):
+        deps = router.Route(lambda foo=None: None).analyze({})
+        self.assertEqual(deps.missing, {})
+        self.assertTrue(deps.ok)
+
+    def test_accepts_iterable_of_keys(self):
+        deps = router.Route(lambda foo, bar: None).analyze(['foo'])
+        self.assertEqual(deps.missing.keys(), ['bar'])
+
+    def test_context_is_always_available(self):
+        deps = router.Route(lambda context: None).analyze({})
+        self.assertTrue(deps.ok)
+
+    def test_follows_callable_items(self):
+        deps = router.Route(lambda foo: None).analyze({
+            'foo': lambda bar, baz=None: None,
+            'bar': lambda qux: None,
+        })
+        self.assertEqual(deps.missing.keys(), ['qux'])
+        self.assertEqual(deps.steps[0].graph, {
+            'foo': ('bar', 'baz'),
+            'bar': ('qux',),
+        })
+        self.assertEqual(deps.steps[0].order, ['bar', 'foo'])
+
+    def test_order_leaves_out_optional_and_volatile_items(self):
+        deps = router.Route(lambda foo, bar=None: None).analyze({
+            'foo': volatile(lambda baz: None),
+            'bar': lambda: None,
+            'baz': lambda: None,
+        })
+        self.assertTrue(deps.ok)
+        self.assertEqual(deps.steps[0].order, ['baz'])
+
+    def test_finds_cycles(self):
+        deps = router.Route(lambda foo: None).analyze({
+            'foo': lambda bar: None,
+            'bar': lambda baz: None,
+            'baz': lambda bar: None,
+        })
+        self.assertEqual(deps.cycles, [('bar', 'baz', 'bar')])
+        self.assertEqual(deps.missing, {})
+
+    def test_named_results_are_available_to_later_handlers(self):
+        deps = router.Route(
+            (lambda: None, 'foo'),
+            lambda foo: None,
+        ).analyze({})
+        self.assertTrue(deps.ok)
+
+    def test_named_results_replace_callable_items(self):
+        deps = router.Route(
+            (lambda: None, 'foo'),
+            lambda foo: None,
+        ).analyze({'foo': lambda foo: None})
+        self.assertTrue(deps.ok)
+        self.assertEqual(deps.steps[1].graph, {})
+
+    def test_exception_handlers_can_take_exc_info(self):
+        exc_handler = lambda exc_info, foo: None
+        deps = router.Route(
+            (lambda: None, None, [(Exception, exc_handler)]),
+        ).analyze({})
+        self.assertEqual(deps.missing, {'foo': [exc_handler]})
+        self.assertTrue(deps.steps[1].exception_handler)
+
+    def test_follows_context_references(self):
+        class Repository(object):
+            def get(self, todo_id):
+                pass
+        deps = router.Route(
+            router.Route.context.repository.get,
+        ).analyze({'repository': Repository()})
+        self.assertEqual(deps.missing.keys(), ['todo_id'])
+
+    def test_context_reference_key_must_exist(self):
+        deps = router.Route(router.Route.context.repository).analyze({})
+        self.assertEqual(deps.missing.keys(), ['repository'])
+
+    def test_skips_previous_references(self):
+        deps = router.Route(
+            lambda: None,
+            router.Route.previous,
+            router.Route.previous.foo,
+        ).analyze({})
+        self.assertTrue(deps.ok)
+        self.assertEqual(len(deps.steps), 1)
+
+    def test_analyzes_subroutes(self):
+        handler = lambda bar: None
+        deps = router.Route(
+            router.Route((lambda: None, 'foo')),
+            lambda foo: None,
+            router.Route(handler),
+        ).analyze({})
+        self.assertEqual(deps.missing, {'bar': [handler]})
+
+    def test_analyzes_routers(self):
+        r = router.Router(
+            (sentinel.match, lambda foo: None),
+        )
+        r.match_keys = Mock(return_value=['foo'])
+        deps = router.Route(r).analyze({'obj': sentinel.obj})
+        self.assertTrue(deps.ok)
+        r.match_keys.assert_called_once_with(sentinel.match)
+
+    def test_prepare_raises_DependencyError(self):
+        route = router.Route(lambda foo, bar: None)
+        with self.assertRaises(route.DependencyError) as assertion:
+            route.prepare({'bar': lambda bar: None})
+        self.assertEqual(
+            str(assertion.exception), "missing 'foo', cycle bar -> bar")
+        self.assertFalse(assertion.exception.dependencies.ok)
+
+    def test_prepared_route_resolves_items_in_order(self):
+        calls = []
+        ctx = Context(
+            foo=lambda bar: calls.append('foo'),
+            bar=lambda: calls.append('bar'),
+            baz=lambda: calls.append('baz'),
+        )
+        route = router.Route(lambda baz, foo: calls.append('handler'))
+        route.prepare(ctx)
+        ctx.resolve = Mock(wraps=ctx.resolve)
+        route(ctx)
+        ctx.resolve.assert_called_once_with(('baz', 'bar', 'foo'))
+        self.assertEqual(calls, ['baz', 'bar', 'foo', 'handler'])
+
+    def test_add_discards_resolution_order(self):
+        route = router.Route(lambda foo: None)
+        route.prepare({'foo': lambda: None})
+        self.assertIsNot(route._resolution, None)
+        route.add(lambda: None)
+        self.assertIs(route._resolution, None)
+
+    def test_parallel_handlers_cant_see_each_others_results(self):
+        route = router.Route(
+            router.Route.parallel(
+                (lambda: None, 'foo'),
+                (lambda foo: None, 'bar'),
+            ),
+            lambda foo, bar: None,
+        )
+        deps = route.analyze({})
+        self.assertEqual(deps.missing.keys(), ['foo'])
+        self.assertEqual(len(deps.missing['foo']), 1)
+
+    def test_prepared_parallel_group_resolves_shared_items_first(self):
+        ctx = Context(
+            foo=lambda bar: sentinel.foo,
+            bar=lambda: sentinel.bar,
+            baz=lambda bar: sentinel.baz,
+        )
+        route = router.Route(router.Route.parallel(
+            (lambda foo: None, 'first'),
+            (lambda baz, bar: None, 'second'),
+        ))
+        route.prepare(ctx)
+        self.assertEqual(route._resolution, [('bar', 'foo', 'baz')])
+
+
+class RecordingContext(Context):
+    """Records the keys present each time a handler is injected."""
+    def inject(self, func, **kwargs):
+        self.seen.append(sorted(self))
+        return Context.inject(self, func, **kwargs)
+
+
+class TestRelease(unittest.TestCase):
+    def test_finds_last_use_of_named_results(self):
+        route = router.Route(
+            (lambda: None, 'foo'),
+            (lambda: None, 'bar'),
+            lambda foo: None,
+            lambda bar: None,
+        )
+        deps = route.analyze()
+        self.assertEqual(deps.last_use, {route: {'foo': 2, 'bar': 3}})
+
+    def test_unread_names_are_last_used_where_named(self):
+        route = router.Route((lambda: None, 'foo'), lambda: None)
+        self.assertEqual(route.analyze().last_use[route], {'foo': 0})
+
+    def test_follows_callable_items(self):
+        route = router.Route(
+            (lambda: None, 'foo'),
+            lambda: None,
+            lambda bar: None,
+        )
+        deps = route.analyze({'bar': lambda foo: None})
+        self.assertEqual(deps.last_use[route], {'foo': 2})
+
+    def test_follows_nested_routes_and_routers(self):
+        nested = router.Route((lambda foo: None, 'bar'))
+        r = KeyRouter(('key', lambda bar: None))
+        route = router.Route((lambda: None, 'foo'), nested, lambda: None, r)
+        deps = route.analyze(['obj'])
+        self.assertEqual(deps.last_use[route], {'foo': 1, 'bar': 3})
+        self.assertNotIn(nested, deps.last_use)
+        self.assertEqual(deps.last_use[r.routes[0][1]], {})
+
+    def test_whole_context_readers_use_every_name(self):
+        for reader in [lambda context: None, router.Route.previous,
+                       router.Route.previous.foo, router.Route.context.foo]:
+            route = router.Route(
+                (lambda: None, 'foo'), lambda: None, reader, lambda: None)
+            deps = route.analyze()
+            self.assertEqual(deps.last_use[route], {'foo': 2})
+
+    def test_exception_handlers_use_names(self):
+        route = router.Route(
+            (lambda: None, 'foo'),
+            (lambda: None, None, [(KeyError, lambda foo: None)]),
+            lambda: None,
+        )
+        self.assertEqual(route.analyze().last_use[route], {'foo': 1})
+
+    def test_releases_names_after_last_use(self):
+        route = router.Route(
+            (lambda: sentinel.foo, 'foo'),
+            (lambda: sentinel.bar, 'bar'),
+            (lambda foo: None, 'baz'),
+            lambda: None,
+            lambda bar: None,
+            lambda: None,
+        )
+        route.prepare(release=True)
+        context = RecordingContext()
+        context.seen = []
+        route(context)
+        self.assertEqual(context.seen, [
+            [], ['foo'], ['bar', 'foo'], ['bar'], ['bar'], [],
+        ])
+        self.assertEqual(context, {})
+
+    def test_keeps_names_unless_asked(self):
+        route = router.Route((lambda: None, 'foo'), lambda: None)
+        route.prepare()
+        context = Context()
+        route(context)
+        self.assertEqual(context, {'foo': None})
+
+    def test_routes_nested_in_routes_keep_their_names(self):
+        nested = router.Route((lambda: sentinel.foo, 'foo'), lambda: None)
+        route = router.Route(nested, lambda foo: foo)
+        route.prepare(release=True)
+        context = Context()
+        self.assertIs(route(context), sentinel.foo)
+        self.assertEqual(context, {})
+
+    def test_router_routes_release_their_names(self):
+        r = KeyRouter(('key', router.Route((lambda: None, 'foo'))))
+        r.prepare(['obj'], release=True)
+        context = Context()
+        r(context, 'key')
+        self.assertEqual(context, {'matched': 'key'})
+
+    def test_add_and_prepare_discard_releases(self):
+        route = router.Route((lambda: None, 'foo'), lambda: None)
+        route.prepare(release=True)
+        self.assertEqual(route._releases, {0: ('foo',)})
+        route.prepare()
+        self.assertIs(route._releases, None)
+        route.prepare(release=True)
+        route.add(lambda: None)
+        self.assertIs(route._releases, None)
+
+    def test_flattened_routes_release_names(self):
+        nested = router.Route((lambda: sentinel.foo, 'foo'))
+        route = router.Route(
+            (nested, 'bar'), lambda foo: None, lambda bar: bar)
+        route.prepare(release=True)
+        route.flatten()
+        context = Context()
+        self.assertIs(route(context), sentinel.foo)
+        self.assertEqual(context, {})
+
+
+class ManualExecutor(object):
+    """Runs the first submitted call immediately, and leaves the rest."""
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, func, *args):
+        future = Future()
+        if not self.submitted:
+            try:
+                future.set_result(func(*args))
+            except Exception, exc:
+                future.set_exception(exc)
+        self.submitted.append(future)
+        return future
+
+
+class TestParallel(unittest.TestCase):
+    def setUp(self):
+        if Future is None:
+            self.skipTest('futures is not installed')
+
+    def test_runs_handlers_at_the_same_time(self):
+        events = threading.Event(), threading.Event()
+        def handler(index):
+            def handler():
+                events[index].set()
+                return events[1 - index].wait(5)
+            return handler
+        route = router.Route(router.Route.parallel(
+            (handler(0), 'first'),
+            (handler(1), 'second'),
+        ))
+        self.assertEqual(route(Context()), (True, True))
+
+    def test_adds_results_to_context(self):
+        route = router.Route(
+            router.Route.parallel(
+                (lambda foo: (foo, sentinel.first), 'first'),
+                (lambda: sentinel.second, 'second'),
+            ),
+            lambda first, second: (first, second),
+        )
+        self.assertEqual(
+            route(Context(foo=sentinel.foo)),
+            ((sentinel.foo, sentinel.first), sentinel.second)
+        )
+
+    def test_group_result_can_be_named(self):
+        route = router.Route(
+            (router.Route.parallel((lambda: sentinel.foo, 'foo')), 'group'),
+            lambda group: group,
+        )
+        self.assertEqual(route(Context()), (sentinel.foo,))
+
+    def test_handlers_can_refer_to_context_items(self):
+        class Repo(object):
+            def getall(self):
+                return sentinel.todos
+            def count(self):
+                return 2
+        route = router.Route(router.Route.parallel(
+            (router.Route.context.repo.getall, 'todos'),
+            (router.Route.context.repo.count, 'count'),
+        ))
+        self.assertEqual(route(Context(repo=Repo())), (sentinel.todos, 2))
+
+    def test_exception_handlers_per_handler(self):
+        MyException = type('MyException', (Exception,), {})
+        exc = MyException()
+        def raiser():
+            raise exc
+        context = Context()
+        route = router.Route(router.Route.parallel(
+            (raiser, 'first', [
+                (MyException, lambda exc_info, context: (
+                    exc_info, 'exc_info' in context))
+            ]),
+            (lambda: sentinel.second, 'second'),
+        ))
+        self.assertEqual(
+            route(context),
+            (((MyException, exc, SOME_TRACEBACK), False), sentinel.second)
+        )
+
+    def test_first_failure_cancels_the_rest(self):
+        MyException = type('MyException', (Exception,), {})
+        executor = ManualExecutor()
+        second = Mock()
+        route = router.Route(router.Route.parallel(
+            (lambda: Mock(side_effect=MyException)(), 'first'),
+            (lambda: second(), 'second'),
+            executor=executor,
+        ))
+        context = Context()
+        with self.assertRaises(MyException):
+            route(context)
+        self.assertTrue(executor.submitted[1].cancelled())
+        self.assertFalse(second.called)
+        self.assertNotIn('second', context)
+
+    def test_returned_stop_stops_the_route(self):
+        route = router.Route(
+            router.Route.parallel(
+                (lambda: sentinel.first, 'first'),
+                (lambda: router.Route.Stop(sentinel.stopped), 'second'),
+            ),
+            lambda: sentinel.not_result,
+        )
+        context = Context()
+        self.assertIs(route(context), sentinel.stopped)
+        self.assertNotIn('first', context)
+
+    def test_group_exception_handlers(self):
+        MyException = type('MyException', (Exception,), {})
+        route = router.Route()
+        route.add(
+            router.Route.parallel(
+                (lambda: Mock(side_effect=MyException)(), 'first')),
+            exception_handlers=[(MyException, lambda: sentinel.handled)]
+        )
+        self.assertIs(route(Context()), sentinel.handled)
+
+    def test_rejects_unknown_keyword_arguments(self):
+        with self.assertRaises(TypeError):
+            router.Route.parallel(foo=None)
+
 
 class TestRouter(unittest.TestCase):
     def setUp(self):
@@ -264,6 +1012,12 @@ class TestRouter(unittest.TestCase):
             r(self.context, sentinel.obj)
         self.assertFalse(handler.called)
 
+    def test_try_route(self):
+        r = router.Router((sentinel.match, lambda: sentinel.result))
+        r.match = lambda match, obj: {} if obj is sentinel.obj else None
+        self.assertIs(r.try_route(self.context, sentinel.obj), sentinel.result)
+        self.assertIs(r.try_route(self.context, sentinel.other), r.Miss)
+
     def test_wraps_handlers_in_route(self):
         handler = Mock()
         r = router.Router(
@@ -286,11 +1040,240 @@ class TestRouter(unittest.TestCase):
             ]
         )
 
+    def test_analyze_includes_router_arguments(self):
+        r = router.Router((sentinel.match, lambda foo: None))
+        deps = r.analyze({})
+        self.assertEqual(sorted(deps.missing), ['foo', 'obj'])
+
+    def test_prepare_raises_DependencyError(self):
+        r = router.Router((sentinel.match, lambda foo: None))
+        with self.assertRaises(r.DependencyError):
+            r.prepare({'obj': sentinel.obj})
+
     def test_doesnt_rewrap_handlers_that_are_already_routes(self):
         route = router.Route()
         r = router.Router((sentinel.match, route))
         self.assertIs(r.routes[0][-1], route)
 
 
+class IndexedKeyRouter(KeyRouter):
+    """Matches keys exactly, or anything for the key ``'*'``."""
+    def match(self, match, obj):
+        self.checked.append(match)
+        if match == '*':
+            return {}
+        return KeyRouter.match(self, match, obj)
+
+    def index_key(self, match):
+        if match != '*':
+            return match
+
+    def lookup_key(self, obj):
+        return obj
+
+
+class TestRouterIndex(unittest.TestCase):
+    def setUp(self):
+        self.context = Context()
+        self.router = IndexedKeyRouter(
+            ('foo', lambda: 'foo'),
+            ('bar', lambda: 'bar'),
+            ('foo', lambda: 'second foo'),
+        )
+        self.router.checked = []
+
+    def test_only_checks_routes_with_the_lookup_key(self):
+        self.assertEqual(self.router(self.context, 'bar'), 'bar')
+        self.assertEqual(self.router.checked, ['bar'])
+
+    def test_first_match_wins(self):
+        self.assertEqual(self.router(self.context, 'foo'), 'foo')
+
+    def test_unindexed_routes_are_checked_in_order(self):
+        self.router.add('*', lambda: 'anything')
+        self.router.add('baz', lambda: 'baz')
+        self.assertEqual(self.router(self.context, 'baz'), 'anything')
+        self.assertEqual(self.router.checked, ['*'])
+        self.router.checked = []
+        self.assertEqual(self.router(self.context, 'bar'), 'bar')
+        self.assertEqual(self.router.checked, ['bar'])
+
+    def test_keys_check_unindexed_routes_in_between(self):
+        r = IndexedKeyRouter(*[(key, lambda: None) for key in
+                               ['*', 'foo', 'bar', '*', 'foo', '*']])
+        r.reindex()
+        for key, expected in (('foo', [0, 1, 3, 4, 5]), ('bar', [0, 2, 3, 5])):
+            self.assertEqual(
+                [r.routes.index(entry)
+                 for entry in r._indexed_routes(r._index[key])],
+                expected
+            )
+
+    def test_unknown_keys_check_unindexed_routes(self):
+        with self.assertRaises(self.router.NoRoute):
+            self.router(self.context, 'qux')
+        self.assertEqual(self.router.checked, [])
+        self.router.add('*', lambda: 'anything')
+        self.assertEqual(self.router(self.context, 'qux'), 'anything')
+
+    def test_checks_every_route_without_a_lookup_key(self):
+        self.router.lookup_key = lambda obj: None
+        with self.assertRaises(self.router.NoRoute):
+            self.router(self.context, 'qux')
+        self.assertEqual(self.router.checked, ['foo', 'bar', 'foo'])
+
+    def test_add_updates_the_index(self):
+        self.router(self.context, 'foo')
+        self.router.add('qux', lambda: 'qux')
+        self.assertEqual(self.router(self.context, 'qux'), 'qux')
+
+    def test_reindex_after_modifying_routes(self):
+        self.router(self.context, 'foo')
+        del self.router.routes[0]
+        self.router.reindex()
+        self.assertEqual(self.router(self.context, 'foo'), 'second foo')
+
+    def test_flattened_routes_use_the_index(self):
+        route = router.Route(lambda: None, self.router)
+        route.flatten()
+        self.assertEqual(route(Context(obj='bar')), 'bar')
+        self.assertEqual(self.router.checked, ['bar'])
+
+
+class TestClassifyMany(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        handler = lambda: self.calls.append(None)
+        self.router = IndexedKeyRouter(
+            ('foo', handler),
+            ('bar', handler),
+            ('*', handler),
+        )
+        self.router.checked = []
+
+    def test_yields_route_index_and_match(self):
+        self.assertEqual(
+            list(self.router.classify_many(['bar', 'foo', 'baz'])),
+            [(1, {'matched': 'bar'}), (0, {'matched': 'foo'}), (2, {})]
+        )
+        self.assertEqual(self.calls, [])
+
+    def test_yields_None_for_misses(self):
+        del self.router.routes[2]
+        self.assertEqual(list(self.router.classify_many(['baz'])),
+                         [(None, None)])
+
+    def test_reads_input_as_needed(self):
+        objs = iter(['foo', 'bar'])
+        results = self.router.classify_many(objs)
+        self.assertEqual(results.next(), (0, {'matched': 'foo'}))
+        self.assertEqual(list(objs), ['bar'])
+
+    def test_worker_processes(self):
+        objs = ['foo', 'bar', 'baz'] * 5
+        self.assertEqual(
+            list(self.router.classify_many(objs, processes=2, chunksize=2)),
+            list(self.router.classify_many(objs))
+        )
+        self.assertEqual(self.calls, [])
+
+    def test_builds_the_index_once(self):
+        builds = []
+        build = self.router._build_index
+        self.router._build_index = lambda: builds.append(None) or build()
+        for i in range(2):
+            self.assertEqual(list(self.router.classify_many(['foo'])),
+                             [(0, {'matched': 'foo'})])
+        self.assertEqual(len(builds), 1)
+
+
+class TestRouterDispatchCache(unittest.TestCase):
+    def setUp(self):
+        self.router = IndexedKeyRouter(
+            ('foo', lambda matched: matched),
+            ('*', lambda: 'anything'),
+        )
+        self.router.checked = []
+        self.router.dispatch_cache = Cache(maxsize=2)
+
+    def test_repeated_objects_skip_matching(self):
+        for i in range(3):
+            context = Context()
+            self.assertEqual(self.router(context, 'foo'), 'foo')
+            self.assertEqual(context['matched'], 'foo')
+        self.assertEqual(self.router.checked, ['foo'])
+        self.assertEqual(
+            (self.router.dispatch_cache.hits,
+             self.router.dispatch_cache.misses),
+            (2, 1)
+        )
+
+    def test_misses_are_cached(self):
+        del self.router.routes[1]
+        self.router.reindex()
+        for i in range(2):
+            with self.assertRaises(self.router.NoRoute):
+                self.router(Context(), 'bar')
+        self.assertEqual(self.router.checked, [])
+        self.assertEqual(self.router.dispatch_cache.hits, 1)
+
+    def test_is_bounded(self):
+        for obj in ['foo', 'bar', 'baz']:
+            self.router(Context(), obj)
+        self.assertEqual(len(self.router.dispatch_cache), 2)
+
+    def test_add_invalidates_entries(self):
+        self.router(Context(), 'bar')
+        self.router.add('bar', lambda: 'bar')
+        self.assertEqual(len(self.router.dispatch_cache), 0)
+
+    def test_mutable_match_values_are_matched_again(self):
+        matches = []
+        def match(match, obj):
+            matches.append(obj)
+            return {'items': []}
+        r = router.Router((sentinel.match, lambda items: items.append(1)))
+        r.match = match
+        r.dispatch_cache = Cache()
+        for i in range(2):
+            context = Context()
+            r(context, 'obj')
+            self.assertEqual(context['items'], [1])
+        self.assertEqual(matches, ['obj', 'obj'])
+
+    def test_uncopyable_match_values_are_not_copied(self):
+        r = router.Router((sentinel.match, lambda lock: lock))
+        r.match = lambda match, obj: {'lock': threading.Lock()}
+        r.dispatch_cache = Cache()
+        locks = [r(Context(), 'obj') for i in range(2)]
+        self.assertIsNot(locks[0], locks[1])
+
+    def test_immutable_match_values_are_shared(self):
+        value = ('immutable', 1)
+        r = router.Router((sentinel.match, lambda: None))
+        r.match = lambda match, obj: {'value': value}
+        r.dispatch_cache = Cache()
+        for i in range(2):
+            context = Context()
+            r(context, 'obj')
+            self.assertIs(context['value'], value)
+
+    def test_matches_uncacheable_routes_again(self):
+        self.router.cache_match = lambda match: match != 'foo'
+        for i in range(3):
+            context = Context()
+            self.assertEqual(self.router(context, 'foo'), 'foo')
+            self.assertEqual(context['matched'], 'foo')
+        self.assertEqual(self.router.checked, ['foo', 'foo', 'foo'])
+        self.assertEqual(self.router.dispatch_cache.hits, 2)
+
+    def test_unhashable_objects_are_not_cached(self):
+        r = router.Router((sentinel.match, lambda: sentinel.result))
+        r.match = lambda match, obj: {}
+        r.dispatch_cache = Cache()
+        self.assertIs(r(Context(), []), sentinel.result)
+        self.assertEqual(len(r.dispatch_cache), 0)
+
+
 if __name__ == '__main__':
     unittest.main()
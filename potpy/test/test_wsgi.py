@@ -6,7 +6,9 @@ if not hasattr(unittest.TestCase, 'assertIs'):
 import re
 from mock import sentinel, Mock, patch
 
-from potpy.context import Context
+from potpy.cache import Cache
+from potpy.context import Context, LayeredContext, singleton
+from potpy.router import Route
 from potpy.template import Template
 from potpy import wsgi
 
@@ -59,6 +61,13 @@ class TestPathRouter(unittest.TestCase):
         self.context.inject(r)
         r.match.assert_called_once_with(template, sentinel.path)
 
+    def test_analyze_adds_template_parameters(self):
+        r = wsgi.PathRouter(
+            ('{foo}/{bar}', lambda foo, bar, baz: None),
+        )
+        deps = r.analyze(['path_info'])
+        self.assertEqual(deps.missing.keys(), ['baz'])
+
     def test_reverse(self):
         r = wsgi.PathRouter(
             ('hello', 'hello/{name}', lambda: Mock()()),
@@ -66,6 +75,423 @@ class TestPathRouter(unittest.TestCase):
         self.assertEqual(r.reverse('hello', name='guido'), 'hello/guido')
 
 
+class ScanningPathRouter(wsgi.PathRouter):
+    def index_key(self, template):
+        return None
+
+
+class TestStaticPaths(unittest.TestCase):
+    routes = [
+        ('/posts/{slug:[a-z]+}', lambda slug: ('slug', slug)),
+        ('/posts/new', lambda: 'new'),
+        ('/posts/42', lambda: '42'),
+        ('/posts/{id:\d+}', lambda id: ('id', id)),
+        ('/health', lambda: 'health'),
+        ('/{page}', lambda page: ('page', page)),
+        ('/about', lambda: 'about'),
+        ('/posts/42', lambda: 'shadowed'),
+    ]
+
+    def route(self, router, path):
+        ctx = Context()
+        result = router.try_route(ctx, path)
+        return result, dict(ctx)
+
+    def test_indexes_static_templates(self):
+        r = wsgi.PathRouter(*self.routes)
+        r.reindex()
+        self.assertEqual(sorted(r._index), ['/about', '/health', '/posts/42',
+                                            '/posts/new'])
+
+    def test_earlier_templates_take_precedence(self):
+        r = wsgi.PathRouter(*self.routes)
+        self.assertEqual(self.route(r, '/posts/new'),
+                         (('slug', 'new'), {'slug': 'new'}))
+        self.assertEqual(self.route(r, '/about'),
+                         (('page', 'about'), {'page': 'about'}))
+
+    def test_static_templates_take_precedence(self):
+        r = wsgi.PathRouter(*self.routes)
+        self.assertEqual(self.route(r, '/posts/42'), ('42', {}))
+        self.assertEqual(self.route(r, '/health'), ('health', {}))
+
+    def test_only_keeps_routes_matching_path(self):
+        r = wsgi.PathRouter(*self.routes)
+        r(Context(), '/health')
+        r(Context(), '/about')
+        self.assertEqual(sorted(r._kept), ['/about', '/health'])
+        self.assertEqual([entry[0].template for entry in r._kept['/health']],
+                         ['/health'])
+        self.assertEqual([entry[0].template for entry in r._kept['/about']],
+                         ['/{page}', '/about'])
+
+    def test_index_is_built_without_matching(self):
+        class CountingTemplate(Template):
+            matches = 0
+            def match(self, string):
+                CountingTemplate.matches += 1
+                return Template.match(self, string)
+        r = wsgi.PathRouter()
+        for i in xrange(100):
+            r.add('/static%d' % (i,), lambda: None)
+            r.add(CountingTemplate('/{page}/%d' % (i,)), lambda: None)
+        r.reindex()
+        self.assertEqual(r._kept, {})
+        r(Context(), '/static99')
+        self.assertEqual(CountingTemplate.matches, 0)
+
+    def test_converters_are_only_called_when_routing(self):
+        loads = []
+        r = wsgi.PathRouter(
+            (Template('/{todo}', todo=loads.append), lambda: None),
+            ('/health', lambda: None),
+        )
+        r.reindex()
+        self.assertEqual(loads, [])
+        r(Context(), '/7')
+        self.assertEqual(loads, ['7'])
+
+    def test_routes_as_scan_would(self):
+        paths = ['/posts/new', '/posts/42', '/posts/7', '/health', '/about',
+                 '/health\n', '/posts/new/', '/', '/other', '/posts/foo']
+        for combined in False, True:
+            r = wsgi.PathRouter(*self.routes)
+            r.combined = combined
+            scan = ScanningPathRouter(*self.routes)
+            for path in paths:
+                self.assertEqual(self.route(r, path), self.route(scan, path))
+
+    def test_rebuilds_after_add(self):
+        r = wsgi.PathRouter(('/health', lambda: 'health'))
+        r(Context(), '/health')
+        r.add('/status', lambda: 'status')
+        self.assertEqual(r(Context(), '/status'), 'status')
+
+
+class TestCombinedPathRouter(unittest.TestCase):
+    def router(self, *routes):
+        r = wsgi.PathRouter(*routes)
+        r.combined = True
+        return r
+
+    def test_first_match_wins(self):
+        r = self.router(
+            ('/posts/{id:\d+}', lambda id: ('id', id)),
+            ('/posts/{slug}', lambda slug: ('slug', slug)),
+        )
+        self.assertEqual(r(Context(), '/posts/42'), ('id', '42'))
+        self.assertEqual(r(Context(), '/posts/foo'), ('slug', 'foo'))
+
+    def test_extracts_parameters_of_matching_route(self):
+        r = self.router(
+            ('/{a}/{b}/x', lambda: None),
+            ('/{c}/{d}', lambda: None),
+        )
+        ctx = Context()
+        r(ctx, '/1/2')
+        self.assertEqual(dict(ctx), {'c': '1', 'd': '2'})
+
+    def test_applies_type_converters(self):
+        r = self.router(
+            (('/posts/{id:(\d)+}', {'id': int}), lambda id: id),
+        )
+        self.assertEqual(r(Context(), '/posts/42'), 42)
+
+    def test_raises_NoRoute(self):
+        r = self.router(('/posts', lambda: None))
+        with self.assertRaises(wsgi.PathRouter.NoRoute):
+            r(Context(), '/users')
+
+    def test_rebuilds_after_add(self):
+        r = self.router(('/posts/{slug}', lambda slug: slug))
+        r(Context(), '/posts/foo')
+        r.add('/users/{name}', lambda name: name.upper())
+        self.assertEqual(r(Context(), '/users/guido'), 'GUIDO')
+
+    def test_splits_many_groups(self):
+        r = self.router(*[
+            ('/r%d/{a}' % (i,), lambda a: a) for i in xrange(100)
+        ])
+        self.assertEqual(r(Context(), '/r99/x'), 'x')
+        self.assertTrue(len(r._segments) > 1)
+
+    def test_matches_backreferences_on_their_own(self):
+        r = self.router(
+            ('/{x:(.)\\2}', lambda x: ('pair', x)),
+            ('/{y}', lambda y: ('other', y)),
+        )
+        self.assertEqual(r(Context(), '/aa'), ('pair', 'aa'))
+        self.assertEqual(r(Context(), '/ab'), ('other', 'ab'))
+        self.assertIs(r._segments[0][0], None)
+
+    def test_uses_overridden_match(self):
+        template = Template('')
+        r = self.router((template, lambda: Mock()()))
+        r.match = Mock(return_value={})
+        r(Context(), sentinel.path)
+        r.match.assert_called_once_with(template, sentinel.path)
+
+
+class TestTreePathRouter(unittest.TestCase):
+    def test_matches_static_segments(self):
+        r = wsgi.TreePathRouter(
+            ('/posts', lambda: 'posts'),
+            ('/posts/new', lambda: 'new'),
+            ('', lambda: 'empty'),
+        )
+        self.assertEqual(r(Context(), '/posts/new'), 'new')
+        self.assertEqual(r(Context(), '/posts'), 'posts')
+        self.assertEqual(r(Context(), ''), 'empty')
+
+    def test_matches_parameter_segments(self):
+        r = wsgi.TreePathRouter(
+            (('/posts/{id:\d+}/v{v:\d+}', {'id': int}), lambda: None),
+        )
+        ctx = Context()
+        r(ctx, '/posts/42/v3')
+        self.assertEqual(dict(ctx), {'id': 42, 'v': '3'})
+
+    def test_first_match_wins(self):
+        r = wsgi.TreePathRouter(
+            ('/posts/{slug:[^/]+}', lambda slug: ('slug', slug)),
+            ('/posts/new', lambda: 'new'),
+            ('/{section:[^/]+}/{id:\d+}', lambda: 'section'),
+            ('/posts/{id:\d+}', lambda: 'id'),
+        )
+        self.assertEqual(r(Context(), '/posts/new'), ('slug', 'new'))
+        self.assertEqual(r(Context(), '/posts/1'), ('slug', '1'))
+        self.assertEqual(r(Context(), '/users/1'), 'section')
+
+    def test_parameters_may_match_slashes(self):
+        r = wsgi.TreePathRouter(
+            ('/files/{path}', lambda path: path),
+        )
+        self.assertEqual(r(Context(), '/files/a/b.txt'), 'a/b.txt')
+
+    def test_static_text_is_a_regex(self):
+        r = wsgi.TreePathRouter(
+            ('/robots.txt', lambda: 'robots'),
+            ('/posts/?', lambda: 'posts'),
+        )
+        self.assertEqual(r(Context(), '/robots.txt'), 'robots')
+        self.assertEqual(r(Context(), '/robots_txt'), 'robots')
+        self.assertEqual(r(Context(), '/posts/'), 'posts')
+
+    def test_raises_NoRoute(self):
+        r = wsgi.TreePathRouter(('/posts/{id:\d+}', lambda: None))
+        with self.assertRaises(wsgi.PathRouter.NoRoute):
+            r(Context(), '/posts/foo')
+
+    def test_rebuilds_after_add(self):
+        r = wsgi.TreePathRouter(('/posts', lambda: 'posts'))
+        r(Context(), '/posts')
+        r.add('/users', lambda: 'users')
+        self.assertEqual(r(Context(), '/users'), 'users')
+
+    def test_reverse(self):
+        r = wsgi.TreePathRouter(
+            ('hello', '/hello/{name:[^/]+}', lambda: None),
+        )
+        self.assertEqual(r.reverse('hello', name='guido'), '/hello/guido')
+
+    def test_routes_as_path_router_would(self):
+        routes = [
+            ('/', lambda: 'root'),
+            ('/posts/{id:\d+}', lambda id: ('id', id)),
+            ('/posts/{slug:[^/]+}/edit', lambda slug: ('edit', slug)),
+            ('/posts/new', lambda: 'new'),
+            ('/files/{path}', lambda path: ('file', path)),
+        ]
+        paths = ['/', '/\n', '/posts/42', '/posts/42\n', '/posts/foo/edit',
+                 '/posts/foo/edit\n', '/posts/new', '/posts/new\n',
+                 '/files/a/b', '/files/a/b\n', '/other', '/other\n']
+        tree = wsgi.TreePathRouter(*routes)
+        scan = wsgi.PathRouter(*routes)
+        for path in paths:
+            self.assertEqual(tree.try_route(Context(), path),
+                             scan.try_route(Context(), path))
+
+    def test_uses_overridden_match(self):
+        template = Template('')
+        r = wsgi.TreePathRouter((template, lambda: Mock()()))
+        r.match = Mock(return_value={})
+        r(Context(), sentinel.path)
+        r.match.assert_called_once_with(template, sentinel.path)
+
+
+class TestMount(unittest.TestCase):
+    def setUp(self):
+        self.posts = wsgi.PathRouter(
+            ('/posts/{slug}', lambda script_name, path_info, slug:
+                (script_name, path_info, slug)),
+            ('', lambda script_name, path_info: (script_name, path_info)),
+        )
+        self.router = wsgi.PathRouter(
+            ('/admin', lambda: 'admin'),
+        )
+
+    def test_shifts_prefix_to_script_name(self):
+        self.router.mount('/blog', self.posts)
+        self.assertEqual(self.router(Context(), '/blog/posts/foo'),
+                         ('/blog', '/posts/foo', 'foo'))
+
+    def test_appends_to_script_name(self):
+        self.router.mount('/blog', self.posts)
+        self.assertEqual(
+            self.router(Context(script_name='/app'), '/blog/posts/foo'),
+            ('/app/blog', '/posts/foo', 'foo'))
+
+    def test_matches_whole_path(self):
+        self.router.mount('/blog/', self.posts)
+        self.assertEqual(self.router(Context(), '/blog'), ('/blog', ''))
+
+    def test_matches_whole_segments(self):
+        self.router.mount('/blog', self.posts)
+        with self.assertRaises(wsgi.PathRouter.NoRoute):
+            self.router(Context(), '/blogs/posts/foo')
+
+    def test_skips_mounted_routes(self):
+        self.posts.match = Mock(wraps=self.posts.match)
+        self.router.mount('/blog', self.posts)
+        self.assertEqual(self.router(Context(), '/admin'), 'admin')
+        self.assertFalse(self.posts.match.called)
+
+    def test_nested_mounts(self):
+        inner = wsgi.PathRouter()
+        inner.mount(('/v{version:\d+}', {'version': int}), self.posts)
+        self.router.mount('/api', inner)
+        ctx = Context()
+        self.assertEqual(self.router(ctx, '/api/v2/posts/foo'),
+                         ('/api/v2', '/posts/foo', 'foo'))
+        self.assertEqual(ctx['version'], 2)
+
+    def test_raises_NoRoute_of_mounted_router(self):
+        self.router.mount('/blog', self.posts)
+        with self.assertRaises(wsgi.PathRouter.NoRoute):
+            self.router(Context(), '/blog/other')
+
+    def test_dispatches_to_mounted_router_directly(self):
+        looked_up = []
+        class SpyContext(Context):
+            def __getitem__(self, key):
+                looked_up.append(key)
+                return Context.__getitem__(self, key)
+        self.router.mount('/blog', self.posts)
+        self.assertIs(self.router._find(SpyContext(), '/blog/posts/foo'),
+                      self.posts.routes[0][1])
+        self.assertNotIn('context', looked_up)
+
+    def test_raises_NoRoute_of_mounted_method_router(self):
+        self.router.mount('/blog', wsgi.MethodRouter(('GET', lambda: None)))
+        with self.assertRaises(wsgi.MethodRouter.MethodNotAllowed):
+            self.router(Context(request_method='POST'), '/blog')
+
+    def test_reverse(self):
+        self.router.mount('blog', '/blog/{lang}', self.posts)
+        self.assertEqual(self.router.reverse('blog', lang='en'), '/blog/en')
+
+    def test_route_name(self):
+        self.router.mount('/blog/', self.posts)
+        self.assertEqual(self.router.route_name(self.router.routes[1][0]),
+                         '/blog/*')
+
+    def test_analyze_adds_shifted_paths(self):
+        self.router.mount('/{lang}', wsgi.PathRouter(
+            ('/', lambda lang, script_name: None),
+        ))
+        deps = self.router.analyze(['path_info'])
+        self.assertEqual(deps.missing, {})
+
+    def test_combined_and_tree_routers(self):
+        for cls, combined in ((wsgi.PathRouter, True),
+                              (wsgi.TreePathRouter, False)):
+            router = cls(('/blog', lambda: 'static'))
+            router.combined = combined
+            router.mount('/blog', self.posts)
+            self.assertEqual(router(Context(), '/blog/posts/foo'),
+                             ('/blog', '/posts/foo', 'foo'))
+            self.assertEqual(router(Context(), '/blog'), 'static')
+
+
+class TestPathRouterDispatchCache(unittest.TestCase):
+    def setUp(self):
+        self.loads = []
+        def load(todo_id):
+            self.loads.append(todo_id)
+            return (todo_id,)
+        self.template = Template('/todos/{todo:\d+}', todo=load)
+        self.router = wsgi.PathRouter(
+            ('/', lambda: None),
+            (self.template, lambda todo: todo),
+        )
+        self.router.dispatch_cache = Cache(maxsize=10)
+
+    def test_converters_are_cached(self):
+        results = [self.router(Context(), '/todos/1') for i in range(3)]
+        self.assertEqual(results, [('1',)] * 3)
+        self.assertEqual(self.loads, ['1'])
+        self.assertEqual(
+            (self.router.dispatch_cache.hits,
+             self.router.dispatch_cache.misses),
+            (2, 1)
+        )
+
+    def test_uncacheable_templates_convert_every_time(self):
+        self.template.cacheable = False
+        results = [self.router(Context(), '/todos/1') for i in range(3)]
+        self.assertEqual(results, [('1',)] * 3)
+        self.assertEqual(self.loads, ['1', '1', '1'])
+        self.assertEqual(self.router.dispatch_cache.hits, 2)
+
+    def test_mutable_conversions_convert_every_time(self):
+        self.template.type_converters['todo'] = lambda todo_id: (
+            self.loads.append(todo_id) or [todo_id])
+        results = [self.router(Context(), '/todos/1') for i in range(3)]
+        self.assertEqual(results, [['1']] * 3)
+        self.assertIsNot(results[1], results[2])
+        self.assertEqual(self.loads, ['1', '1', '1'])
+
+    def test_add_invalidates_entries(self):
+        self.router(Context(), '/todos/1')
+        self.router.add('/todos/{id}', lambda: None)
+        self.assertEqual(len(self.router.dispatch_cache), 0)
+
+    def test_mounts_shift_paths(self):
+        router = wsgi.PathRouter()
+        router.mount('/app', self.router)
+        router.dispatch_cache = self.router.dispatch_cache
+        for i in range(2):
+            ctx = Context()
+            self.assertEqual(router(ctx, '/app/todos/1'), ('1',))
+            self.assertEqual((ctx['script_name'], ctx['path_info']),
+                             ('/app', '/todos/1'))
+        self.assertEqual(router.dispatch_cache.hits, 2)
+
+
+class TestFlattenedRouters(unittest.TestCase):
+    def setUp(self):
+        self.router = wsgi.PathRouter(('/posts/{slug}', Route(
+            (lambda slug: slug.upper(), 'title'),
+            wsgi.MethodRouter(
+                ('GET', Route(lambda title: ('GET', title))),
+                ('POST', lambda title: ('POST', title)),
+            ),
+        )))
+        self.router.flatten()
+
+    def test_follows_method_router(self):
+        route = self.router.routes[0][1]
+        self.assertIsNot(route._flat[2], None)
+        for method in 'GET', 'POST':
+            ctx = Context(path_info='/posts/foo', request_method=method)
+            self.assertEqual(ctx.inject(self.router), (method, 'FOO'))
+
+    def test_raises_MethodNotAllowed(self):
+        ctx = Context(path_info='/posts/foo', request_method='DELETE')
+        with self.assertRaises(wsgi.MethodRouter.MethodNotAllowed):
+            ctx.inject(self.router)
+
+
 class MethodRouter(unittest.TestCase):
     def setUp(self):
         self.context = Context()
@@ -94,6 +520,19 @@ class MethodRouter(unittest.TestCase):
         self.context.inject(r)
         r.match.assert_called_once_with(sentinel.match, sentinel.method)
 
+    def test_only_checks_routes_for_the_method(self):
+        r = wsgi.MethodRouter(
+            ('GET', lambda: 'get'),
+            (('GET', 'POST'), lambda: 'get or post'),
+            ('POST', lambda: 'post'),
+        )
+        r.match = Mock(wraps=r.match)
+        self.assertEqual(r(self.context, 'POST'), 'get or post')
+        self.assertEqual(
+            [args[0][0] for args in r.match.call_args_list],
+            [('GET', 'POST')]
+        )
+
     def test_NoRoute_is_subclass(self):
         self.assertTrue(issubclass(
             wsgi.MethodRouter.MethodNotAllowed, wsgi.Router.NoRoute))
@@ -221,6 +660,34 @@ class TestApp(unittest.TestCase):
         not_allowed.return_value.assert_called_once_with(
             self.environ, sentinel.start_response)
 
+    def test_routers_miss_without_raising(self):
+        router = wsgi.PathRouter(('/foo', lambda: sentinel.app))
+        router.NoRoute = Mock(wraps=router.NoRoute)
+        app = wsgi.App(router)
+        self.environ['PATH_INFO'] = '/bar'
+        with patch.object(app, 'not_found') as not_found:
+            self.assertIs(
+                app(self.environ, sentinel.start_response),
+                not_found.return_value
+            )
+        router.NoRoute.assert_called_once_with('/bar')
+
+    def test_method_routers_miss_without_raising(self):
+        app = wsgi.App(wsgi.MethodRouter((('GET',), lambda: sentinel.app)))
+        self.environ['REQUEST_METHOD'] = 'POST'
+        with patch.object(app, 'method_not_allowed') as not_allowed:
+            app(self.environ, sentinel.start_response)
+        not_allowed.assert_called_once_with('POST', ['GET'])
+
+    def test_nested_router_misses_are_still_handled(self):
+        app = wsgi.App(wsgi.PathRouter(
+            ('/foo', wsgi.MethodRouter((('GET',), lambda: sentinel.app))),
+        ))
+        self.environ.update(PATH_INFO='/foo', REQUEST_METHOD='POST')
+        with patch.object(app, 'method_not_allowed') as not_allowed:
+            app(self.environ, sentinel.start_response)
+        not_allowed.assert_called_once_with('POST', ['GET'])
+
     def test_can_specify_default_context(self):
         router = Mock()
         app = wsgi.App(
@@ -233,6 +700,77 @@ class TestApp(unittest.TestCase):
         app(self.environ, sentinel.start_response),
         router.assert_called_once_with(sentinel.extra1, sentinel.extra2)
 
+    def test_honours_lifetimes_in_default_context(self):
+        build_shared = Mock(side_effect=lambda: object())
+        build_request = Mock(side_effect=lambda environ: object())
+        seen = []
+        def handler(shared, request, other_request):
+            seen.append((shared, request, other_request))
+            return Mock()
+        app = wsgi.App(
+            lambda context: context.inject(handler),
+            {
+                'shared': singleton(lambda: build_shared()),
+                'request': lambda environ: build_request(environ),
+                'other_request': lambda request: request,
+            }
+        )
+        app(self.environ, sentinel.start_response)
+        app(self.environ, sentinel.start_response)
+        self.assertEqual(build_shared.call_count, 1)
+        self.assertEqual(build_request.call_count, 2)
+        (shared1, request1, other1), (shared2, request2, other2) = seen
+        self.assertIs(shared1, shared2)
+        self.assertIsNot(request1, request2)
+        self.assertIs(request1, other1)
+
+    def test_adds_script_name_to_context(self):
+        router = Mock()
+        app = wsgi.App(lambda script_name: router(script_name))
+        app(self.environ, sentinel.start_response)
+        router.assert_called_once_with('')
+        router.reset_mock()
+        self.environ['SCRIPT_NAME'] = '/app'
+        app(self.environ, sentinel.start_response)
+        router.assert_called_once_with('/app')
+
+    def test_does_not_modify_default_context(self):
+        default_context = {'extra': lambda: sentinel.extra}
+        def handler(context, extra):
+            context['extra'] = sentinel.overridden
+            return Mock()
+        app = wsgi.App(handler, default_context)
+        app(self.environ, sentinel.start_response)
+        app(self.environ, sentinel.start_response)
+        self.assertEqual(default_context.keys(), ['extra'])
+        self.assertIs(default_context['extra'](), sentinel.extra)
+
+    def test_nested_routers_share_default_context(self):
+        app = wsgi.App(
+            wsgi.PathRouter(('/', wsgi.MethodRouter(
+                ('GET', lambda db: db)))),
+            {'db': lambda: Mock()},
+        )
+        self.environ.update(PATH_INFO='/', REQUEST_METHOD='GET')
+        with patch.object(LayeredContext, '_flatten') as flatten:
+            app(self.environ, sentinel.start_response)
+        self.assertFalse(flatten.called)
+
+    def test_context_item_includes_default_context(self):
+        seen = []
+        def handler(context):
+            seen.append(dict(context))
+            seen.append(Context(context))
+            seen.append((lambda **kwargs: kwargs)(**context))
+            return Mock()
+        app = wsgi.App(handler, {'db': sentinel.db})
+        app(self.environ, sentinel.start_response)
+        expected = ['db', 'environ', 'path_info', 'request_method',
+                    'script_name']
+        for mapping in seen:
+            self.assertEqual(sorted(mapping), expected)
+            self.assertIs(mapping['db'], sentinel.db)
+
 
 if __name__ == '__main__':
     unittest.main()
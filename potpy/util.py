@@ -12,7 +12,7 @@ def rename_args(func, argnames):
             c.co_code,
             c.co_consts,
             c.co_names,
-            argnames,
+            tuple(argnames) + c.co_varnames[len(argnames):],
             c.co_filename,
             c.co_name,
             c.co_firstlineno,
@@ -4,12 +4,72 @@ This module provides classes for creating WSGI (:pep:`333`) applications.
 For a simple example, see ``examples/wsgi.py``. For a more complete example,
 see ``examples/todo``.
 """
-from .router import Router
-from .template import Template
-from .context import Context
+import re
+import sre_parse
+from itertools import islice
+from sre_constants import (LITERAL, NOT_LITERAL, IN, NEGATE, RANGE,
+                           CATEGORY, CATEGORY_NOT_DIGIT, CATEGORY_NOT_SPACE,
+                           CATEGORY_NOT_WORD, MAX_REPEAT, MIN_REPEAT,
+                           SUBPATTERN, BRANCH)
+
+from .router import Router, _dispatch_arg
+from .template import Template, _parse, _make_pattern
+from .context import LayeredContext
 from .util import rename_args
 
 
+class PathPrefix(object):
+    """
+    A path template matching the start of a path, for
+    :meth:`PathRouter.mount`.
+
+    Matches like a :class:`~potpy.template.Template`, except that the
+    template only has to match up to a ``/`` in the path, or its end. The
+    rest of the path is returned as ``path_info``, along with the template
+    parameters:
+
+        >>> from pprint import pprint
+        >>> prefix = PathPrefix('/users/{user_id:\d+}', user_id=int)
+        >>> pprint(prefix.match('/users/42/posts'))
+        {'path_info': '/posts', 'user_id': 42}
+        >>> pprint(prefix.match('/users/42'))
+        {'path_info': '', 'user_id': 42}
+        >>> prefix.match('/users/42x')
+
+    A trailing ``/`` in the template is ignored.
+    """
+    #: See :attr:`potpy.template.Template.cacheable`.
+    cacheable = True
+
+    def __init__(self, template, **type_converters):
+        self.template = template
+        self.type_converters = type_converters
+        self._template = Template(template.rstrip('/'), **type_converters)
+        # Template patterns end with $
+        self.regex = re.compile(
+            self._template.regex.pattern[:-1] + '(?=/|$)')
+
+    def match(self, string):
+        """Match the start of a string against the template.
+
+        Returns a dict of the template parameters and the rest of the
+        string, as ``path_info``, or ``None`` if the string doesn't start
+        with a match.
+        """
+        m = self.regex.match(string)
+        if m is None:
+            return None
+        c = self.type_converters
+        params = dict((k, c[k](v) if k in c else v)
+                      for k, v in m.groupdict().iteritems())
+        params['path_info'] = string[m.end():]
+        return params
+
+    def fill(self, **kwargs):
+        """Fill the template with the given parameters."""
+        return self._template.fill(**kwargs)
+
+
 class PathRouter(Router):
     """
     Route by URL/path.
@@ -31,7 +91,34 @@ class PathRouter(Router):
 
     Routes can also be named, allowing reverse path lookup and filling of path
     parameters. See :meth:`reverse` for details.
+
+    Another router can be mounted under a path prefix, to route the rest of
+    the path. See :meth:`mount`.
     """
+    #: If true, match paths against all the templates at once, with one
+    #: combined regular expression, rather than against each template in
+    #: turn. The first matching route still wins.
+    #: Python limits the number of groups in a regular expression, so large
+    #: routers are split into a few combined expressions. Templates using
+    #: backreferences, conditionals or inline flags are matched on their
+    #: own. Has no effect if :meth:`match` is overridden.
+    combined = False
+
+    # The combined regular expressions, built on the first call after routes
+    # are added: a list of (regex, targets) tuples, where targets maps the
+    # group number of each alternative to its (match, route) entry, the
+    # group numbers of its parameters, and its type converters. A regex of
+    # None stands for a single entry to check with match().
+    _segments = None
+
+    # The routes to check for each static path requested since the index was
+    # built (see _keep).
+    _kept = None
+
+    # Maps the routes of mounted routers to the router, if it can be
+    # dispatched to directly (see _find), or None.
+    _mounts = {}
+
     def __init__(self, *routes):
         self._templates = {}
         super(PathRouter, self).__init__(*routes)
@@ -64,6 +151,61 @@ class PathRouter(Router):
             self._templates[name] = template
         super(PathRouter, self).add(template, *args)
 
+    def mount(self, *args):
+        """Route paths starting with a prefix to another router.
+
+        The prefix is checked once for each path. Paths starting with it
+        (followed by a ``/`` or nothing) are routed by the mounted router,
+        after moving the matched part of ``path_info`` in the context to the
+        end of ``script_name``, as a WSGI server would for an application
+        mounted there. Other paths skip the mounted router's routes
+        altogether. A mounted :class:`~potpy.router.Router` isn't called
+        itself: the route it finds is called directly.
+
+            >>> from potpy.context import Context
+            >>> api = PathRouter(
+            ...     ('/posts/{slug}', lambda script_name, path_info, slug:
+            ...         (script_name, path_info, slug)),
+            ... )
+            >>> router = PathRouter()
+            >>> router.mount('api', '/api/v{version:\d+}', api)
+            >>> ctx = Context(path_info='/api/v2/posts/foo')
+            >>> ctx.inject(router)
+            ('/api/v2', '/posts/foo', 'foo')
+            >>> ctx['version']
+            '2'
+            >>> router.reverse('api', version=3)
+            '/api/v3'
+
+        The ``environ`` isn't changed.
+
+        :param name: Optional. If specified, allows reverse lookup of the
+            prefix with :meth:`reverse`.
+        :param prefix: A string or :class:`PathPrefix` instance used to match
+            the start of paths. Strings (or ``(string, type_converters)``
+            tuples, as for :meth:`add`) will be wrapped in a PathPrefix
+            instance.
+        :param router: The router, usually another PathRouter, to call for
+            matching paths.
+        """
+        if len(args) > 2:
+            name, prefix, router = args
+        else:
+            name = None
+            prefix, router = args
+        if isinstance(prefix, tuple):
+            prefix, type_converters = prefix
+            prefix = PathPrefix(prefix, **type_converters)
+        elif not isinstance(prefix, PathPrefix):
+            prefix = PathPrefix(prefix)
+        if name:
+            self._templates[name] = prefix
+        super(PathRouter, self).add(prefix, router)
+        mounts = dict(self._mounts)
+        mounts[self.routes[-1][1]] = router if isinstance(router, Router) \
+            and _dispatch_arg(router) is not None else None
+        self._mounts = mounts
+
     def match(self, template, path_info):
         """Check for a path match.
 
@@ -82,9 +224,166 @@ class PathRouter(Router):
         """
         return template.match(path_info)
 
+    def match_keys(self, template):
+        """List the template's parameter names.
+
+            >>> from potpy.template import Template
+            >>> PathRouter().match_keys(Template('/posts/{slug}'))
+            ['slug']
+        """
+        keys = template.regex.groupindex.keys()
+        if isinstance(template, PathPrefix):
+            keys.extend(['path_info', 'script_name'])
+        return keys
+
     __call__ = rename_args(Router.__call__, (
         'self', 'context', 'path_info'))
 
+    def _find(self, context, path_info):
+        route = super(PathRouter, self)._find(context, path_info)
+        if route is not None and route in self._mounts:
+            # the match left the rest of the path in path_info
+            rest = context['path_info']
+            context['script_name'] = context.get('script_name', '') + \
+                path_info[:len(path_info) - len(rest)]
+            # rather than calling the route, which calls the router, find
+            # the router's route
+            router = self._mounts[route]
+            if router is not None:
+                route = router._find(context, rest)
+                if route is None:
+                    raise router.NoRoute(rest)
+        return route
+
+    def index_key(self, template):
+        """Index templates without parameters by their path.
+
+        Only templates whose text has no regular expression syntax are
+        indexed, so that a path matches them exactly when it equals the
+        text. Requests for such a path are routed with a dict lookup,
+        checking only the routes added before it that match the path.
+
+            >>> from potpy.template import Template
+            >>> PathRouter().index_key(Template('/health'))
+            '/health'
+            >>> PathRouter().index_key(Template('/posts/{slug}'))
+            >>> PathRouter().index_key(Template('/robots.txt'))
+        """
+        if isinstance(template, Template) and self._stock_match() and \
+                _plain.match(template.template):
+            return template.template
+        return None
+
+    def cache_match(self, template):
+        """Keep the parameters of a template in the
+        :attr:`~potpy.router.Router.dispatch_cache` unless its ``cacheable``
+        attribute is false.
+
+        Type converters are called once for each cached path, and their
+        results reused if they're immutable (otherwise the template is
+        matched again). Set ``cacheable = False`` on templates whose
+        converters must be called for every request, such as ones that look
+        the parameter up somewhere:
+
+            >>> from potpy.cache import Cache
+            >>> from potpy.context import Context
+            >>> from potpy.template import Template
+            >>> loads = []
+            >>> def load(todo_id):
+            ...     loads.append(todo_id)
+            ...     return 'todo %s' % (todo_id,)
+            ...
+            >>> template = Template('/{todo}', todo=load)
+            >>> template.cacheable = False
+            >>> router = PathRouter((template, lambda todo: todo))
+            >>> router.dispatch_cache = Cache(maxsize=1000)
+            >>> router(Context(), '/1'), router(Context(), '/1')
+            ('todo 1', 'todo 1')
+            >>> loads
+            ['1', '1']
+            >>> router.dispatch_cache.hits, router.dispatch_cache.misses
+            (1, 1)
+        """
+        return getattr(template, 'cacheable', True)
+
+    def lookup_key(self, path_info):
+        """Look up routes by path."""
+        if path_info.endswith('\n'):
+            # $ also matches before a trailing newline
+            return None
+        return path_info
+
+    def _stock_match(self):
+        return getattr(self.match, 'im_func', None) is PathRouter.match.im_func
+
+    def _build_index(self):
+        super(PathRouter, self)._build_index()
+        self._segments = None
+        self._kept = {}
+
+    def _keep(self, path_info):
+        # A request for a static path can only match the routes before its
+        # own that match the path, and always matches its own, so keep just
+        # those. Only their regexes are checked here, so that type converters
+        # are called when routing, and not before.
+        stop, entry = self._index[path_info][0]
+        kept = []
+        for other in islice(self._unindexed, stop):
+            regex = getattr(other[0], 'regex', None)
+            if regex is None or regex.match(path_info) is not None:
+                kept.append(other)
+        kept.append(entry)
+        self._kept[path_info] = kept
+        return kept
+
+    def _dispatch(self, path_info):
+        index = self._index
+        if index is None:
+            self._build_index()
+            index = self._index
+        if index:
+            # the routes kept for the path itself, found on its first lookup
+            entries = self._kept.get(path_info)
+            if entries is None and path_info in index:
+                entries = self._keep(path_info)
+            if entries is not None:
+                for entry in entries[:-1]:
+                    m = self.match(entry[0], path_info)
+                    if m is not None:
+                        return entry, m
+                return entries[-1], {}
+        # With combined, find the matching route with one regex match for
+        # each segment, instead of one for each route.
+        if not self.combined or not self._stock_match():
+            return super(PathRouter, self)._dispatch(path_info)
+        segments = self._segments
+        if segments is None:
+            segments = self._segments = _combine(self.routes)
+        for regex, targets in segments:
+            if regex is None:
+                m = targets[0].match(path_info)
+                if m is not None:
+                    return targets, m
+                continue
+            found = regex.match(path_info)
+            if found is not None:
+                entry, groups, converters = targets[found.lastindex]
+                m = {}
+                for name, group in groups:
+                    value = found.group(group)
+                    if name in converters:
+                        value = converters[name](value)
+                    m[name] = value
+                return entry, m
+
+    def route_name(self, template):
+        """Name a route by its path template, followed by ``/*`` for mounted
+        routers.
+        """
+        if isinstance(template, PathPrefix):
+            return template.template.rstrip('/') + '/*'
+        return template.template
+
     def reverse(self, *args, **kwargs):
         """Look up a path by name and fill in the provided parameters.
 
@@ -99,6 +398,360 @@ class PathRouter(Router):
         return self._templates[name].fill(**kwargs)
 
 
+# Python 2 allows no more than 99 groups in one regular expression (100,
+# counting the whole match).
+_MAX_GROUPS = 99
+
+# Constructs that mean a pattern can't be combined with others: numbered and
+# named backreferences, conditionals and (global) inline flags.
+_uncombinable = re.compile(
+    r'(?<!\\)(?:\\\\)*\\[1-9]|\(\?P=|\(\?\(|\(\?[iLmsux]+\)')
+
+_group_name = re.compile(r'(?<!\\)((?:\\\\)*)\(\?P<\w+>')
+
+
+def _combinable(template):
+    # Return the template's pattern with its groups unnamed, or None.
+    pattern = template.regex.pattern
+    if template.regex.flags & ~(re.U | re.L) or \
+            _uncombinable.search(pattern):
+        return None
+    pattern = _group_name.sub(r'\1(', pattern)
+    try:
+        if re.compile(pattern).groups != template.regex.groups:
+            return None
+    except re.error:
+        return None
+    return pattern
+
+
+def _combine(routes):
+    # Build PathRouter._segments from a list of (template, route) entries.
+    segments = []
+    alternatives = []
+    targets = {}
+    groups = 0
+    def flush():
+        if alternatives:
+            segments.append((re.compile('|'.join(alternatives)), targets))
+    for entry in routes:
+        template = entry[0]
+        pattern = None
+        if isinstance(template, Template):
+            pattern = _combinable(template)
+        if pattern is None:
+            flush()
+            alternatives, targets, groups = [], {}, 0
+            segments.append((None, entry))
+            continue
+        size = template.regex.groups + 1
+        if groups + size > _MAX_GROUPS:
+            flush()
+            alternatives, targets, groups = [], {}, 0
+        offset = groups + 1
+        alternatives.append('(%s)' % (pattern,))
+        targets[offset] = (entry, [
+            (name, offset + group)
+            for name, group in template.regex.groupindex.iteritems()
+        ], template.type_converters)
+        groups += size
+    flush()
+    return segments
+
+
+class TreePathRouter(PathRouter):
+    """
+    Route by URL/path, finding routes in a tree of path segments.
+
+    A drop-in replacement for :class:`PathRouter`, for routers with many
+    routes: paths match the same routes, with the same parameters, and
+    :meth:`~PathRouter.reverse` works the same way. Templates are split on
+    ``/`` into a tree, so that finding a route costs about as much as the
+    path is deep, rather than one regular expression match for each route.
+
+        >>> from potpy.context import Context
+        >>> router = TreePathRouter(
+        ...     ('/posts/{id:\d+}', lambda id: ('post', id)),
+        ...     ('/posts/{slug:[^/]+}/edit', lambda slug: ('edit', slug)),
+        ...     ('users', '/users/{name:[^/]+}', lambda name: name),
+        ... )
+        >>> router(Context(), '/posts/42')
+        ('post', '42')
+        >>> router(Context(), '/posts/foo/edit')
+        ('edit', 'foo')
+        >>> router.reverse('users', name='guido')
+        '/users/guido'
+
+    Plain segments (like ``posts``) are looked up in a dict. Segments with
+    parameters are matched one segment at a time, which only works if the
+    parameters' regular expressions can't match a ``/`` (``\d+`` and
+    ``[^/]+`` can't, but the default, ``.*``, can). The rest of a template,
+    from the first segment that can't be matched on its own, is matched as a
+    regular expression against the rest of the path. So is all of a template
+    that uses inline flags, or alternatives or anchors in its static text
+    (and any ``match`` argument that isn't a
+    :class:`~potpy.template.Template`). A template like ``/posts/{slug}``
+    still only costs one match, against paths starting ``/posts/``.
+
+    Has the same effect as :class:`PathRouter` if :meth:`match` is
+    overridden. The :attr:`~PathRouter.combined` attribute is ignored.
+    """
+    # The root _Node of the tree, built on the first call after routes are
+    # added.
+    _tree = None
+
+    def _build_index(self):
+        super(TreePathRouter, self)._build_index()
+        self._tree = None
+
+    def _dispatch(self, path_info):
+        # $ also matches before a trailing newline, which splitting the path
+        # into segments doesn't allow for, so scan for such paths
+        if not self._stock_match() or path_info.endswith('\n'):
+            return Router._dispatch(self, path_info)
+        if self._index is None:
+            self._build_index()
+        tree = self._tree
+        if tree is None:
+            tree = self._tree = _build_tree(self.routes)
+        found = tree.find(path_info.split('/'), 0, len(tree.order))
+        if found is None:
+            return None
+        index, m = found
+        entry = tree.order[index]
+        template = entry[0]
+        if isinstance(template, Template):
+            c = template.type_converters
+            for k in c:
+                if k in m:
+                    m[k] = c[k](m[k])
+        return entry, m
+
+
+_SLASH = ord('/')
+
+_NOT_CATEGORIES = (CATEGORY_NOT_DIGIT, CATEGORY_NOT_SPACE, CATEGORY_NOT_WORD)
+
+# Characters with no special meaning in the regex of a template's static
+# text (see potpy.template).
+_plain = re.compile(r'[^.^$*+?()\[\]{}|\\]*$')
+
+
+def _set_has_slash(items):
+    negate = found = False
+    for op, av in items:
+        if op is NEGATE:
+            negate = True
+        elif op is LITERAL:
+            found = found or av == _SLASH
+        elif op is RANGE:
+            found = found or av[0] <= _SLASH <= av[1]
+        elif op is CATEGORY:
+            found = found or av in _NOT_CATEGORIES
+        else:
+            return True
+    return found != negate
+
+
+def _never_slash(items):
+    # Whether a parsed regex can only match text without a slash, and
+    # doesn't look beyond what it matches (so it matches a segment the same
+    # way on its own as within a path).
+    for op, av in items:
+        if op is LITERAL:
+            if av == _SLASH:
+                return False
+        elif op is IN:
+            if _set_has_slash(av):
+                return False
+        elif op is MAX_REPEAT or op is MIN_REPEAT:
+            if not _never_slash(av[2]):
+                return False
+        elif op is SUBPATTERN:
+            if not _never_slash(av[1]):
+                return False
+        elif op is BRANCH:
+            for branch in av[1]:
+                if not _never_slash(branch):
+                    return False
+        else:
+            # NOT_LITERAL, ANY, anchors, lookarounds, backreferences...
+            if op is not NOT_LITERAL or av != _SLASH:
+                return False
+    return True
+
+
+def _segment_param(regex):
+    try:
+        return _never_slash(sre_parse.parse(regex))
+    except Exception:
+        return False
+
+
+# Static text that affects how the rest of a template's regex matches: top
+# level alternatives, anchors and lookbehinds.
+_entangled = re.compile(r'\||\^|\(\?<')
+
+
+def _self_contained(regex):
+    # Whether a piece of a template's static text means the same on its own
+    # as it does within the template.
+    try:
+        sre_parse.parse(regex)
+    except Exception:
+        return False
+    return True
+
+
+def _split_template(template):
+    # Split a template into a list of segments, each a list of (regex, name)
+    # parts without a slash, and the parts left over to match the rest of
+    # the path with (or None).
+    parsed = _parse(template.template)
+    if template.regex.flags & ~(re.U | re.L) or \
+            re.search(r'\(\?[iLmsux]+\)', template.regex.pattern) or \
+            any(_entangled.search(part) for part, name in parsed if not name):
+        return [], parsed
+    segments = []
+    current = []
+    for i, (part, name) in enumerate(parsed):
+        if name is not None:
+            if not _segment_param(part):
+                return segments, current + parsed[i:]
+            current.append((part, name))
+            continue
+        pieces = part.split('/')
+        plain = [bool(_plain.match(piece)) for piece in pieces]
+        split = len(pieces)
+        if not all(plain):
+            # split before the first piece that isn't plain, or earlier if
+            # the text from there on doesn't make sense by itself
+            split = plain.index(False)
+            while split and not _self_contained('/'.join(pieces[split:])):
+                split -= 1
+            if not split and not _self_contained(part):
+                return [], parsed
+        for j, piece in enumerate(pieces[:split]):
+            if j:
+                segments.append(current)
+                current = []
+            if piece:
+                current.append((piece, None))
+        if split < len(pieces):
+            if split:
+                segments.append(current)
+                current = []
+            return segments, current + [('/'.join(pieces[split:]), None)] \
+                + parsed[i + 1:]
+    segments.append(current)
+    return segments, None
+
+
+class _Node(object):
+    """A segment of the path templates in a TreePathRouter."""
+    __slots__ = ('first', 'leaf', 'static', 'dynamic', 'rest', 'order')
+
+    def __init__(self):
+        # The position of the first route in or under the node.
+        self.first = None
+        # The position of the first route ending at the node.
+        self.leaf = None
+        # Plain next segments, mapped to their nodes.
+        self.static = {}
+        # (regex, node) tuples for next segments with parameters.
+        self.dynamic = []
+        # (position, regex or match) tuples for routes matching the rest of
+        # the path, in order.
+        self.rest = []
+
+    def add(self, index, segments, rest):
+        node = self
+        for segment in segments:
+            if node.first is None:
+                node.first = index
+            if all(name is None for part, name in segment):
+                key = ''.join(part for part, name in segment)
+                child = node.static.get(key)
+                if child is None:
+                    child = node.static[key] = _Node()
+            else:
+                pattern = _make_pattern(segment)
+                for regex, child in node.dynamic:
+                    if regex.pattern == pattern:
+                        break
+                else:
+                    child = _Node()
+                    node.dynamic.append((re.compile(pattern), child))
+            node = child
+        if node.first is None:
+            node.first = index
+        if rest is None:
+            if node.leaf is None:
+                node.leaf = index
+        else:
+            node.rest.append((index, rest))
+
+    def find(self, parts, depth, limit):
+        # Find the first route under the node, before position limit,
+        # matching the parts of the path from depth on. Returns the route's
+        # position and parameters, or None.
+        if self.first is None or self.first >= limit:
+            return None
+        best = None
+        if depth == len(parts):
+            if self.leaf is not None and self.leaf < limit:
+                return self.leaf, {}
+            return None
+        segment = parts[depth]
+        child = self.static.get(segment)
+        if child is not None:
+            found = child.find(parts, depth + 1, limit)
+            if found is not None:
+                best = found
+                limit = found[0]
+        for regex, child in self.dynamic:
+            if child.first >= limit:
+                continue
+            m = regex.match(segment)
+            if m is not None:
+                found = child.find(parts, depth + 1, limit)
+                if found is not None:
+                    found[1].update(m.groupdict())
+                    best = found
+                    limit = found[0]
+        if self.rest:
+            rest = None
+            for index, regex in self.rest:
+                if index >= limit:
+                    break
+                if rest is None:
+                    rest = '/'.join(parts[depth:])
+                if callable(regex):
+                    m = regex(rest)
+                else:
+                    m = regex.match(rest)
+                    if m is not None:
+                        m = m.groupdict()
+                if m is not None:
+                    return index, m
+        return best
+
+
+def _build_tree(routes):
+    root = _Node()
+    root.order = routes
+    for index, entry in enumerate(routes):
+        template = entry[0]
+        if not isinstance(template, Template):
+            root.add(index, [], template.match)
+            continue
+        segments, rest = _split_template(template)
+        if rest is not None:
+            rest = re.compile(_make_pattern(rest))
+        root.add(index, segments, rest)
+    return root
+
+
 class MethodRouter(Router):
     """
     Route by request method.
@@ -151,9 +804,27 @@ class MethodRouter(Router):
             return {} if request_method == methods else None
         return {} if request_method in methods else None
 
+    def index_key(self, methods):
+        """Index routes for a single method by that method. Routes for a
+        tuple of methods are checked for every method.
+        """
+        if isinstance(methods, basestring):
+            return methods
+        return None
+
+    def lookup_key(self, request_method):
+        """Look up routes by request method."""
+        return request_method
+
     __call__ = rename_args(Router.__call__, (
         'self', 'context', 'request_method'))
 
+    def route_name(self, methods):
+        """Name a route by its request methods."""
+        if isinstance(methods, basestring):
+            return methods
+        return ', '.join(methods)
+
 
 class App(object):
     """Wrap a potpy router in a WSGI application.
@@ -169,8 +840,13 @@ class App(object):
     requests.
 
     Calls the provided router with a context containing ``environ``,
-    ``path_info``, and ``request_method`` fields, and any fields from the
-    optional ``default_context`` argument.
+    ``script_name``, ``path_info``, and ``request_method`` fields, and any
+    fields from the optional ``default_context`` argument.
+
+    Callable items in ``default_context`` are called once per request by
+    default. Wrap them in :class:`~potpy.context.singleton` or
+    :class:`~potpy.context.per_thread` to build them once and share them
+    between requests; see :class:`~potpy.context.Lifetime`.
 
     :param router: The router to call in response to WSGI requests.
     :param default_context: Optional. A :class:`dict`-like mapping of extra
@@ -240,24 +916,46 @@ class App(object):
     def __call__(self, environ, start_response):
         """Call the router as a WSGI app.
 
-        Constructs a :class:`~potpy.context.Context` object with ``environ``,
-        ``path_info``, and ``request_method`` (extracted from the environ),
-        and any fields supplied in ``self.default_context``.
+        Constructs a :class:`~potpy.context.LayeredContext` object with
+        ``environ``, ``script_name``, ``path_info``, and ``request_method``
+        (extracted from the environ), layered over ``self.default_context``.
+        The default context is shared between requests, only copied for
+        handlers that take the ``context`` itself, and never modified.
 
         Calls the result of the router call as a WSGI app.
+
+        When the router is a :class:`~potpy.router.Router`, it is called
+        with :meth:`~potpy.router.Router.try_route`, so that a request no
+        route matches doesn't raise an exception.
         """
-        context = Context(
+        context = LayeredContext(
             self.default_context,
             environ=environ,
+            script_name=environ.get('SCRIPT_NAME', ''),
             path_info=environ['PATH_INFO'],
             request_method=environ['REQUEST_METHOD']
         )
+        router = self.router
+        arg = _dispatch_arg(router) if isinstance(router, Router) else None
         try:
-            response = context.inject(self.router)
-        except MethodRouter.MethodNotAllowed, exc:
-            return self.method_not_allowed(
-                exc.request_method, exc.allowed_methods
-            )(environ, start_response)
-        except PathRouter.NoRoute:
-            return self.not_found(environ, start_response)
+            if arg is None:
+                response = context.inject(router)
+            else:
+                obj = context[arg]
+                response = router.try_route(context, obj)
+                if response is router.Miss:
+                    response = self.no_route(router.NoRoute(obj))
+        except Router.NoRoute, exc:
+            response = self.no_route(exc)
         return response(environ, start_response)
+
+    def no_route(self, exc):
+        """Return the WSGI app responding to a request no route matched.
+
+        :param exc: The :exc:`~potpy.router.Router.NoRoute` exception (raised
+            or not) describing the miss.
+        """
+        if isinstance(exc, MethodRouter.MethodNotAllowed):
+            return self.method_not_allowed(
+                exc.request_method, exc.allowed_methods)
+        return self.not_found
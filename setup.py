@@ -22,6 +22,7 @@ setup_args = dict(
     test_suite='potpy.test',
     test_loader='potpy.test.loader:Loader',
     tests_require=['mock'],
+    extras_require={'asyncio': ['trollius'], 'futures': ['futures']},
 )
 
 if __name__ == '__main__':